@@ -0,0 +1,449 @@
+"""
+Benchmark the file indexing functions on reproducible synthetic directory trees.
+
+Each benchmark reports the wall time, files per second and the number of calls to os functions
+like os.stat or os.scandir and to methods of the DirEntry objects, see SyscallCounter. Results
+are appended to a JSONL file, so runs of different versions of the package can be compared.
+
+Examples:
+    python -m packg.benchmarks.indexing -o results.jsonl
+    python -m packg.benchmarks.indexing --fanout 8 --depth 4 --files_per_dir 50 -b make_index
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Optional
+
+from attrs import asdict, define, field
+from loguru import logger
+
+import packg
+from packg import Const
+from packg.iotools.file_indexer import make_index, regex_glob
+from packg.iotools.folder import Folder
+from packg.iotools.pathspec_matcher import apply_pathspecs, make_pathspecs_from_args
+from packg.log import SHORTEST_FORMAT, configure_logger, get_logger_level_from_args
+from packg.typext import PathType
+from typedparser import TypedParser, VerboseQuietArgs, add_argument
+
+
+class BenchmarkC(Const):
+    MAKE_INDEX = "make_index"
+    MAKE_INDEX_WORKERS = "make_index_workers"
+    MAKE_INDEX_PATHSPECS = "make_index_pathspecs"
+    REGEX_GLOB = "regex_glob"
+    FOLDER_POPULATE = "folder_populate"
+    FOLDER_POPULATE_WORKERS = "folder_populate_workers"
+    APPLY_PATHSPECS = "apply_pathspecs"
+
+
+@define
+class TreeSpec:
+    """
+    Shape of a synthetic tree. The tree only depends on these values, including the seed.
+
+    Args:
+        fanout: number of subdirectories per directory
+        depth: number of directory levels below the root
+        files_per_dir: number of files per directory
+        max_file_size: files get a random size between 0 and this many bytes
+        num_symlinks: number of symlinks to random files and directories
+        ignored_dir_ratio: fraction of directories named like build output, e.g. "build"
+        seed: random seed
+        extensions: file extensions, each file gets a random one. The first file of each
+            directory is always named "keep.log"
+        exclude_git: git-like pathspecs to exclude files, used by the pathspec benchmarks
+    """
+
+    fanout: int = 4
+    depth: int = 3
+    files_per_dir: int = 20
+    max_file_size: int = 0
+    num_symlinks: int = 10
+    ignored_dir_ratio: float = 0.1
+    seed: int = 0
+    extensions: tuple[str, ...] = (".txt", ".jpg", ".json", ".py", ".pyc", ".log")
+    exclude_git: tuple[str, ...] = ("*.pyc", "*.log", "build/", "__pycache__/", "!keep.log")
+
+
+def create_synthetic_tree(root: PathType, spec: TreeSpec) -> dict[str, int]:
+    """
+    Create a synthetic directory tree.
+
+    Args:
+        root: directory to create the tree in, must be empty or not exist
+        spec: shape of the tree
+
+    Returns:
+        counts of created dirs, files and symlinks
+    """
+    rng = random.Random(spec.seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    dirs, files = [root], []
+    level_dirs = [root]
+    for level in range(spec.depth):
+        next_level_dirs = []
+        for parent in level_dirs:
+            for i in range(spec.fanout):
+                if rng.random() < spec.ignored_dir_ratio:
+                    name = rng.choice(["build", "__pycache__"])
+                    name = name if i == 0 else f"{name}{i}"
+                else:
+                    name = f"dir_{level}_{i}"
+                new_dir = parent / name
+                new_dir.mkdir()
+                next_level_dirs.append(new_dir)
+        dirs += next_level_dirs
+        level_dirs = next_level_dirs
+    for directory in dirs:
+        for i in range(spec.files_per_dir):
+            name = "keep.log" if i == 0 else f"file_{i}{rng.choice(spec.extensions)}"
+            file = directory / name
+            size = rng.randint(0, spec.max_file_size)
+            file.write_bytes(b"x" * size)
+            files.append(file)
+    num_symlinks = 0
+    for i in range(spec.num_symlinks):
+        target = rng.choice(files) if i % 2 == 0 or len(dirs) < 2 else rng.choice(dirs[1:])
+        link = rng.choice(dirs) / f"link_{i}"
+        link.symlink_to(target, target_is_directory=target.is_dir())
+        num_symlinks += 1
+    return {"dirs": len(dirs), "files": len(files), "symlinks": num_symlinks}
+
+
+class SyscallCounter:
+    """
+    Count calls to os functions that hit the filesystem, without needing strace.
+
+    The functions are replaced in the os module while the context is active, so calls from
+    pathlib and other modules that look them up as os.<name> are counted as well. os.scandir
+    returns proxies of the DirEntry objects that count the calls of their methods as e.g.
+    "DirEntry.stat", so code using scandir can be compared to code using listdir and os.stat.
+    The DirEntry methods are counted as one call each, even though they are often answered from
+    the directory listing or their cache without a syscall. Calls that do not go through the
+    os module are not counted, e.g. the stat call of open().
+
+    Usage:
+        with SyscallCounter() as counter:
+            make_index("data")
+        print(counter.counts)
+    """
+
+    FUNCTION_NAMES = ("stat", "lstat", "scandir", "listdir", "readlink", "open", "access")
+
+    def __init__(self):
+        self.counts: Counter[str] = Counter()
+        self._originals: dict[str, Callable] = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> SyscallCounter:
+        for name in self.FUNCTION_NAMES:
+            original = getattr(os, name)
+            self._originals[name] = original
+            if name == "scandir":
+                setattr(os, name, self._wrap_scandir(original))
+            else:
+                setattr(os, name, self._wrap(name, original))
+        return self
+
+    def __exit__(self, *args) -> None:
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        self._originals = {}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def _wrap(self, name: str, original: Callable) -> Callable:
+        def counting_function(*args, **kwargs):
+            self._count(name)
+            return original(*args, **kwargs)
+
+        return counting_function
+
+    def _wrap_scandir(self, original: Callable) -> Callable:
+        def counting_scandir(*args, **kwargs):
+            self._count("scandir")
+            return _CountingScandirIterator(original(*args, **kwargs), self._count)
+
+        return counting_scandir
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+class _CountingScandirIterator:
+    """Wraps the iterator returned by os.scandir to return _CountingDirEntry objects."""
+
+    def __init__(self, scandir_it, count: Callable[[str], None]):
+        self._scandir_it = scandir_it
+        self._count = count
+
+    def __iter__(self) -> _CountingScandirIterator:
+        return self
+
+    def __next__(self) -> _CountingDirEntry:
+        return _CountingDirEntry(next(self._scandir_it), self._count)
+
+    def close(self) -> None:
+        self._scandir_it.close()
+
+    def __enter__(self) -> _CountingScandirIterator:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class _CountingDirEntry:
+    """Proxy of an os.DirEntry that counts the calls of its methods."""
+
+    __slots__ = ("_entry", "_count", "name", "path")
+
+    def __init__(self, entry: os.DirEntry, count: Callable[[str], None]):
+        self._entry = entry
+        self._count = count
+        self.name = entry.name
+        self.path = entry.path
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self) -> str:
+        return repr(self._entry)
+
+    def stat(self, *, follow_symlinks: bool = True) -> os.stat_result:
+        self._count("DirEntry.stat")
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+    def is_dir(self, *, follow_symlinks: bool = True) -> bool:
+        self._count("DirEntry.is_dir")
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def is_file(self, *, follow_symlinks: bool = True) -> bool:
+        self._count("DirEntry.is_file")
+        return self._entry.is_file(follow_symlinks=follow_symlinks)
+
+    def is_symlink(self) -> bool:
+        self._count("DirEntry.is_symlink")
+        return self._entry.is_symlink()
+
+    def inode(self) -> int:
+        self._count("DirEntry.inode")
+        return self._entry.inode()
+
+
+@define
+class BenchmarkResult:
+    benchmark: str
+    num_files: int
+    seconds: float
+    syscalls: dict[str, int]
+    tree: dict = field(factory=dict)
+    version: str = packg.__version__
+    python: str = platform.python_version()
+    timestamp: float = field(factory=time.time)
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.num_files / self.seconds if self.seconds > 0 else float("inf")
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "files_per_sec": self.files_per_sec}
+
+
+def get_benchmark_functions(
+    root: Path, spec: TreeSpec, workers: int = 8
+) -> dict[str, Callable[[], int]]:
+    """
+    Returns:
+        dict {benchmark name: function that runs the benchmark and returns the number of files}
+    """
+    pathspec_args = {"exclude_git": list(spec.exclude_git)}
+
+    def run_make_index() -> int:
+        return len(make_index(root, verbose=False))
+
+    def run_make_index_workers() -> int:
+        return len(make_index(root, verbose=False, workers=workers))
+
+    def run_make_index_pathspecs() -> int:
+        return len(make_index(root, verbose=False, pathspec_args=pathspec_args))
+
+    def run_regex_glob() -> int:
+        return sum(1 for _ in regex_glob(root, r"\.(jpg|json)$", ignore_directories=True))
+
+    def run_folder_populate() -> int:
+        folder = Folder(root)
+        folder.populate(recursive=True)
+        return _count_folder_files(folder)
+
+    def run_folder_populate_workers() -> int:
+        folder = Folder(root)
+        folder.populate(recursive=True, workers=workers)
+        return _count_folder_files(folder)
+
+    # filter a fixed list of paths, so only the matching is measured
+    rel_files = [f"/{rel_file}" for rel_file in make_index(root, verbose=False)]
+
+    def run_apply_pathspecs() -> int:
+        specs = make_pathspecs_from_args(pathspec_args)
+        return len(list(apply_pathspecs(rel_files, specs)))
+
+    return {
+        BenchmarkC.MAKE_INDEX: run_make_index,
+        BenchmarkC.MAKE_INDEX_WORKERS: run_make_index_workers,
+        BenchmarkC.MAKE_INDEX_PATHSPECS: run_make_index_pathspecs,
+        BenchmarkC.REGEX_GLOB: run_regex_glob,
+        BenchmarkC.FOLDER_POPULATE: run_folder_populate,
+        BenchmarkC.FOLDER_POPULATE_WORKERS: run_folder_populate_workers,
+        BenchmarkC.APPLY_PATHSPECS: run_apply_pathspecs,
+    }
+
+
+def _count_folder_files(folder: Folder) -> int:
+    return len(folder.file_names) + sum(
+        _count_folder_files(subfolder) for subfolder in folder.dir_refs.values()
+    )
+
+
+def run_benchmarks(
+    spec: TreeSpec,
+    benchmarks: Optional[list[str]] = None,
+    repeats: int = 3,
+    workers: int = 8,
+    root: Optional[PathType] = None,
+    output_file: Optional[PathType] = None,
+) -> list[BenchmarkResult]:
+    """
+    Create a synthetic tree and run the benchmarks on it.
+
+    Args:
+        spec: shape of the tree
+        benchmarks: names of the benchmarks to run, see BenchmarkC, default all
+        repeats: run each benchmark this often and report the fastest run
+        workers: number of threads for the benchmarks with workers
+        root: directory to create the tree in, default a new temporary directory
+        output_file: optional JSONL file to append the results to
+
+    Returns:
+        list of results
+    """
+    benchmarks = BenchmarkC.values_list() if benchmarks is None else benchmarks
+    if root is None:
+        with tempfile.TemporaryDirectory(prefix="packg_benchmark_") as tmp_dir:
+            results = _run_benchmarks_on_tree(
+                Path(tmp_dir) / "tree", spec, benchmarks, repeats, workers
+            )
+    else:
+        results = _run_benchmarks_on_tree(Path(root), spec, benchmarks, repeats, workers)
+    if output_file is not None:
+        output_file = Path(output_file)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with output_file.open("a", encoding="utf-8") as fh:
+            for result in results:
+                fh.write(json.dumps(result.to_dict()) + "\n")
+        logger.info(f"Appended {len(results)} results to {output_file}")
+    return results
+
+
+def _run_benchmarks_on_tree(
+    root: Path, spec: TreeSpec, benchmarks: list[str], repeats: int, workers: int
+) -> list[BenchmarkResult]:
+    tree_counts = create_synthetic_tree(root, spec)
+    tree_info = {**asdict(spec), **tree_counts}
+    logger.info(f"Created tree in {root}: {tree_counts}")
+    functions = get_benchmark_functions(root, spec, workers=workers)
+    results = []
+    for name in benchmarks:
+        best = None
+        for _ in range(repeats):
+            with SyscallCounter() as counter:
+                start = time.perf_counter()
+                num_files = functions[name]()
+                seconds = time.perf_counter() - start
+            result = BenchmarkResult(name, num_files, seconds, dict(counter.counts), tree_info)
+            if best is None or result.seconds < best.seconds:
+                best = result
+        logger.info(
+            f"{name:25s} {best.num_files:8d} files {best.seconds:8.3f}s "
+            f"{best.files_per_sec:12,.0f} files/s {sum(best.syscalls.values()):8d} syscalls"
+        )
+        results.append(best)
+    return results
+
+
+@define
+class Args(VerboseQuietArgs):
+    fanout: int = add_argument(type=int, default=4, help="Subdirectories per directory")
+    depth: int = add_argument(type=int, default=4, help="Directory levels")
+    files_per_dir: int = add_argument(type=int, default=20, help="Files per directory")
+    max_file_size: int = add_argument(type=int, default=0, help="Maximum file size in bytes")
+    num_symlinks: int = add_argument(type=int, default=10, help="Number of symlinks")
+    ignored_dir_ratio: float = add_argument(
+        type=float, default=0.1, help="Fraction of directories named like build output"
+    )
+    extensions: Optional[list[str]] = add_argument(
+        shortcut="-e",
+        action="append",
+        help="File extensions to choose from e.g. -e .txt, default see TreeSpec",
+    )
+    exclude_git: Optional[list[str]] = add_argument(
+        shortcut="-x",
+        action="append",
+        help="Git-like pathspecs to exclude in the pathspec benchmarks, default see TreeSpec",
+    )
+    seed: int = add_argument(type=int, default=0, help="Random seed")
+    benchmarks: Optional[list[str]] = add_argument(
+        shortcut="-b",
+        action="append",
+        choices=BenchmarkC.values_list(),
+        help="Benchmarks to run, default all",
+    )
+    repeats: int = add_argument(shortcut="-r", type=int, default=3, help="Repeats per benchmark")
+    workers: int = add_argument(shortcut="-w", type=int, default=8, help="Threads for workers")
+    output_file: Optional[Path] = add_argument(
+        shortcut="-o", type=str, default=None, help="JSONL file to append the results to"
+    )
+
+
+def main():
+    parser = TypedParser.create_parser(Args, description=__doc__)
+    args: Args = parser.parse_args()
+    configure_logger(level=get_logger_level_from_args(args), format=SHORTEST_FORMAT)
+    spec = TreeSpec(
+        fanout=args.fanout,
+        depth=args.depth,
+        files_per_dir=args.files_per_dir,
+        max_file_size=args.max_file_size,
+        num_symlinks=args.num_symlinks,
+        ignored_dir_ratio=args.ignored_dir_ratio,
+        seed=args.seed,
+    )
+    if args.extensions is not None:
+        spec.extensions = tuple(args.extensions)
+    if args.exclude_git is not None:
+        spec.exclude_git = tuple(args.exclude_git)
+    run_benchmarks(
+        spec,
+        benchmarks=args.benchmarks,
+        repeats=args.repeats,
+        workers=args.workers,
+        output_file=args.output_file,
+    )
+
+
+if __name__ == "__main__":
+    main()
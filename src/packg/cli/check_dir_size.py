@@ -1,21 +1,19 @@
 from __future__ import annotations
 
+import hashlib
 from pathlib import Path
 from typing import Optional
 
-import joblib
 from attr import define
 from loguru import logger
 
-from packg import Const
-from packg.caching import get_joblib_memory
+from packg import Const, format_exception
 from packg.iotools.folder import Folder, get_subfolder_data
 from packg.iotools.misc import format_b_in_gb
 from packg.log import configure_logger, get_logger_level_from_args
+from packg.paths import get_packg_cache_dir
 from typedparser import TypedParser, VerboseQuietArgs, add_argument
 
-mem: joblib.Memory = get_joblib_memory(verbose=True)
-
 
 class FileSortFieldsC(Const):
     PATH = "path"
@@ -34,6 +32,11 @@ class Args(VerboseQuietArgs):
         shortcut="-d", type=int, default=-1, help="Max nesting levels to show (-1=inf)."
     )
     reset_cache: bool = add_argument(shortcut="-r", action="store_true", help="Reset the cache.")
+    refresh: bool = add_argument(
+        shortcut="-u",
+        action="store_true",
+        help="Update the cached tree by listing only folders whose mtime changed.",
+    )
     sort: str = add_argument(  # TODO better error msg if this is set wrongly
         shortcut="-o",
         type=str,
@@ -48,6 +51,9 @@ class Args(VerboseQuietArgs):
     type: Optional[str] = add_argument(
         shortcut="-t", type=str, default=None, help="Filter path type: (d)irs, (f)iles or None"
     )
+    workers: int = add_argument(
+        shortcut="-w", type=int, default=0, help="Number of threads to list folders (0 = off)"
+    )
 
 
 def main():
@@ -57,13 +63,13 @@ def main():
     args: Args = parser.parse_args()
     configure_logger(level=get_logger_level_from_args(args))
 
+    start = Path(args.start_path).absolute().as_posix()
     if args.reset_cache:
-        get_populated_root.clear()
+        get_cache_file(start).unlink(missing_ok=True)
         logger.info("Cleared cache")
 
-    start = Path(args.start_path).absolute().as_posix()
     logger.info(f"Finding all files in {start}")
-    root = get_populated_root(start)
+    root = get_populated_root(start, workers=args.workers, refresh=args.refresh)
     # print_graph(root, max_level=args.depth, min_size_mb=args.min_mb)
     subfolder_data = get_subfolder_data(root, max_level=args.depth, min_size_mb=args.min_mb)
     # df = convert_subfolder_data_to_dataframe(subfolder_data)
@@ -85,11 +91,41 @@ def main():
     print(df.to_string(index=False))
 
 
-@mem.cache(verbose=99999)
-def get_populated_root(start: str):
+def get_cache_file(start: str) -> Path:
+    """
+    Trees are cached as npz files, see Folder.save. Older versions cached them with joblib
+    in the packg cache dir under joblib/, those entries are not read anymore and can be deleted.
+    """
+    start_hash = hashlib.sha256(start.encode("utf-8")).hexdigest()[:16]
+    return get_packg_cache_dir() / "check_dir_size" / f"{start_hash}.npz"
+
+
+def get_populated_root(start: str, workers: int = 0, refresh: bool = False) -> Folder:
+    """
+    Populate the folder tree of start, or load it from the cache file if it exists.
+
+    Args:
+        start: absolute path of the root folder
+        workers: number of threads to list folders, see Folder.populate
+        refresh: update a cached tree with Folder.refresh and save it again
+    """
+    cache_file = get_cache_file(start)
+    if cache_file.is_file():
+        try:
+            root = Folder.load(cache_file)
+            logger.info(f"Loaded cached tree of {start} from {cache_file}")
+        except Exception as e:
+            logger.warning(f"Ignoring broken cache {cache_file}: {format_exception(e)}")
+        else:
+            if refresh:
+                root.refresh(workers=workers)
+                root.save(cache_file)
+            return root
     logger.info(f"Populating root folder {start}")
     root = Folder(start)
-    root.populate(recursive=True)
+    root.populate(recursive=True, workers=workers)
+    root.save(cache_file)
+    logger.info(f"Saved tree to {cache_file}")
     return root
 
 
@@ -105,8 +141,7 @@ def print_graph(
     if max_level == 0:
         return
     size_b_other_files = 0
-    for file, file_stat in root_folder.files_and_stat.items():
-        file_size = file_stat.st_size
+    for file, file_size in zip(root_folder.file_names, root_folder.file_sizes.tolist()):
         if file_size >= min_size_b:
             print_fn(f"{format_b_in_gb(file_size):>10s} F {full_path_to_here}{file} ")
             continue
@@ -0,0 +1,278 @@
+"""
+Compress, decompress or recompress all files in a directory tree in parallel.
+
+Outputs are written next to their sources and get the mtime of their source. Outputs with the
+same mtime and a plausible size are considered up to date and skipped, use -f to redo them.
+
+Examples:
+    python -m packg.cli.compress_tree data -e json                     # a.json -> a.json.zst
+    python -m packg.cli.compress_tree data -m decompress -e json.zst   # a.json.zst -> a.json
+    python -m packg.cli.compress_tree data -m recompress -e xz -x tmp/ # a.json.xz -> a.json.zst
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from attrs import define
+from loguru import logger
+
+from packg import Const, format_exception
+from packg.iotools.compress import (
+    COMPRESSOR_SUFFIXES,
+    CompressorC,
+    CompressorWriter,
+    DecompressorReader,
+    get_available_compressors,
+    get_compressor,
+    get_compressor_name_from_filename,
+    get_decompressor,
+    get_suffix_for_compressor_name,
+)
+from packg.iotools.file_indexer import make_index
+from packg.iotools.misc import format_bytes_human_readable
+from packg.iotools.pathspec_matcher import PathSpecArgs
+from packg.log import SHORTEST_FORMAT, configure_logger, get_logger_level_from_args
+from packg.multiproc import FnMultiProcessor
+from typedparser import TypedParser, VerboseQuietArgs, add_argument
+
+
+class ModeC(Const):
+    COMPRESS = "compress"
+    DECOMPRESS = "decompress"
+    RECOMPRESS = "recompress"
+
+
+class StatusC(Const):
+    CONVERTED = "converted"
+    FAILED = "failed"
+
+
+@define
+class Args(VerboseQuietArgs, PathSpecArgs):
+    folder: Path = add_argument("folder", type=str, help="Directory to process")
+    endings: Optional[list[str]] = add_argument(
+        shortcut="-e", action="append", help="Only process files with these endings e.g. -e json"
+    )
+    mode: str = add_argument(
+        shortcut="-m",
+        type=str,
+        default=ModeC.COMPRESS,
+        help="What to do with the files",
+        choices=ModeC.values_list(),
+    )
+    compressor: str = add_argument(
+        shortcut="-c",
+        type=str,
+        default=CompressorC.ZSTD,
+        help="Compressor for the outputs of compress and recompress",
+        choices=[c for c in get_available_compressors() if c != CompressorC.NONE],
+    )
+    workers: int = add_argument(
+        shortcut="-w", type=int, default=-1, help="Number of workers (-1 = number of cpus)"
+    )
+    force: bool = add_argument(shortcut="-f", action="store_true", help="Redo up-to-date files")
+    delete: bool = add_argument(
+        shortcut="-d", action="store_true", help="Delete source files after converting them"
+    )
+    verify: bool = add_argument(
+        shortcut="-y", action="store_true", help="Verify the round-trip of each output"
+    )
+    dry_run: bool = add_argument(
+        shortcut="-n", action="store_true", help="Only show what would be done"
+    )
+
+
+def main():
+    parser = TypedParser.create_parser(Args, description=__doc__)
+    args: Args = parser.parse_args()
+    configure_logger(level=get_logger_level_from_args(args), format=SHORTEST_FORMAT)
+    logger.info(f"{args}")
+
+    folder = Path(args.folder)
+    if not folder.is_dir():
+        raise ValueError(f"Not a dir: {folder}")
+    jobs = find_jobs(
+        folder,
+        args.mode,
+        args.compressor,
+        pathspec_args=args,
+        endings=args.endings,
+        force=args.force,
+    )
+    logger.info(f"Found {len(jobs)} files to {args.mode}")
+    if len(jobs) == 0:
+        return
+    if args.dry_run:
+        for src, dst, _, _ in jobs:
+            logger.info(f"Would convert {src} -> {dst}")
+        logger.warning("Dry run (-n), did not modify any files.")
+        return
+
+    workers = os.cpu_count() if args.workers < 0 else args.workers
+    mp = FnMultiProcessor(
+        workers=workers,
+        target_fn=convert_file,
+        with_output=True,
+        desc=f"{args.mode.capitalize()} files",
+        total=len(jobs),
+        ignore_errors=True,
+    )
+    for src, dst, src_compressor, dst_compressor in jobs:
+        mp.put(src, dst, src_compressor, dst_compressor, args.verify, args.delete)
+    mp.run()
+    results = [mp.get() for _ in range(len(jobs))]
+    mp.close()
+
+    statuses = [result[0] if result is not None else StatusC.FAILED for result in results]
+    size_in = sum(result[1] for result in results if result is not None)
+    size_out = sum(result[2] for result in results if result is not None)
+    counts = {status: statuses.count(status) for status in StatusC.values()}
+    logger.info(
+        f"Done: {counts}. Size of converted files {format_bytes_human_readable(size_in)} -> "
+        f"{format_bytes_human_readable(size_out)}"
+    )
+
+
+def find_jobs(
+    folder: Path,
+    mode: str,
+    compressor: str,
+    pathspec_args: PathSpecArgs | dict | None = None,
+    endings: Optional[list[str]] = None,
+    force: bool = False,
+) -> list[tuple[str, str, str, str]]:
+    """
+    Args:
+        folder: root directory
+        mode: see ModeC
+        compressor: compressor for the outputs of compress and recompress
+        pathspec_args: pathspec arguments to select files, see make_index
+        endings: only select files with these endings e.g. ["json"]
+        force: also return jobs for outputs that are up to date
+
+    Returns:
+        list of tuples (source file, output file, source compressor, output compressor)
+    """
+    file_index = make_index(folder, verbose=False, pathspec_args=pathspec_args)
+    endings = None if endings is None else tuple(f".{ending}" for ending in endings)
+    jobs = []
+    n_up_to_date = 0
+    for rel_file, props in file_index.items():
+        if endings is not None and not rel_file.endswith(endings):
+            continue
+        src = folder / rel_file
+        src_compressor = get_compressor_name_from_filename(src)
+        if mode == ModeC.COMPRESS:
+            if src_compressor is not None:
+                continue
+            src_compressor = CompressorC.NONE
+            dst = src.parent / f"{src.name}{get_suffix_for_compressor_name(compressor)}"
+            dst_compressor = compressor
+        elif mode in (ModeC.DECOMPRESS, ModeC.RECOMPRESS):
+            if src_compressor is None:
+                continue
+            dst = src.with_suffix("")
+            dst_compressor = CompressorC.NONE
+            if mode == ModeC.RECOMPRESS:
+                if COMPRESSOR_SUFFIXES[src.suffix.lower()] == compressor:
+                    continue
+                dst = dst.parent / f"{dst.name}{get_suffix_for_compressor_name(compressor)}"
+                dst_compressor = compressor
+        else:
+            raise ValueError(f"Unknown mode: {mode}, must be one of {ModeC.values_list()}")
+        if not force and is_up_to_date(dst, props.size, src.stat().st_mtime_ns):
+            n_up_to_date += 1
+            continue
+        jobs.append((src.as_posix(), dst.as_posix(), src_compressor, dst_compressor))
+    if n_up_to_date > 0:
+        logger.info(f"Skipping {n_up_to_date} files with up-to-date outputs")
+    return jobs
+
+
+def is_up_to_date(dst: Path, src_size: int, src_mtime_ns: int) -> bool:
+    """
+    Outputs are stamped with the mtime of their source. A different mtime means the source changed
+    since, an empty output of a non-empty source means the conversion did not finish.
+    """
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        return False
+    if dst_stat.st_mtime_ns != src_mtime_ns:
+        return False
+    return dst_stat.st_size > 0 or src_size == 0
+
+
+def convert_file(
+    src: str,
+    dst: str,
+    src_compressor: str,
+    dst_compressor: str,
+    verify: bool = False,
+    delete: bool = False,
+) -> tuple[str, int, int]:
+    """
+    Convert a single file, streaming it in chunks so it is never fully held in memory.
+    The output is written to a temporary file first and then renamed, so an interrupted run
+    never leaves a partial output behind.
+
+    Returns:
+        tuple of (status, input size in bytes, output size in bytes)
+    """
+    src_path, dst_path = Path(src), Path(dst)
+    src_stat = src_path.stat()
+    tmp_path = dst_path.parent / f".{dst_path.name}.tmp"
+    try:
+        # the uncompressed size is only known when compressing
+        size = src_stat.st_size if src_compressor == CompressorC.NONE else -1
+        hasher = hashlib.sha256() if verify else None
+        with src_path.open("rb") as fh_in, tmp_path.open("wb") as fh_out:
+            reader = DecompressorReader(fh_in, get_decompressor(src_compressor))
+            with CompressorWriter(fh_out, get_compressor(dst_compressor, size)) as writer:
+                _copy_stream(reader, writer, hasher)
+        if verify:
+            output_hasher = hashlib.sha256()
+            with tmp_path.open("rb") as fh_in:
+                reader = DecompressorReader(fh_in, get_decompressor(dst_compressor))
+                _copy_stream(reader, None, output_hasher)
+            if output_hasher.digest() != hasher.digest():
+                raise RuntimeError(f"Round-trip verification failed for {dst}")
+        os.utime(tmp_path, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(tmp_path, dst_path)
+    except Exception as e:
+        logger.error(f"Failed to convert {src}: {format_exception(e)}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return StatusC.FAILED, 0, 0
+    if delete:
+        src_path.unlink()
+    return StatusC.CONVERTED, src_stat.st_size, dst_path.stat().st_size
+
+
+def _copy_stream(
+    fh_in: BinaryIO,
+    fh_out: Optional[BinaryIO],
+    hasher=None,
+    chunk_size: int = 1024**2,
+) -> None:
+    """Like shutil.copyfileobj, also updates the hasher with the data if given.
+    With fh_out None the data is only hashed."""
+    if hasher is None:
+        shutil.copyfileobj(fh_in, fh_out, chunk_size)
+        return
+    while True:
+        chunk = fh_in.read(chunk_size)
+        if not chunk:
+            break
+        hasher.update(chunk)
+        if fh_out is not None:
+            fh_out.write(chunk)
+
+
+if __name__ == "__main__":
+    main()
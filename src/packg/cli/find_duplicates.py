@@ -0,0 +1,278 @@
+"""
+Find duplicate files in one or more directory trees.
+
+Files are grouped by size first. Groups with more than one file are narrowed down by a hash of
+the start and end of each file, then by the hash of the full content. Files with a unique size
+are never read, and files that are unique after the partial hash are not read completely.
+
+Examples:
+    python -m packg.cli.find_duplicates data1 data2 -m 1000000 -o duplicates.json
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from attrs import define
+from loguru import logger
+
+from packg import format_exception
+from packg.iotools.file_indexer import hash_file, make_index
+from packg.iotools.jsonext import dump_json
+from packg.iotools.misc import format_bytes_human_readable
+from packg.iotools.pathspec_matcher import PathSpecArgs
+from packg.log import SHORTEST_FORMAT, configure_logger, get_logger_level_from_args
+from typedparser import TypedParser, VerboseQuietArgs, add_argument
+
+
+@define
+class Args(VerboseQuietArgs, PathSpecArgs):
+    roots: list[str] = add_argument("roots", type=str, nargs="+", help="Directories to search")
+    min_size: int = add_argument(
+        shortcut="-m", type=int, default=1, help="Ignore files smaller than this many bytes"
+    )
+    partial_kb: int = add_argument(
+        shortcut="-p",
+        type=int,
+        default=64,
+        help="KB to hash at the start and end of each file before hashing it completely",
+    )
+    hash_algo: str = add_argument(
+        shortcut="-a", type=str, default="blake2b", help="Hash algorithm"
+    )
+    workers: int = add_argument(
+        shortcut="-w", type=int, default=8, help="Number of threads for listing and hashing"
+    )
+    output_file: Optional[Path] = add_argument(
+        shortcut="-o", type=str, default=None, help="Write the duplicate groups to a json file"
+    )
+    num_show: int = add_argument(
+        shortcut="-n", type=int, default=20, help="Number of groups to show (-1 = all)"
+    )
+
+
+@define
+class DuplicateGroup:
+    size: int
+    digest: str
+    files: list[str]
+
+    @property
+    def wasted_bytes(self) -> int:
+        return self.size * (len(self.files) - 1)
+
+
+def main():
+    parser = TypedParser.create_parser(Args, description=__doc__)
+    args: Args = parser.parse_args()
+    configure_logger(level=get_logger_level_from_args(args), format=SHORTEST_FORMAT)
+    logger.info(f"{args}")
+
+    groups = find_duplicates(
+        args.roots,
+        min_size=args.min_size,
+        partial_size=args.partial_kb * 1024,
+        hash_algo=args.hash_algo,
+        workers=args.workers,
+        pathspec_args=args,
+        verbose=args.verbose,
+    )
+    num_show = len(groups) if args.num_show < 0 else args.num_show
+    for group in groups[:num_show]:
+        print(
+            f"{format_bytes_human_readable(group.wasted_bytes)} wasted by {len(group.files)} "
+            f"copies of {format_bytes_human_readable(group.size)}:"
+        )
+        for file in group.files:
+            print(f"    {file}")
+    if len(groups) > num_show:
+        print(f"... and {len(groups) - num_show} more groups")
+    wasted = sum(group.wasted_bytes for group in groups)
+    num_files = sum(len(group.files) for group in groups)
+    logger.info(
+        f"Found {len(groups)} groups with {num_files} duplicate files, "
+        f"{format_bytes_human_readable(wasted)} wasted."
+    )
+    if args.output_file is not None:
+        dump_json(
+            [{"size": g.size, "digest": g.digest, "files": g.files} for g in groups],
+            args.output_file,
+            indent=2,
+        )
+        logger.info(f"Wrote {args.output_file}")
+
+
+def find_duplicates(
+    roots: list[str | Path],
+    min_size: int = 1,
+    partial_size: int = 64 * 1024,
+    hash_algo: str = "blake2b",
+    workers: int = 8,
+    pathspec_args: PathSpecArgs | dict | None = None,
+    verbose: bool = False,
+) -> list[DuplicateGroup]:
+    """
+    Roots that are equal to or inside another root are skipped, so no file is listed twice.
+    Hardlinks to the same file are not duplicates, only the first path of each inode is kept.
+
+    Args:
+        roots: directories to search, files are reported as root / relative path
+        min_size: ignore files smaller than this many bytes
+        partial_size: bytes to hash at the start and end of each file in the first pass
+        hash_algo: hashlib algorithm
+        workers: number of threads for listing and hashing, 0 to do everything in this thread
+        pathspec_args: pathspec arguments to select files, see make_index
+        verbose: show progress
+
+    Returns:
+        groups of files with the same content, sorted by wasted bytes descending.
+        The files of each group are sorted.
+    """
+    roots = _get_outermost_roots(roots)
+    all_sizes, file_indexes = [], []
+    for root in roots:
+        file_index = make_index(
+            root,
+            verbose=verbose,
+            pathspec_args=pathspec_args,
+            workers=workers,
+            return_file_index=True,
+        )
+        file_indexes.append(file_index)
+        all_sizes.append(file_index.sizes)
+    sizes = np.concatenate(all_sizes) if len(all_sizes) > 0 else np.zeros(0, dtype=np.int64)
+    candidates = _get_positions_in_groups(sizes, sizes >= min_size)
+    logger.info(f"Found {len(candidates)} of {len(sizes)} files with the same size as another")
+
+    # convert only the candidates to paths
+    root_starts = np.cumsum([0] + [len(file_index) for file_index in file_indexes])
+    root_ids = np.searchsorted(root_starts, candidates, side="right") - 1
+    files = []
+    for root_id, root in enumerate(roots):
+        positions = candidates[root_ids == root_id] - root_starts[root_id]
+        root_str = Path(root).as_posix()
+        files += [f"{root_str}/{p}" for p in file_indexes[root_id].get_paths(positions)]
+    sizes = sizes[candidates]
+    is_first_link = _get_first_links(files, workers)
+    if not is_first_link.all():
+        logger.info(f"Skipping {np.sum(~is_first_link)} hardlinks to files that are kept")
+        candidates = _get_positions_in_groups(sizes, is_first_link)
+        files, sizes = [files[i] for i in candidates.tolist()], sizes[candidates]
+
+    # files of up to 2 * partial_size bytes are hashed completely in the first pass already
+    digests = _hash_files(files, hash_algo, partial_size, workers)
+    keys = [f"{size}-{digest}" for size, digest in zip(sizes.tolist(), digests)]
+    is_readable = np.array([digest is not None for digest in digests], dtype=bool)
+    candidates = _get_positions_in_groups(np.array(keys, dtype=object), is_readable)
+    is_partial = sizes[candidates] > 2 * partial_size
+    full_candidates = candidates[is_partial]
+    logger.info(
+        f"Found {len(candidates)} files with the same partial hash as another, "
+        f"hashing {len(full_candidates)} of them completely"
+    )
+    full_digests = _hash_files([files[i] for i in full_candidates], hash_algo, None, workers)
+    for i, digest in zip(full_candidates.tolist(), full_digests):
+        digests[i] = digest
+        keys[i] = f"{sizes[i]}-{digest}"
+        is_readable[i] = digest is not None
+
+    groups: dict[str, DuplicateGroup] = {}
+    for i in _get_positions_in_groups(np.array(keys, dtype=object), is_readable).tolist():
+        group = groups.setdefault(keys[i], DuplicateGroup(int(sizes[i]), digests[i], []))
+        group.files.append(files[i])
+    for group in groups.values():
+        group.files.sort()
+    return sorted(groups.values(), key=lambda g: (-g.wasted_bytes, g.files[0]))
+
+
+def _get_outermost_roots(roots: list[str | Path]) -> list[str | Path]:
+    """
+    Returns:
+        the roots in the input order, without roots that are equal to or inside another root
+    """
+    resolved = [Path(root).resolve() for root in roots]
+    kept = []
+    for i, root in enumerate(roots):
+        outer = [
+            j
+            for j, other in enumerate(resolved)
+            if j != i
+            and resolved[i].is_relative_to(other)
+            and (resolved[i] != other or j < i)
+        ]
+        if len(outer) > 0:
+            logger.info(f"Skipping root {root}, it is already searched in {roots[outer[0]]}")
+            continue
+        kept.append(root)
+    return kept
+
+
+def _get_first_links(files: list[str], workers: int) -> np.ndarray:
+    """
+    Returns:
+        bool array, False for files that are hardlinks to the same inode as a file that sorts
+        before them
+    """
+    if workers == 0:
+        stats = [_stat_or_none(file) for file in files]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            stats = list(executor.map(_stat_or_none, files))
+    first_links: dict[tuple[int, int], int] = {}
+    for i, file_stat in enumerate(stats):
+        if file_stat is None or file_stat.st_nlink < 2:
+            continue
+        key = (file_stat.st_dev, file_stat.st_ino)
+        if key not in first_links or files[i] < files[first_links[key]]:
+            first_links[key] = i
+    is_first = np.array([file_stat is None or file_stat.st_nlink < 2 for file_stat in stats])
+    is_first[list(first_links.values())] = True
+    return is_first.astype(bool)
+
+
+def _stat_or_none(file: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(file)
+    except OSError:
+        return None
+
+
+def _get_positions_in_groups(keys: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        sorted positions of the keys where the mask is True and the key appears at least twice
+        among those positions
+    """
+    positions = np.flatnonzero(mask)
+    if len(positions) == 0:
+        return positions
+    _, inverse, counts = np.unique(keys[positions], return_inverse=True, return_counts=True)
+    return positions[counts[inverse.reshape(-1)] > 1]
+
+
+def _hash_files(
+    files: list[str], hash_algo: str, partial_size: Optional[int], workers: int
+) -> list[Optional[str]]:
+    """Hash files in threads, hashlib releases the GIL. Unreadable files get None."""
+    get_digest = partial(_hash_file_or_none, hash_algo=hash_algo, partial_size=partial_size)
+    if workers == 0:
+        return [get_digest(file) for file in files]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(get_digest, files))
+
+
+def _hash_file_or_none(file: str, hash_algo: str, partial_size: Optional[int]) -> Optional[str]:
+    try:
+        return hash_file(file, hash_algo, partial_size)
+    except OSError as e:
+        logger.warning(f"Could not read {file}: {format_exception(e)}")
+        return None
+
+
+if __name__ == "__main__":
+    main()
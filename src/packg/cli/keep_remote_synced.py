@@ -32,6 +32,7 @@ from loguru import logger
 
 from packg import format_exception
 from packg.dtime import get_timestamp_for_filename
+from packg.iotools.file_indexer import FileProperties, diff_indexes
 from packg.iotools.git_status_checker import (
     check_for_stages,
     check_for_unpushed_commits,
@@ -169,7 +170,7 @@ class SyncCollector:
 
     def find_files_to_update(self):
         in_files = self.get_all_collected_files()
-        to_update = []
+        current_files = {}
         for file in in_files:
             full_file = self.src_base_dir / file
             if not full_file.is_file():
@@ -177,16 +178,20 @@ class SyncCollector:
                     print(f"    not a file anymore: {file}")
                 continue
             stat = full_file.stat()
-            modtime = stat.st_mtime
-            size = stat.st_size
-            if file in self.stored_files:
-                old_modtime, old_size = self.stored_files[file]
-                if old_modtime == modtime and old_size == size:
-                    if self.verbose:
-                        print(f"    unchanged: {file}")
-                    continue
+            current_files[file] = FileProperties(stat.st_size, stat.st_mtime)
+        diff = diff_indexes(
+            {file: self.stored_files[file] for file in current_files if file in self.stored_files},
+            current_files,
+        )
+        changed_files = diff.added | diff.modified
+        to_update = []
+        for file in current_files:
+            if file not in changed_files:
+                if self.verbose:
+                    print(f"    unchanged: {file}")
+                continue
             to_update.append(file)
-            self.stored_files[file] = (modtime, size)
+        self.stored_files.update(current_files)
         return to_update
 
     def run_rsync(self, dst):
@@ -4,7 +4,14 @@ Note: Everything inside this directory should not import from this __init__.py f
 but from the actual source file. For everything outside, importing from this __init__.py is fine.
 """
 
-from .file_indexer import make_index, regex_glob, sort_file_paths_with_dirs_separated
+from .file_index import FileIndex
+from .file_indexer import (
+    IndexContext,
+    iter_index,
+    make_index,
+    regex_glob,
+    sort_file_paths_with_dirs_separated,
+)
 from .file_reader import (
     open_file_or_io,
     read_bytes_from_file_or_io,
@@ -36,9 +43,11 @@ from .misc import (
     set_working_directory,
 )
 from .pathspec_matcher import (
+    CompiledPathSpecs,
     PathSpecRepr,
     PathSpecWithConversion,
     apply_pathspecs,
+    get_compiled_pathspecs,
     make_and_apply_pathspecs,
     make_git_pathspec,
     make_pathspec,
@@ -68,6 +77,8 @@ __all__ = [
     "dumps_yaml",
     "make_git_pathspec",
     "make_index",
+    "iter_index",
+    "IndexContext",
     "find_git_root",
     "navigate_to_git_root",
     "open_file_or_io",
@@ -79,6 +90,8 @@ __all__ = [
     "PathSpecWithConversion",
     "regex_glob",
     "apply_pathspecs",
+    "CompiledPathSpecs",
+    "get_compiled_pathspecs",
     "make_and_apply_pathspecs",
     "make_pathspecs",
     "set_working_directory",
@@ -89,4 +102,5 @@ __all__ = [
     "format_bytes_human_readable",
     "PathSpecRepr",
     "redump_json",
+    "FileIndex",
 ]
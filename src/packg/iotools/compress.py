@@ -1,57 +1,372 @@
 """
-possible improvements:
-    - add more hyperparameters to the compressor wrappers, currently using mostly the defaults.
-    - auto compressor name from filename
-    - compressor ios similar to BytesIO that compress/decompress as needed on write/read
-
+Compression utilities built on a registry of codecs, see register_codec.
+Use get_compressor / get_decompressor to create codecs by name, and auto_select_codec to pick
+a codec for some type of data by benchmarking the codecs on a sample.
 """
 
+from __future__ import annotations
+
+import bz2
+import importlib.util
+import io
 import lzma
+import os
+import shutil
+import struct
 import tarfile
+import threading
 import time
+import zipfile
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from typing import Union
+from typing import BinaryIO, Callable, Optional, Union
 
+import numpy as np
 import zstandard
+from attrs import define, field
+from tqdm import tqdm
 
 from packg.constclass import Const
 from packg.iotools.file_reader import open_file_or_io, read_bytes_from_file_or_io
-from packg.typext import PathType
+from packg.iotools.pathspec_matcher import (
+    CompiledPathSpecs,
+    PathSpecArgs,
+    get_compiled_pathspecs,
+    make_pathspecs_from_args,
+)
+from packg.log import logger
+from packg.typext import PathType, PathTypeCls
 
 
 def extract_tar(
-    tar_file: PathType, target_dir: PathType = None, delete_after_extract: bool = False
+    tar_file: PathType,
+    target_dir: PathType = None,
+    delete_after_extract: bool = False,
+    workers: int = 0,
+    pathspec_args: PathSpecArgs | dict | None = None,
+    compressor_name: Optional[str] = None,
+    verbose: bool = False,
+    max_pending_bytes: int = 256 * 1024**2,
 ) -> None:
     """
+    Extract a tar file in a single streaming pass. Member contents are read sequentially from the
+    archive and written to disk by a thread pool.
+
+    Compressed tars are supported: .tar.zst and .tar.xz are decompressed with the compressor
+    wrappers, other formats supported by tarfile (e.g. .tar.gz) are detected automatically.
+
+    Members with absolute paths, paths leaving the target dir (also via symlinks) and links
+    pointing outside the target dir are refused with a ValueError. Device files and fifos are
+    skipped.
+
     Args:
         tar_file: tar file to extract.
         target_dir: default None, extract into the parent folder of the tar file.
         delete_after_extract: default False, delete the tar file after extraction.
+        workers: number of threads writing files (0 = write in the foreground)
+        pathspec_args: optional pathspec arguments to filter members. Paths are matched with a
+            leading slash, directories additionally with a trailing slash (as in make_index).
+        compressor_name: decompress the stream with this compressor (see CompressorC),
+            default None = determine from the file suffix.
+        verbose: show progress in bytes/sec of the archive file.
+        max_pending_bytes: maximum size of member data held in memory waiting to be written.
+            Larger members are written directly from the stream in the foreground.
     """
     tar_file = Path(tar_file)
     if target_dir is None:
         target_dir = tar_file.parent
-    target_dir = Path(target_dir)
-    with tarfile.open(tar_file.as_posix()) as tar:
-        tar.extractall(path=target_dir)
+    target_dir = Path(target_dir).absolute()
+    os.makedirs(target_dir, exist_ok=True)
+    specs = get_compiled_pathspecs(make_pathspecs_from_args(pathspec_args))
+    if compressor_name is None:
+        compressor_name = get_compressor_name_from_filename(tar_file)
+
+    with tar_file.open("rb") as fh_raw:
+        if compressor_name is None:
+            fh, tar_mode = fh_raw, "r|*"
+        else:
+            fh, tar_mode = DecompressorReader(fh_raw, get_decompressor(compressor_name)), "r|"
+        pbar = tqdm(
+            total=tar_file.stat().st_size,
+            desc=f"Extracting {tar_file.name}",
+            unit="B",
+            unit_scale=True,
+            unit_divisor=1024,
+            disable=not verbose,
+        )
+        with tarfile.open(fileobj=fh, mode=tar_mode) as tar:
+            extractor = _TarExtractor(target_dir, workers, max_pending_bytes)
+            try:
+                for member in tar:
+                    if _tar_member_is_selected(member, specs):
+                        extractor.extract(tar, member)
+                    pbar.update(fh_raw.tell() - pbar.n)
+            finally:
+                extractor.close()
+        pbar.close()
     if delete_after_extract:
         tar_file.unlink()
 
 
-def load_xz(file, mode: str = "rt", encoding: str = "utf-8"):
-    if "b" in mode:
-        encoding = None
-    with lzma.open(file, mode, encoding=encoding) as fh:
-        data_str = fh.read()
-    return data_str
+def _tar_member_is_selected(member: tarfile.TarInfo, specs: CompiledPathSpecs) -> bool:
+    if len(specs) == 0:
+        return True
+    name = f"/{member.name.strip('/')}{'/' if member.isdir() else ''}"
+    return specs.match(name)
+
+
+class _TarExtractor:
+    """Helper for extract_tar, writes tar members to disk using a thread pool."""
+
+    def __init__(self, target_dir: Path, workers: int, max_pending_bytes: int):
+        self.target_dir = os.path.realpath(target_dir)
+        self.max_pending_bytes = max_pending_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.pending: dict[Future, tuple[str, int]] = {}
+        self.pending_by_path: dict[str, Future] = {}
+        self.pending_bytes = 0
+        self.safe_parents: set[str] = set()
+        self.dirs: list[tarfile.TarInfo] = []
+
+    def get_safe_path(self, name: str) -> str:
+        if os.path.isabs(name):
+            raise ValueError(f"Refusing to extract absolute path {name}")
+        path = os.path.normpath(os.path.join(self.target_dir, name))
+        if os.path.commonpath([self.target_dir, path]) != self.target_dir:
+            raise ValueError(f"Refusing to extract {name} outside of {self.target_dir}")
+        # make sure no symlink on the way leads outside of the target dir
+        parent = os.path.dirname(path)
+        if parent not in self.safe_parents:
+            real_parent = os.path.realpath(parent)
+            if os.path.commonpath([self.target_dir, real_parent]) != self.target_dir:
+                raise ValueError(f"Refusing to extract {name} through a symlink to {real_parent}")
+            self.safe_parents.add(parent)
+        return path
+
+    def extract(self, tar: tarfile.TarFile, member: tarfile.TarInfo) -> None:
+        path = self.get_safe_path(member.name)
+        if member.isdir():
+            os.makedirs(path, exist_ok=True)
+            self.dirs.append(member)
+            return
+        if member.isfile():
+            self.extract_file(tar, member, path)
+            return
+        if member.issym() or member.islnk():
+            self.extract_link(member, path)
+            return
+        logger.debug(f"Skipping {member.name} with unsupported tar type {member.type}")
+
+    def extract_file(self, tar: tarfile.TarFile, member: tarfile.TarInfo, path: str) -> None:
+        if path in self.pending_by_path:  # the same file is contained twice, the later one wins.
+            self._collect(self.pending_by_path[path])
+        fh_member = tar.extractfile(member)
+        if self.executor is None or member.size > self.max_pending_bytes:
+            _write_tar_member(path, fh_member, member.mode, member.mtime)
+            return
+        while len(self.pending) > 0 and self.pending_bytes + member.size > self.max_pending_bytes:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self._collect(future)
+        # the stream only moves forward, so the data must be read before the next member.
+        data = fh_member.read()
+        future = self.executor.submit(_write_tar_member, path, data, member.mode, member.mtime)
+        self.pending[future] = (path, member.size)
+        self.pending_by_path[path] = future
+        self.pending_bytes += member.size
+
+    def extract_link(self, member: tarfile.TarInfo, path: str) -> None:
+        self.wait_for_pending()
+        if member.issym():
+            link_target = os.path.join(os.path.dirname(path), member.linkname)
+        else:
+            link_target = os.path.join(self.target_dir, member.linkname)
+        real_target = os.path.realpath(link_target)
+        if os.path.commonpath([self.target_dir, real_target]) != self.target_dir:
+            raise ValueError(f"Refusing to extract link {member.name} -> {member.linkname}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.lexists(path):
+            os.unlink(path)
+        if member.issym():
+            os.symlink(member.linkname, path)
+            self.safe_parents.clear()  # the new symlink may be part of known parents
+            return
+        if not os.path.exists(real_target):
+            logger.warning(f"Skipping hardlink {member.name}, target {member.linkname} missing")
+            return
+        os.link(real_target, path)
+
+    def _collect(self, future: Future) -> None:
+        path, size = self.pending.pop(future)
+        del self.pending_by_path[path]
+        self.pending_bytes -= size
+        future.result()
+
+    def wait_for_pending(self) -> None:
+        for future in list(self.pending):
+            self._collect(future)
+
+    def close(self) -> None:
+        self.wait_for_pending()
+        if self.executor is not None:
+            self.executor.shutdown()
+        # set directory times at the end, since extracting files into them changes them.
+        for member in sorted(self.dirs, key=lambda m: m.name, reverse=True):
+            path = self.get_safe_path(member.name)
+            os.chmod(path, member.mode & 0o777)
+            os.utime(path, (member.mtime, member.mtime))
+
+
+def _write_tar_member(
+    path: str, data_or_fh: Union[bytes, BinaryIO], mode: int, mtime: float
+) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.islink(path):
+        os.unlink(path)
+    with open(path, "wb") as fh:
+        if isinstance(data_or_fh, bytes):
+            fh.write(data_or_fh)
+        else:
+            shutil.copyfileobj(data_or_fh, fh, 1024**2)
+    os.chmod(path, mode & 0o777)
+    os.utime(path, (mtime, mtime))
+
+
+def create_tar_zst(
+    root: PathType,
+    out_file: PathType,
+    pathspec_args: PathSpecArgs | dict | None = None,
+    level: int = 3,
+    threads: int = -1,
+    volume_size: Optional[int] = None,
+    follow_symlinks: bool = False,
+    verbose: bool = True,
+) -> list[Path]:
+    """
+    Pack all files in a directory into a zstd-compressed tar, streaming files in chunks so no
+    file is ever fully held in memory. Empty directories are not included.
 
+    Args:
+        root: directory to pack, paths in the archive are relative to it.
+        out_file: output file e.g. "archive.tar.zst"
+        pathspec_args: optional pathspec arguments to filter files, see make_index
+        level: zstd compression level
+        threads: zstd compression threads, default -1 = all cores
+        volume_size: split the output into volumes of at most this size in bytes, named
+            archive.tar.zst.000, archive.tar.zst.001, ... Concatenated volumes form the archive
+            (e.g. cat archive.tar.zst.* | zstd -d | tar -x).
+        follow_symlinks: pack the targets of symlinks, default False = skip symlinks
+        verbose: show progress
 
-def dump_xz(data, file, mode: str = "wt", encoding: str = "utf-8"):
+    Returns:
+        list of output files written
+    """
+    from packg.iotools.file_indexer import make_index
+
+    root = Path(root).absolute()
+    out_file = Path(out_file).absolute()
+    file_index = make_index(
+        root, verbose=verbose, pathspec_args=pathspec_args, follow_symlinks=follow_symlinks
+    )
+    out_rel = out_file.relative_to(root).as_posix() if out_file.is_relative_to(root) else None
+    if volume_size is None:
+        fh_out = out_file.open("wb")
+    else:
+        fh_out = VolumeWriter(out_file, volume_size)
+    pbar = tqdm(
+        total=sum(props.size for props in file_index.values()),
+        desc=f"Packing {out_file.name}",
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+        disable=not verbose,
+    )
+    compressor = ZstdCompressorWrapper(level=level, threads=threads)
+    try:
+        with io.BufferedWriter(CompressorWriter(fh_out, compressor), 1024**2) as fh:
+            with tarfile.open(fileobj=fh, mode="w|", dereference=follow_symlinks) as tar:
+                for rel_file, props in file_index.items():
+                    if out_rel is not None and (
+                        rel_file == out_rel or rel_file.startswith(f"{out_rel}.")
+                    ):
+                        continue  # do not pack the archive into itself
+                    tar.add(root / rel_file, arcname=rel_file, recursive=False)
+                    pbar.update(props.size)
+    except BaseException:
+        # remove the partial output, also on KeyboardInterrupt
+        fh_out.close()
+        for file in [out_file] if volume_size is None else fh_out.files:
+            file.unlink(missing_ok=True)
+        raise
+    finally:
+        pbar.close()
+    fh_out.close()
+    if volume_size is None:
+        return [out_file]
+    return fh_out.files
+
+
+def load_xz(file, mode: str = "rt", encoding: str = "utf-8", threads: int = 0):
+    """
+    Args:
+        file: file name or open binary file-like object
+        mode: "rt" for text or "rb" for bytes
+        encoding: encoding for text mode
+        threads: decompress the streams of multi-stream files in parallel, see dump_xz.
+            0 = single-threaded, -1 = all cores
+    """
     if "b" in mode:
         encoding = None
-    with lzma.open(file, mode, encoding=encoding) as fh:
-        fh.write(data)
+    if threads == 0:
+        with lzma.open(file, mode, encoding=encoding) as fh:
+            data_str = fh.read()
+        return data_str
+    data_bytes = decompress_file_to_bytes(file, CompressorC.LZMA, threads=threads)
+    if encoding is None:
+        return data_bytes
+    # same newline handling as the text mode of lzma.open
+    return io.TextIOWrapper(io.BytesIO(data_bytes), encoding=encoding).read()
+
+
+def dump_xz(
+    data,
+    file,
+    mode: str = "wt",
+    encoding: str = "utf-8",
+    threads: int = 0,
+    level: Optional[int] = None,
+    block_size: int = 8 * 1024**2,
+):
+    """
+    Args:
+        data: str or bytes to write
+        file: file name or open binary file-like object
+        mode: "wt", "at", "wb" or "ab"
+        encoding: encoding for text mode
+        threads: compress blocks in parallel, see LzmaCompressorWrapper.
+            0 = single-threaded, -1 = all cores
+        level: compression preset 0-9, default None = 6
+        block_size: size of the independently compressed blocks in bytes, used if threads != 0
+    """
+    if "b" in mode:
+        encoding = None
+    if threads == 0:
+        with lzma.open(file, mode, encoding=encoding, preset=level) as fh:
+            fh.write(data)
+        return
+    if isinstance(data, str):
+        data = data.encode(encoding)
+    # appending a new stream to an xz file gives a valid multi-stream file.
+    mode = "ab" if "a" in mode else "wb"
+    compressed = compress_data_to_bytes(
+        data, CompressorC.LZMA, threads=threads, level=level, block_size=block_size
+    )
+    with open_file_or_io(file, mode=mode) as fh:
+        fh.write(compressed)
 
 
 class CompressorC(Const, str):
@@ -59,6 +374,90 @@ class CompressorC(Const, str):
     LZMA = "lzma"
     ZSTD = "zstd"
     ZSTD_SLOW = "zstd_slow"
+    GZIP = "gzip"
+    BZ2 = "bz2"
+
+
+class OptionalCompressorC(Const, str):
+    """Codecs that are only registered if their package is installed."""
+
+    LZ4 = "lz4"
+
+
+@define
+class Codec:
+    """
+    Args:
+        name: name of the codec
+        compressor_cls: creates the compressor, gets the kwargs of get_compressor
+        decompressor_cls: creates the decompressor, gets the kwargs of get_decompressor
+        suffixes: file suffixes, the first one is the default suffix for new files
+        default_kwargs: defaults for the compressor e.g. level
+        uses_size: compressor accepts the size of the data
+        supports_threads: compressor accepts threads
+        supports_dict: compressor and decompressor accept dict_data
+    """
+
+    name: str
+    compressor_cls: Callable[..., CompressorInterface]
+    decompressor_cls: Callable[..., DecompressorInterface]
+    suffixes: tuple[str, ...] = ()
+    default_kwargs: dict = field(factory=dict)
+    uses_size: bool = False
+    supports_threads: bool = False
+    supports_dict: bool = False
+
+
+CODECS: dict[str, Codec] = {}
+COMPRESSOR_SUFFIXES: dict[str, str] = {}
+
+
+def register_codec(codec: Codec, overwrite: bool = False) -> None:
+    """
+    Make a codec available by name in get_compressor, get_decompressor and for file suffixes.
+    Suffixes that are already registered stay with their first codec.
+    """
+    if codec.name in CODECS and not overwrite:
+        raise ValueError(f"Codec {codec.name} is already registered")
+    CODECS[codec.name] = codec
+    for suffix in codec.suffixes:
+        COMPRESSOR_SUFFIXES.setdefault(suffix, codec.name)
+
+
+def get_available_compressors() -> list[str]:
+    """
+    Returns:
+        names of all registered codecs, optional codecs are only registered if installed.
+    """
+    return list(CODECS.keys())
+
+
+def _get_codec(compressor_name: str) -> Codec:
+    if compressor_name not in CODECS:
+        hint = ""
+        if compressor_name in OptionalCompressorC.values():
+            hint = ", it needs an optional dependency that is not installed"
+        raise ValueError(f"Unknown compressor {compressor_name}{hint}")
+    return CODECS[compressor_name]
+
+
+def get_compressor_name_from_filename(file: PathType) -> Optional[str]:
+    """
+    Returns:
+        compressor name for the file suffix (e.g. "zstd" for data.tar.zst) or None if unknown.
+    """
+    return COMPRESSOR_SUFFIXES.get(Path(file).suffix.lower())
+
+
+def get_suffix_for_compressor_name(compressor_name: str) -> str:
+    """
+    Returns:
+        default file suffix for the compressor (e.g. ".zst" for "zstd")
+    """
+    codec = _get_codec(compressor_name)
+    if len(codec.suffixes) == 0:
+        raise ValueError(f"No file suffix for compressor {compressor_name}")
+    return codec.suffixes[0]
 
 
 class CompressorInterface:
@@ -83,6 +482,124 @@ class DecompressorInterface:
         return self.decompress(data)
 
 
+class DecompressorReader(io.RawIOBase):
+    """
+    Read-only binary file-like object that decompresses another file-like object on the fly.
+
+    Usage:
+        with open("data.tar.zst", "rb") as fh_raw:
+            fh = DecompressorReader(fh_raw, get_decompressor(CompressorC.ZSTD))
+            tar = tarfile.open(fileobj=fh, mode="r|")
+
+    Args:
+        fh: binary file-like object with the compressed data
+        decompressor: decompressor, see get_decompressor
+        chunk_size: size of compressed chunks to read at once
+    """
+
+    def __init__(
+        self, fh: BinaryIO, decompressor: DecompressorInterface, chunk_size: int = 1024**2
+    ):
+        super().__init__()
+        self.fh = fh
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self._buffer = memoryview(b"")
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self._buffer) == 0 and not self._eof:
+            compressed = self.fh.read(self.chunk_size)
+            if len(compressed) == 0:
+                self._buffer = memoryview(self.decompressor.flush())
+                self._eof = True
+            else:
+                self._buffer = memoryview(self.decompressor.decompress(compressed))
+        n_bytes = min(len(buffer), len(self._buffer))
+        buffer[:n_bytes] = self._buffer[:n_bytes]
+        self._buffer = self._buffer[n_bytes:]
+        return n_bytes
+
+
+class CompressorWriter(io.RawIOBase):
+    """
+    Write-only binary file-like object that compresses data on the fly into another file-like
+    object. Closing it writes the end of the compressed stream, the target is not closed.
+
+    Args:
+        fh: binary file-like object to write the compressed data to
+        compressor: compressor, see get_compressor
+    """
+
+    def __init__(self, fh: BinaryIO, compressor: CompressorInterface):
+        super().__init__()
+        self.fh = fh
+        self.compressor = compressor
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.fh.write(self.compressor.compress(bytes(data)))
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.fh.write(self.compressor.flush())
+        super().close()
+
+
+class VolumeWriter(io.RawIOBase):
+    """
+    Write-only binary file-like object that splits the output into files of at most volume_size
+    bytes, named file.000, file.001, ...
+
+    Args:
+        file: base name of the output files
+        volume_size: maximum size of each file in bytes
+    """
+
+    def __init__(self, file: PathType, volume_size: int):
+        super().__init__()
+        assert volume_size > 0, f"volume_size must be positive but is {volume_size}"
+        self.file = Path(file)
+        self.volume_size = volume_size
+        self.files: list[Path] = []
+        self._fh: Optional[BinaryIO] = None
+        self._written = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = memoryview(data)
+        n_bytes = len(data)
+        while len(data) > 0:
+            if self._fh is None or self._written >= self.volume_size:
+                self._next_volume()
+            n_write = min(len(data), self.volume_size - self._written)
+            self._fh.write(data[:n_write])
+            self._written += n_write
+            data = data[n_write:]
+        return n_bytes
+
+    def _next_volume(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        volume_file = self.file.parent / f"{self.file.name}.{len(self.files):03d}"
+        self._fh = volume_file.open("wb")
+        self.files.append(volume_file)
+        self._written = 0
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+        super().close()
+
+
 def decompress_file_to_bytes(file_or_io, compressor_name: str, **compressor_kwargs) -> bytes:
     data_bytes_compressed = read_bytes_from_file_or_io(file_or_io)
     return decompress_bytes_to_bytes(data_bytes_compressed, compressor_name, **compressor_kwargs)
@@ -134,47 +651,62 @@ def compress_data_to_file(
         fh.write(data_bytes)
 
 
-# noinspection PyArgumentList
-def get_compressor(compressor_name: str, size: int = -1, **kwargs) -> CompressorInterface:
+def get_compressor(
+    compressor_name: str,
+    size: int = -1,
+    dict_data: Optional[bytes] = None,
+    level: Optional[int] = None,
+    threads: Optional[int] = None,
+    **kwargs,
+) -> CompressorInterface:
     """
     Args:
-        compressor_name: name of the algorithm
+        compressor_name: name of the algorithm, see get_available_compressors
         size: total size of the data that will be compressed.
             some compression algorithms can benefit from knowing this. default -1 = unknown
-        **kwargs: parameters for the specific compressor
+        dict_data: optional zstd dictionary, see train_zstd_dictionary
+        level: compression level, default None = the default of the codec
+        threads: number of threads for codecs that support it, 0 = single-threaded, -1 = all cores
+        **kwargs: other parameters for the specific compressor
 
     Returns:
         compressor
     """
-    if compressor_name == CompressorC.NONE:
-        return DummyCompressor(**kwargs)
-    if compressor_name == CompressorC.LZMA:
-        return LzmaCompressorWrapper(**kwargs)
-    if compressor_name == CompressorC.ZSTD:
-        return ZstdCompressorWrapper(size=size, **kwargs)
-    if compressor_name == CompressorC.ZSTD_SLOW:
-        return ZstdCompressorWrapper(size=size, level=9, **kwargs)
-    raise ValueError(f"Unknown compressor {compressor_name}")
-
-
-# noinspection PyArgumentList
-def get_decompressor(compressor_name: str, **kwargs) -> DecompressorInterface:
+    codec = _get_codec(compressor_name)
+    if dict_data is not None:
+        if not codec.supports_dict:
+            raise ValueError(f"Compressor {compressor_name} does not support dictionaries")
+        kwargs["dict_data"] = dict_data
+    if threads not in (None, 0):
+        if not codec.supports_threads:
+            raise ValueError(f"Compressor {compressor_name} does not support threads")
+        kwargs["threads"] = threads
+    if level is not None:
+        kwargs["level"] = level
+    if codec.uses_size:
+        kwargs["size"] = size
+    return codec.compressor_cls(**{**codec.default_kwargs, **kwargs})
+
+
+def get_decompressor(
+    compressor_name: str, dict_data: Optional[bytes] = None, **kwargs
+) -> DecompressorInterface:
     """
 
     Args:
-        compressor_name: name of the algorithm
+        compressor_name: name of the algorithm, see get_available_compressors
+        dict_data: optional zstd dictionary, must be the same as used for compression
         **kwargs: parameters for the specific decompressor
 
     Returns:
         decompressor
     """
-    if compressor_name == CompressorC.NONE:
-        return DummyDecompressor(**kwargs)
-    if compressor_name == CompressorC.LZMA:
-        return LzmaDecompressorWrapper(**kwargs)
-    if compressor_name in (CompressorC.ZSTD, CompressorC.ZSTD_SLOW):
-        return ZstdDecompressorWrapper(**kwargs)
-    raise ValueError(f"Unknown compressor {compressor_name}")
+    codec = _get_codec(compressor_name)
+    if dict_data is not None:
+        if not codec.supports_dict:
+            raise ValueError(f"Compressor {compressor_name} does not support dictionaries")
+        kwargs["dict_data"] = dict_data
+    return codec.decompressor_cls(**kwargs)
 
 
 class DummyCompressor(CompressorInterface):
@@ -191,47 +723,1097 @@ class DummyDecompressor(DecompressorInterface):
 
 
 class ZstdCompressorWrapper(CompressorInterface):
-    def __init__(self, size=-1, level=3, threads=0):
-        self.cctx = zstandard.ZstdCompressor(level=level, threads=threads)
-        self.compressor = self.cctx.compressobj(size=size)
+    """
+    Args:
+        size: total size of the data that will be compressed, default -1 = unknown
+        level: compression level
+        threads: number of threads, 0 = single-threaded, -1 = all cores
+        dict_data: optional dictionary created with train_zstd_dictionary
+    """
+
+    def __init__(self, size=-1, level=3, threads=0, dict_data: Optional[bytes] = None):
+        self.size = size
+        self.level = level
+        self.threads = threads
+        self.dict_data = dict_data
+        self.cctx = None
+        self.compressor = None
 
     def compress(self, data: bytes) -> bytes:
+        if self.compressor is None:
+            # streaming needs its own context, the cached ones are shared by one-shot calls.
+            self.cctx = _create_zstd_cctx(self.level, self.threads, self.dict_data)
+            self.compressor = self.cctx.compressobj(size=self.size)
         return self.compressor.compress(data)
 
     def flush(self) -> bytes:
-        return self.compressor.flush(zstandard.FLUSH_FRAME)
+        return b"".join([self.compress(b""), self.compressor.flush(zstandard.FLUSH_FRAME)])
+
+    def compress_once(self, data: bytes) -> bytes:
+        if self.compressor is not None:
+            return super().compress_once(data)
+        return _get_cached_zstd_cctx(self.level, self.threads, self.dict_data).compress(data)
 
 
 class ZstdDecompressorWrapper(DecompressorInterface):
-    def __init__(self):
-        self.cctx = zstandard.ZstdDecompressor()
-        self.decompressor = self.cctx.decompressobj()
+    def __init__(self, dict_data: Optional[bytes] = None):
+        self.dict_data = dict_data
+        self.cctx = None
+        self.decompressor = None
 
     def decompress(self, data: bytes) -> bytes:
-        return self.decompressor.decompress(data)
+        if self.cctx is None:
+            self.cctx = _create_zstd_dctx(self.dict_data)
+        # a decompressobj stops after one frame, so start a new one for multi-frame data.
+        outputs = []
+        while True:
+            if self.decompressor is None or self.decompressor.eof:
+                self.decompressor = self.cctx.decompressobj()
+            outputs.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data
+            if not self.decompressor.eof or len(data) == 0:
+                break
+        return b"".join(outputs)
+
+    def decompress_once(self, data: bytes) -> bytes:
+        if self.decompressor is not None:
+            return self.decompress(data)
+        dctx = _get_cached_zstd_dctx(self.dict_data)
+        outputs = []
+        while len(data) > 0:
+            decompressor = dctx.decompressobj()
+            outputs.append(decompressor.decompress(data))
+            if not decompressor.eof:
+                break
+            data = decompressor.unused_data
+        return b"".join(outputs)
+
+
+def train_zstd_dictionary(
+    samples: list[Union[str, bytes]],
+    dict_size: int = 112640,
+    encoding: str = "utf-8",
+    **kwargs,
+) -> bytes:
+    """
+    Train a zstd dictionary to compress many small records of similar content.
+    Needs a few thousand samples, and the dictionary should be ~100x smaller than the samples.
+
+    Args:
+        samples: list of example records
+        dict_size: maximum size of the dictionary in bytes, default 110KB like the zstd cli
+        encoding: encoding for str samples
+        **kwargs: passed to zstandard.train_dictionary e.g. level, threads
+
+    Returns:
+        dictionary as bytes, to be passed as dict_data to get_compressor and get_decompressor.
+    """
+    samples = [s.encode(encoding) if isinstance(s, str) else s for s in samples]
+    zdict = zstandard.train_dictionary(dict_size, samples, **kwargs)
+    return zdict.as_bytes()
+
+
+def save_zstd_dictionary(dict_data: bytes, file_or_io, create_parent: bool = False) -> None:
+    """Save in the raw format, which is also readable by the zstd cli (zstd -D file)."""
+    with open_file_or_io(file_or_io, mode="wb", create_parent=create_parent) as fh:
+        fh.write(dict_data)
+
+
+def load_zstd_dictionary(file_or_io) -> bytes:
+    return read_bytes_from_file_or_io(file_or_io)
+
+
+_zstd_local = threading.local()
+# contexts per thread for each of compression and decompression. each context keeps its
+# dictionary alive, so the cache is small to not keep the dictionaries of finished work around
+_ZSTD_CONTEXTS_PER_THREAD = 8
+
+
+@lru_cache(maxsize=32)
+def _get_zstd_compression_dict(
+    dict_data: bytes, level: Optional[int] = None
+) -> zstandard.ZstdCompressionDict:
+    zdict = zstandard.ZstdCompressionDict(dict_data)
+    if level is not None:
+        zdict.precompute_compress(level=level)
+    return zdict
+
+
+def _create_zstd_cctx(
+    level: int, threads: int, dict_data: Optional[bytes]
+) -> zstandard.ZstdCompressor:
+    if dict_data is None:
+        return zstandard.ZstdCompressor(level=level, threads=threads)
+    zdict = _get_zstd_compression_dict(dict_data, level)
+    return zstandard.ZstdCompressor(level=level, threads=threads, dict_data=zdict)
+
+
+def _create_zstd_dctx(dict_data: Optional[bytes]) -> zstandard.ZstdDecompressor:
+    if dict_data is None:
+        return zstandard.ZstdDecompressor()
+    return zstandard.ZstdDecompressor(dict_data=_get_zstd_compression_dict(dict_data))
+
+
+def _get_cached_zstd_cctx(
+    level: int, threads: int, dict_data: Optional[bytes]
+) -> zstandard.ZstdCompressor:
+    """
+    Reuse contexts for one-shot compression, which saves the setup cost for small records.
+    Contexts are not thread-safe, so they are cached per thread. Each thread keeps the
+    _ZSTD_CONTEXTS_PER_THREAD most recently used contexts until the thread ends.
+    """
+    key = (level, threads, dict_data)
+    return _get_thread_cached("cctxs", key, partial(_create_zstd_cctx, level, threads, dict_data))
+
+
+def _get_cached_zstd_dctx(dict_data: Optional[bytes]) -> zstandard.ZstdDecompressor:
+    return _get_thread_cached("dctxs", dict_data, partial(_create_zstd_dctx, dict_data))
+
+
+def _get_thread_cached(cache_name: str, key, create_fn: Callable):
+    """Get a value from a small LRU cache of the current thread."""
+    cache = getattr(_zstd_local, cache_name, None)
+    if cache is None:
+        cache = OrderedDict()
+        setattr(_zstd_local, cache_name, cache)
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+        return value
+    value = create_fn()
+    cache[key] = value
+    if len(cache) > _ZSTD_CONTEXTS_PER_THREAD:
+        cache.popitem(last=False)
+    return value
 
 
 class LzmaCompressorWrapper(CompressorInterface):
-    def __init__(self):
-        self.lzc = lzma.LZMACompressor()
+    """
+    Args:
+        level: compression preset 0-9, default None = 6
+        threads: number of threads, 0 = single-threaded, -1 = all cores
+        block_size: size of the independently compressed blocks in bytes, used if threads != 0
+
+    With threads, the input is cut into blocks which are compressed in parallel, each into its own
+    xz stream. Concatenated xz streams are a valid xz file which any decompressor can read, and
+    LzmaDecompressorWrapper can decompress the streams in parallel again. The ratio is slightly
+    worse, since the blocks cannot reference each other's data.
+    """
+
+    def __init__(
+        self, level: Optional[int] = None, threads: int = 0, block_size: int = 8 * 1024**2
+    ):
+        self.level = level
+        self.threads = os.cpu_count() if threads < 0 else threads
+        self.block_size = block_size
+        self.lzc = lzma.LZMACompressor(preset=level) if self.threads == 0 else None
+        self.buffer = bytearray()
+        self.num_streams = 0
+        self.executor = None
 
     def compress(self, data: bytes) -> bytes:
-        return self.lzc.compress(data)
+        if self.lzc is not None:
+            return self.lzc.compress(data)
+        self.buffer += data
+        num_blocks = len(self.buffer) // self.block_size
+        if num_blocks < self.threads:
+            return b""
+        return self._compress_blocks(num_blocks)
 
     def flush(self) -> bytes:
-        return self.lzc.flush()
+        if self.lzc is not None:
+            return self.lzc.flush()
+        # empty input still needs one stream to be a valid xz file
+        num_blocks = -(-len(self.buffer) // self.block_size)
+        output = self._compress_blocks(max(num_blocks, int(self.num_streams == 0)))
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        return output
+
+    def _compress_blocks(self, num_blocks: int) -> bytes:
+        size = min(num_blocks * self.block_size, len(self.buffer))
+        blocks = [
+            bytes(self.buffer[start : start + self.block_size])
+            for start in range(0, size, self.block_size)
+        ]
+        blocks += [b""] * (num_blocks - len(blocks))
+        del self.buffer[:size]
+        self.num_streams += len(blocks)
+        if len(blocks) <= 1 or self.threads == 1:
+            return b"".join(_compress_xz_block(block, self.level) for block in blocks)
+        if self.executor is None:
+            # lzma releases the GIL while compressing, so threads scale without pickling the data.
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        return b"".join(
+            self.executor.map(_compress_xz_block, blocks, [self.level] * len(blocks))
+        )
+
+
+class MultiStreamDecompressorWrapper(DecompressorInterface):
+    """
+    Base class for decompressors that stop at the end of a stream (or frame or member), to read
+    concatenated streams as written by e.g. cat a.gz b.gz > c.gz
+    """
 
+    stream_padding: bytes = b""
 
-class LzmaDecompressorWrapper(DecompressorInterface):
     def __init__(self):
-        self.lzd = lzma.LZMADecompressor()
+        self.decompressor = self._create_decompressor()
+
+    def _create_decompressor(self):
+        raise NotImplementedError
 
     def decompress(self, data: bytes) -> bytes:
-        return self.lzd.decompress(data)
+        outputs = []
+        while True:
+            if self.decompressor.eof:
+                if len(self.stream_padding) > 0:
+                    data = data.lstrip(self.stream_padding)
+                if len(data) == 0:
+                    break
+                self.decompressor = self._create_decompressor()
+            outputs.append(self.decompressor.decompress(data))
+            # lz4 returns None instead of empty bytes
+            data = self.decompressor.unused_data or b""
+            if not self.decompressor.eof or len(data) == 0:
+                break
+        return b"".join(outputs)
+
+
+class LzmaDecompressorWrapper(MultiStreamDecompressorWrapper):
+    """
+    Args:
+        threads: number of threads for decompress_once, 0 = single-threaded, -1 = all cores.
+            Only multi-stream files as written by LzmaCompressorWrapper with threads can be
+            decompressed in parallel, other files are decompressed single-threaded.
+    """
+
+    # streams can be separated by null bytes
+    stream_padding = b"\x00"
+
+    def __init__(self, threads: int = 0):
+        super().__init__()
+        self.threads = os.cpu_count() if threads < 0 else threads
+
+    def _create_decompressor(self):
+        return lzma.LZMADecompressor()
+
+    def decompress_once(self, data: bytes) -> bytes:
+        if self.threads == 0:
+            return self.decompress(data)
+        return decompress_xz_parallel(data, self.threads)
+
+
+_XZ_HEADER_MAGIC = b"\xfd7zXZ\x00"
+_XZ_FOOTER_MAGIC = b"YZ"
+_XZ_HEADER_SIZE = 12
+
+
+def _compress_xz_block(block: bytes, level: Optional[int] = None) -> bytes:
+    return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+
+
+def decompress_xz_parallel(data: bytes, threads: int = -1) -> bytes:
+    """
+    Decompress the streams of a multi-stream xz file in parallel.
+
+    Args:
+        data: compressed data
+        threads: number of threads, -1 = all cores
+
+    Returns:
+        decompressed data
+    """
+    try:
+        ranges = find_xz_streams(data)
+    except ValueError as e:
+        logger.debug(f"Cannot find xz streams ({e}), decompressing single-threaded")
+        ranges = None
+    if ranges is None or len(ranges) <= 1:
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    view = memoryview(data)
+    streams = [view[start:stop] for start, stop in ranges]
+    threads = os.cpu_count() if threads < 0 else threads
+    with ThreadPoolExecutor(max_workers=min(threads, len(streams))) as executor:
+        return b"".join(executor.map(_decompress_xz_stream, streams))
+
+
+def _decompress_xz_stream(stream: bytes) -> bytes:
+    return lzma.decompress(stream, format=lzma.FORMAT_XZ)
+
+
+def find_xz_streams(data: bytes) -> list[tuple[int, int]]:
+    """
+    Find the streams in xz data by walking backwards over the stream footers and indexes,
+    without decompressing anything.
+
+    Args:
+        data: compressed data
+
+    Returns:
+        list of (start, stop) byte positions of the streams, in file order
+
+    Raises:
+        ValueError: if the data is not a valid xz file
+    """
+    ranges = []
+    pos = len(data)
+    while pos > 0:
+        # skip stream padding, which is a multiple of 4 null bytes
+        while pos >= 4 and data[pos - 4 : pos] == b"\x00\x00\x00\x00":
+            pos -= 4
+        if pos == 0:
+            break
+        footer_start = pos - _XZ_HEADER_SIZE
+        if footer_start < _XZ_HEADER_SIZE or data[pos - 2 : pos] != _XZ_FOOTER_MAGIC:
+            raise ValueError(f"No xz stream footer at position {pos}")
+        (backward_size,) = struct.unpack_from("<I", data, footer_start + 4)
+        index_start = footer_start - (backward_size + 1) * 4
+        if index_start < _XZ_HEADER_SIZE or data[index_start] != 0:
+            raise ValueError(f"No xz index at position {index_start}")
+        num_records, index_pos = _read_xz_varint(data, index_start + 1)
+        blocks_size = 0
+        for _ in range(num_records):
+            unpadded_size, index_pos = _read_xz_varint(data, index_pos)
+            _uncompressed_size, index_pos = _read_xz_varint(data, index_pos)
+            blocks_size += -(-unpadded_size // 4) * 4
+        stream_start = index_start - blocks_size - _XZ_HEADER_SIZE
+        if stream_start < 0 or data[stream_start : stream_start + 6] != _XZ_HEADER_MAGIC:
+            raise ValueError(f"No xz stream header at position {stream_start}")
+        ranges.append((stream_start, pos))
+        pos = stream_start
+    if len(ranges) == 0:
+        raise ValueError("No xz streams found")
+    return ranges[::-1]
+
+
+def _read_xz_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    for shift in range(0, 63, 7):
+        if pos >= len(data):
+            break
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+    raise ValueError(f"Invalid xz variable-length integer before position {pos}")
+
+
+class GzipCompressorWrapper(CompressorInterface):
+    def __init__(self, level: int = 6):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+class GzipDecompressorWrapper(MultiStreamDecompressorWrapper):
+    def _create_decompressor(self):
+        return zlib.decompressobj(31)
+
+
+class Bz2CompressorWrapper(CompressorInterface):
+    def __init__(self, level: int = 9):
+        self.compressor = bz2.BZ2Compressor(level)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.compressor.flush()
+
+
+class Bz2DecompressorWrapper(MultiStreamDecompressorWrapper):
+    def _create_decompressor(self):
+        return bz2.BZ2Decompressor()
+
+
+class Lz4CompressorWrapper(CompressorInterface):
+    """Needs the optional lz4 package."""
+
+    def __init__(self, level: int = 0):
+        import lz4.frame
+
+        self.compressor = lz4.frame.LZ4FrameCompressor(compression_level=level)
+        self.started = False
+
+    def compress(self, data: bytes) -> bytes:
+        if not self.started:
+            self.started = True
+            return b"".join([self.compressor.begin(), self.compressor.compress(data)])
+        return self.compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return b"".join([self.compress(b""), self.compressor.flush()])
+
+
+class Lz4DecompressorWrapper(MultiStreamDecompressorWrapper):
+    """Needs the optional lz4 package."""
+
+    def _create_decompressor(self):
+        import lz4.frame
+
+        return lz4.frame.LZ4FrameDecompressor()
+
+
+register_codec(Codec(CompressorC.NONE, DummyCompressor, DummyDecompressor))
+register_codec(
+    Codec(
+        CompressorC.ZSTD,
+        ZstdCompressorWrapper,
+        ZstdDecompressorWrapper,
+        suffixes=(".zst", ".zstd"),
+        uses_size=True,
+        supports_threads=True,
+        supports_dict=True,
+    )
+)
+register_codec(
+    Codec(
+        CompressorC.ZSTD_SLOW,
+        ZstdCompressorWrapper,
+        ZstdDecompressorWrapper,
+        suffixes=(".zst",),
+        default_kwargs={"level": 9},
+        uses_size=True,
+        supports_threads=True,
+        supports_dict=True,
+    )
+)
+register_codec(
+    Codec(
+        CompressorC.LZMA,
+        LzmaCompressorWrapper,
+        LzmaDecompressorWrapper,
+        suffixes=(".xz", ".lzma"),
+        supports_threads=True,
+    )
+)
+register_codec(
+    Codec(CompressorC.GZIP, GzipCompressorWrapper, GzipDecompressorWrapper, suffixes=(".gz",))
+)
+register_codec(
+    Codec(CompressorC.BZ2, Bz2CompressorWrapper, Bz2DecompressorWrapper, suffixes=(".bz2",))
+)
+if importlib.util.find_spec("lz4") is not None:
+    register_codec(
+        Codec(
+            OptionalCompressorC.LZ4,
+            Lz4CompressorWrapper,
+            Lz4DecompressorWrapper,
+            suffixes=(".lz4",),
+        )
+    )
+
+
+class GoalC(Const):
+    SPEED = "speed"
+    RATIO = "ratio"
+    BALANCED = "balanced"
+
+
+@define
+class CodecBenchmark:
+    """Result of benchmark_codecs, times are the best of the repeats."""
+
+    name: str
+    level: Optional[int]
+    size_in: int
+    size_out: int
+    compress_seconds: float
+    decompress_seconds: float
+
+    @property
+    def ratio(self) -> float:
+        return self.size_in / max(self.size_out, 1)
+
+    @property
+    def compress_speed(self) -> float:
+        """In bytes per second of uncompressed data"""
+        return self.size_in / max(self.compress_seconds, 1e-9)
+
+    @property
+    def decompress_speed(self) -> float:
+        """In bytes per second of uncompressed data"""
+        return self.size_in / max(self.decompress_seconds, 1e-9)
+
+    def get_cost(self, goal: str, io_speed: float) -> tuple[float, float]:
+        total_seconds = self.compress_seconds + self.decompress_seconds
+        if goal == GoalC.SPEED:
+            return total_seconds, self.size_out
+        if goal == GoalC.RATIO:
+            return self.size_out, total_seconds
+        if goal == GoalC.BALANCED:
+            return total_seconds + self.size_out / io_speed, self.size_out
+        raise ValueError(f"Unknown goal: {goal}, must be one of {GoalC.values_list()}")
+
+
+def benchmark_codecs(
+    sample: Union[str, bytes],
+    candidates: Optional[list[Union[str, tuple[str, Optional[int]]]]] = None,
+    repeats: int = 3,
+    encoding: str = "utf-8",
+) -> list[CodecBenchmark]:
+    """
+    Measure ratio and speed of codecs on a sample, single-threaded.
+
+    Args:
+        sample: data to compress, should be representative and at least a few hundred KB
+        candidates: list of codec names or (codec name, level) tuples.
+            default None = all available codecs except "none" with their default level
+        repeats: repeat the measurements and use the fastest time
+        encoding: encoding for str samples
+
+    Returns:
+        list of benchmark results, in the order of the candidates
+    """
+    if isinstance(sample, str):
+        sample = sample.encode(encoding)
+    if candidates is None:
+        candidates = [name for name in get_available_compressors() if name != CompressorC.NONE]
+    results = []
+    for candidate in candidates:
+        name, level = (candidate, None) if isinstance(candidate, str) else candidate
+        compress_seconds, decompress_seconds = float("inf"), float("inf")
+        compressed = b""
+        for _ in range(repeats):
+            start = time.perf_counter()
+            compressed = compress_data_to_bytes(sample, name, level=level)
+            compress_seconds = min(compress_seconds, time.perf_counter() - start)
+            start = time.perf_counter()
+            decompressed = decompress_bytes_to_bytes(compressed, name)
+            decompress_seconds = min(decompress_seconds, time.perf_counter() - start)
+            if decompressed != sample:
+                raise RuntimeError(f"Codec {name} failed the round-trip of the sample")
+        results.append(
+            CodecBenchmark(
+                name, level, len(sample), len(compressed), compress_seconds, decompress_seconds
+            )
+        )
+    return results
+
+
+def auto_select_codec(
+    sample: Union[str, bytes],
+    goal: str = GoalC.BALANCED,
+    candidates: Optional[list[Union[str, tuple[str, Optional[int]]]]] = None,
+    io_speed: float = 100 * 1024**2,
+    repeats: int = 3,
+    verbose: bool = False,
+) -> CodecBenchmark:
+    """
+    Pick a codec for data similar to the sample by benchmarking the candidates on it.
+
+    Args:
+        sample: data to compress, should be representative and at least a few hundred KB
+        goal: see GoalC.
+            "speed": fastest compression plus decompression.
+            "ratio": smallest output.
+            "balanced": smallest total time, where writing and reading the compressed
+                data counts with io_speed.
+        candidates: see benchmark_codecs
+        io_speed: disk or network speed in bytes per second, for goal "balanced"
+        repeats: see benchmark_codecs
+        verbose: log all results
+
+    Returns:
+        benchmark result of the best codec, use its name and level for get_compressor
+    """
+    results = benchmark_codecs(sample, candidates, repeats=repeats)
+    results = sorted(results, key=lambda r: r.get_cost(goal, io_speed))
+    if verbose:
+        for r in results:
+            logger.info(
+                f"{r.name:10s} level={r.level} ratio={r.ratio:.2f} "
+                f"compress={r.compress_speed / 1024**2:.1f}MB/s "
+                f"decompress={r.decompress_speed / 1024**2:.1f}MB/s"
+            )
+    return results[0]
+
+
+ZSTD_SKIPPABLE_SEEK_TABLE_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC = 0x8F92EAB1
+_ZSTD_SEEK_TABLE_FOOTER = struct.Struct("<IBI")
+_ZSTD_SKIPPABLE_HEADER = struct.Struct("<II")
+
+
+class SeekableZstdWriter:
+    """
+    Write zstd data as independent frames followed by a seek table, following the zstd seekable
+    format (zstd/contrib/seekable_format). The output is a valid .zst file for any decompressor,
+    SeekableZstdReader can additionally decompress only the frames that cover a requested range.
+
+    Usage:
+        with SeekableZstdWriter("data.jsonl.zst", frame_size=4 * 1024**2) as writer:
+            for line in lines:
+                writer.write(f"{line}\n")
+
+    Args:
+        file_or_io: output file or binary file-like object
+        frame_size: uncompressed size in bytes after which a new frame is started
+        level: zstd compression level
+        threads: zstd threads used to compress a single frame
+        align_lines: only end frames after a newline, so that no line spans two frames
+        encoding: encoding used when writing str data
+    """
+
+    def __init__(
+        self,
+        file_or_io,
+        frame_size: int = 4 * 1024**2,
+        level: int = 3,
+        threads: int = 0,
+        align_lines: bool = True,
+        encoding: str = "utf-8",
+    ):
+        assert 0 < frame_size < 2**32, f"frame_size must be in (0, 2**32) but is {frame_size}"
+        self.frame_size = frame_size
+        self.align_lines = align_lines
+        self.encoding = encoding
+        self.cctx = zstandard.ZstdCompressor(level=level, threads=threads)
+        self.should_close = isinstance(file_or_io, PathTypeCls)
+        self.fh = Path(file_or_io).open("wb") if self.should_close else file_or_io
+        self.frames: list[tuple[int, int]] = []  # (compressed size, decompressed size)
+        self._buffer = bytearray()
+        self.closed = False
+
+    def write(self, data: Union[str, bytes]) -> None:
+        if isinstance(data, str):
+            data = data.encode(self.encoding)
+        self._buffer += data
+        while len(self._buffer) >= self.frame_size:
+            cut = self._find_frame_end()
+            if cut == -1:
+                break
+            self._write_frame(bytes(self._buffer[:cut]))
+            del self._buffer[:cut]
+
+    def _find_frame_end(self) -> int:
+        if not self.align_lines:
+            return self.frame_size
+        pos = self._buffer.rfind(b"\n", 0, self.frame_size)
+        if pos == -1:
+            # the current line is longer than the frame size, end the frame after it.
+            pos = self._buffer.find(b"\n", self.frame_size)
+            if pos == -1:
+                return -1
+        return pos + 1
+
+    def _write_frame(self, data: bytes) -> None:
+        assert len(data) < 2**32, f"Frame too large for the seek table: {len(data)} bytes"
+        compressed = self.cctx.compress(data)
+        self.fh.write(compressed)
+        self.frames.append((len(compressed), len(data)))
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if len(self._buffer) > 0:
+            self._write_frame(bytes(self._buffer))
+            self._buffer = bytearray()
+        table = b"".join(struct.pack("<II", c_size, d_size) for c_size, d_size in self.frames)
+        footer = _ZSTD_SEEK_TABLE_FOOTER.pack(len(self.frames), 0, ZSTD_SEEKABLE_MAGIC)
+        header = _ZSTD_SKIPPABLE_HEADER.pack(
+            ZSTD_SKIPPABLE_SEEK_TABLE_MAGIC, len(table) + len(footer)
+        )
+        self.fh.write(header + table + footer)
+        if self.should_close:
+            self.fh.close()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class SeekableZstdReader:
+    """
+    Random access into zstd files written in the seekable format (see SeekableZstdWriter).
+    Only the frames covering the requested byte or line range are decompressed.
+
+    Usage:
+        with SeekableZstdReader("data.jsonl.zst", workers=8) as reader:
+            data = reader.read_range(10_000_000, 10_001_000)
+            lines = reader.read_lines(500, 600)
+
+    Args:
+        file_or_io: input file or seekable binary file-like object
+        workers: number of threads to decompress frames in parallel (0 = foreground)
+    """
+
+    def __init__(self, file_or_io, workers: int = 0):
+        self.workers = workers
+        self.should_close = isinstance(file_or_io, PathTypeCls)
+        self.fh = Path(file_or_io).open("rb") if self.should_close else file_or_io
+        c_sizes, d_sizes = self._read_seek_table()
+        self.c_offsets = np.concatenate([[0], np.cumsum(c_sizes, dtype=np.int64)])
+        self.d_offsets = np.concatenate([[0], np.cumsum(d_sizes, dtype=np.int64)])
+        self._line_counts: Optional[np.ndarray] = None
+        self._ends_with_newline = True
+
+    def _read_seek_table(self) -> tuple[np.ndarray, np.ndarray]:
+        self.fh.seek(0, io.SEEK_END)
+        file_size = self.fh.tell()
+        if file_size < _ZSTD_SEEK_TABLE_FOOTER.size + _ZSTD_SKIPPABLE_HEADER.size:
+            raise ValueError(f"File too small to contain a zstd seek table: {file_size} bytes")
+        self.fh.seek(file_size - _ZSTD_SEEK_TABLE_FOOTER.size)
+        num_frames, descriptor, magic = _ZSTD_SEEK_TABLE_FOOTER.unpack(
+            self.fh.read(_ZSTD_SEEK_TABLE_FOOTER.size)
+        )
+        if magic != ZSTD_SEEKABLE_MAGIC:
+            raise ValueError("Not a seekable zstd file: seek table footer not found.")
+        entry_size = 12 if descriptor & 0x80 else 8
+        table_size = num_frames * entry_size
+        self.fh.seek(
+            file_size - _ZSTD_SEEK_TABLE_FOOTER.size - table_size - _ZSTD_SKIPPABLE_HEADER.size
+        )
+        skippable_magic, _ = _ZSTD_SKIPPABLE_HEADER.unpack(
+            self.fh.read(_ZSTD_SKIPPABLE_HEADER.size)
+        )
+        if skippable_magic != ZSTD_SKIPPABLE_SEEK_TABLE_MAGIC:
+            raise ValueError("Not a seekable zstd file: seek table frame not found.")
+        table = np.frombuffer(self.fh.read(table_size), dtype="<u4").reshape(num_frames, -1)
+        return table[:, 0].astype(np.int64), table[:, 1].astype(np.int64)
+
+    @property
+    def num_frames(self) -> int:
+        return len(self.c_offsets) - 1
+
+    @property
+    def size(self) -> int:
+        """Total decompressed size in bytes."""
+        return int(self.d_offsets[-1])
+
+    def _read_compressed_frames(self, frame_ids: list[int]) -> list[bytes]:
+        raw_frames = []
+        for frame_id in frame_ids:
+            self.fh.seek(int(self.c_offsets[frame_id]))
+            raw_frames.append(
+                self.fh.read(int(self.c_offsets[frame_id + 1] - self.c_offsets[frame_id]))
+            )
+        return raw_frames
+
+    def _map_frames(self, fn, frame_ids: list[int]) -> list:
+        raw_frames = self._read_compressed_frames(frame_ids)
+        max_sizes = [int(self.d_offsets[i + 1] - self.d_offsets[i]) for i in frame_ids]
+        if self.workers == 0 or len(frame_ids) <= 1:
+            return [fn(raw, max_size) for raw, max_size in zip(raw_frames, max_sizes)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # zstandard releases the GIL while decompressing, so threads run in parallel.
+            return list(executor.map(fn, raw_frames, max_sizes))
+
+    def read_frames(self, frame_ids: list[int]) -> list[bytes]:
+        return self._map_frames(_decompress_zstd_frame, frame_ids)
+
+    def read_frame(self, frame_id: int) -> bytes:
+        return self.read_frames([frame_id])[0]
+
+    def read_range(self, start: int, stop: Optional[int] = None) -> bytes:
+        """
+        Args:
+            start: first decompressed byte to read
+            stop: end of the range (exclusive), default None = until the end of the data
+
+        Returns:
+            decompressed bytes in range [start, stop)
+        """
+        stop = self.size if stop is None else min(stop, self.size)
+        if start >= stop:
+            return b""
+        first_frame = int(np.searchsorted(self.d_offsets, start, side="right")) - 1
+        last_frame = int(np.searchsorted(self.d_offsets, stop, side="left")) - 1
+        data = b"".join(self.read_frames(list(range(first_frame, last_frame + 1))))
+        offset = int(self.d_offsets[first_frame])
+        return data[start - offset : stop - offset]
+
+    def get_line_counts(self) -> np.ndarray:
+        """
+        Number of newlines per frame. Computed once by decompressing all frames, then cached.
+        Pass the result to set_line_counts of another reader to reuse it for the same file.
+        """
+        if self._line_counts is None:
+            counts_and_ends = self._map_frames(
+                _count_newlines_in_zstd_frame, list(range(self.num_frames))
+            )
+            self._line_counts = np.array([count for count, _ in counts_and_ends], dtype=np.int64)
+            self._ends_with_newline = len(counts_and_ends) == 0 or counts_and_ends[-1][1]
+        return self._line_counts
+
+    def set_line_counts(self, line_counts: np.ndarray, ends_with_newline: bool = True) -> None:
+        assert len(line_counts) == self.num_frames, (
+            f"Got {len(line_counts)} line counts for {self.num_frames} frames"
+        )
+        self._line_counts = np.asarray(line_counts, dtype=np.int64)
+        self._ends_with_newline = ends_with_newline
+
+    @property
+    def num_lines(self) -> int:
+        line_counts = self.get_line_counts()
+        return int(line_counts.sum()) + (0 if self._ends_with_newline else 1)
+
+    def read_lines(
+        self, start: int, stop: Optional[int] = None, encoding: Optional[str] = "utf-8"
+    ) -> list[Union[str, bytes]]:
+        """
+        Read lines [start, stop) without the trailing newlines. Usable as a JSONL record index:
+        json.loads(reader.read_lines(i, i + 1)[0]) loads record i.
+
+        Args:
+            start: first line to read
+            stop: end of the range (exclusive), default None = until the end of the data
+            encoding: encoding to decode the lines, None to return bytes
+
+        Returns:
+            list of lines
+        """
+        num_lines = self.num_lines
+        stop = num_lines if stop is None else min(stop, num_lines)
+        if start >= stop:
+            return []
+        cum_counts = np.cumsum(self._line_counts)
+        # the frame containing newline number "start" (1-based) is where line "start" begins.
+        first_frame = int(np.searchsorted(cum_counts, start, side="left")) if start > 0 else 0
+        last_frame = min(int(np.searchsorted(cum_counts, stop, side="left")), self.num_frames - 1)
+        lines_before = int(cum_counts[first_frame - 1]) if first_frame > 0 else 0
+        data = b"".join(self.read_frames(list(range(first_frame, last_frame + 1))))
+        lines = data.split(b"\n")[start - lines_before : stop - lines_before]
+        if encoding is not None:
+            lines = [line.decode(encoding) for line in lines]
+        return lines
+
+    def close(self) -> None:
+        if self.should_close:
+            self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _decompress_zstd_frame(raw_frame: bytes, max_output_size: int) -> bytes:
+    return zstandard.ZstdDecompressor().decompress(raw_frame, max_output_size=max_output_size)
+
+
+def _count_newlines_in_zstd_frame(raw_frame: bytes, max_output_size: int) -> tuple[int, bool]:
+    data = _decompress_zstd_frame(raw_frame, max_output_size)
+    return data.count(b"\n"), data.endswith(b"\n")
+
+
+class ZipIndex:
+    """
+    Index of the members of a zip file, read from its central directory.
+
+    The central directory is read once per process and cached as long as the size and mtime of
+    the zip file do not change. Members are read from a file handle that is opened on demand.
+
+    Args:
+        zip_file: path to the zip file
+        use_cache: reuse the cached central directory if the zip file did not change
+
+    Usage:
+        with ZipIndex("data.zip") as zip_index:
+            print(len(zip_index), zip_index.listing())
+            with zip_index.open("some/member.json") as fh:
+                data = fh.read()
+            zip_index.extract(target_dir="out", names=["some/member.json"], workers=4)
+    """
+
+    def __init__(self, zip_file: PathType, use_cache: bool = True):
+        self.zip_file = Path(zip_file)
+        stat = self.zip_file.stat()
+        key = (self.zip_file.absolute().as_posix(), stat.st_size, stat.st_mtime_ns)
+        read_fn = _read_zip_infos if use_cache else _read_zip_infos.__wrapped__
+        self.infos: dict[str, zipfile.ZipInfo] = read_fn(*key)
+        self._zf: Optional[zipfile.ZipFile] = None
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.infos.keys())
+
+    def __len__(self) -> int:
+        return len(self.infos)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.infos
+
+    def __iter__(self):
+        return iter(self.infos)
+
+    def get_info(self, name: str) -> zipfile.ZipInfo:
+        return self.infos[name]
+
+    def listing(self, include_dirs: bool = True) -> dict[str, tuple[int, float]]:
+        """
+        Args:
+            include_dirs: also list the directory entries
+
+        Returns:
+            dict: filename -> (size, timestamp), same format as read_unzip_list_output
+        """
+        return {
+            name: (info.file_size, _get_zip_info_timestamp(info))
+            for name, info in self.infos.items()
+            if include_dirs or not info.is_dir()
+        }
+
+    def open(self, name: str) -> BinaryIO:
+        """Open a member for streaming reads, without reading it into memory."""
+        if self._zf is None:
+            self._zf = zipfile.ZipFile(self.zip_file, "r")
+        return self._zf.open(self.infos[name], "r")
+
+    def read(self, name: str) -> bytes:
+        with self.open(name) as fh:
+            return fh.read()
+
+    def extract(
+        self,
+        target_dir: PathType,
+        names: Optional[list[str]] = None,
+        workers: int = 0,
+        verbose: bool = False,
+    ) -> list[Path]:
+        """
+        Extract members, optionally in parallel processes which each open the zip file.
+        Unsafe member names (absolute or with "..") are sanitized like in zipfile.ZipFile.extract
+
+        Args:
+            target_dir: directory to extract to
+            names: members to extract, default None = all members
+            workers: number of processes, 0 = extract in the current process
+            verbose: show progress bar
+
+        Returns:
+            list of extracted paths
+        """
+        from packg.multiproc import FnMultiProcessor  # avoid circular import
+
+        names = self.names if names is None else names
+        target_dir = Path(target_dir).as_posix()
+        # create all directories here, so the workers do not race to create the same parents
+        _make_zip_member_dirs([self.infos[name] for name in names], target_dir)
+        if workers == 0 or len(names) <= 1:
+            return _extract_zip_members(self.zip_file.as_posix(), names, target_dir)
+
+        # balance the chunks by compressed size, largest members first
+        num_chunks = min(len(names), workers * 4)
+        chunks, chunk_sizes = [[] for _ in range(num_chunks)], np.zeros(num_chunks, dtype=np.int64)
+        for name in sorted(names, key=lambda n: self.infos[n].compress_size, reverse=True):
+            chunk_id = int(np.argmin(chunk_sizes))
+            chunks[chunk_id].append(name)
+            chunk_sizes[chunk_id] += self.infos[name].compress_size + 1
+        mp = FnMultiProcessor(
+            workers=workers,
+            target_fn=_extract_zip_members,
+            with_output=True,
+            ignore_errors=True,
+            total=num_chunks,
+            desc=f"Extracting {self.zip_file.name}",
+            verbose=verbose,
+        )
+        for chunk in chunks:
+            mp.put(self.zip_file.as_posix(), chunk, target_dir)
+        mp.run()
+        paths, num_failed = [], 0
+        for _ in range(num_chunks):
+            chunk_paths = mp.get()
+            if chunk_paths is None:
+                num_failed += 1
+                continue
+            paths.extend(chunk_paths)
+        mp.close()
+        if num_failed > 0:
+            raise RuntimeError(
+                f"Failed to extract {num_failed}/{num_chunks} chunks of {self.zip_file} to "
+                f"{target_dir}, see the errors logged above"
+            )
+        return paths
+
+    def close(self):
+        if self._zf is not None:
+            self._zf.close()
+            self._zf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+@lru_cache(maxsize=8)
+def _read_zip_infos(zip_file: str, _size: int, _mtime_ns: int) -> dict[str, zipfile.ZipInfo]:
+    with zipfile.ZipFile(zip_file, "r") as zf:
+        return {info.filename: info for info in zf.infolist()}
+
+
+def _get_zip_info_timestamp(info: zipfile.ZipInfo) -> float:
+    # zip stores local time without timezone, same as unzip -l shows it
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def _get_zip_member_path(info: zipfile.ZipInfo, target_dir: str) -> Path:
+    """Sanitize the member name the same way as zipfile.ZipFile.extract"""
+    arcname = info.filename.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    if os.path.sep == "\\":
+        arcname = _sanitize_windows_name(arcname, os.path.sep)
+    return Path(os.path.normpath(os.path.join(target_dir, arcname)))
+
+
+_WINDOWS_ILLEGAL_NAME_TABLE = str.maketrans(':<>|"?*', "_" * 7)
+
+
+def _sanitize_windows_name(arcname: str, pathsep: str) -> str:
+    """Replace bad characters and remove trailing dots and empty parts, same as zipfile"""
+    arcname = arcname.translate(_WINDOWS_ILLEGAL_NAME_TABLE)
+    parts = (part.rstrip(".") for part in arcname.split(pathsep))
+    return pathsep.join(part for part in parts if part)
+
+
+def _make_zip_member_dirs(infos: list[zipfile.ZipInfo], target_dir: str) -> None:
+    dirs = set()
+    for info in infos:
+        path = _get_zip_member_path(info, target_dir)
+        dirs.add(path if info.is_dir() else path.parent)
+    for directory in sorted(dirs):
+        os.makedirs(directory, exist_ok=True)
+
+
+def _extract_zip_members(zip_file: str, names: list[str], target_dir: str) -> list[Path]:
+    """Extract members, the directories must already exist, see _make_zip_member_dirs"""
+    paths = []
+    with zipfile.ZipFile(zip_file, "r") as zf:
+        for name in names:
+            info = zf.getinfo(name)
+            path = _get_zip_member_path(info, target_dir)
+            if not info.is_dir():
+                with zf.open(info, "r") as fh_in, open(path, "wb") as fh_out:
+                    shutil.copyfileobj(fh_in, fh_out)
+                timestamp = _get_zip_info_timestamp(info)
+                os.utime(path, (timestamp, timestamp))
+            paths.append(path)
+    return paths
 
 
 def read_unzip_list_output(unzip_output: str):
     """
+    Parse the output of unzip -l. Prefer ZipIndex(zip_file).listing(), which reads the zip file
+    directly.
+
     Args:
         unzip_output: output from unzip -l command
 
@@ -0,0 +1,644 @@
+"""
+Compact array-backed file index, see FileIndex.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fnmatch
+import json
+import os
+import re
+import struct
+from collections.abc import ItemsView, Mapping, ValuesView
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
+from attr import define
+
+from packg.iotools.compress import CompressorC, compress_data_to_bytes, decompress_bytes_to_bytes
+from packg.typext import PathType
+from typedparser import NamedTupleMixin
+
+FNV_OFFSET = 0xCBF29CE484222325
+FNV_PRIME = 0x100000001B3
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+FILE_INDEX_MAGIC = b"PKGFIDX\x00"
+FILE_INDEX_VERSION = 1
+_HEADER_LENGTH = struct.Struct("<I")
+_ALIGNMENT = 64
+
+
+@define
+class FileProperties(NamedTupleMixin):
+    size: int
+    mtime: float
+
+
+@define
+class FilePropertiesWithDigest(FileProperties):
+    """File properties with the hex digest of the content, None if the file could not be read"""
+
+    digest: Optional[str]
+
+
+class FileIndex(Mapping):
+    """
+    Read-only mapping {relative path str: FileProperties} of a file tree, stored in a few numpy
+    arrays instead of one dict entry, str and FileProperties object per file.
+
+    Paths are utf-8 encoded and concatenated into one byte buffer, path i is
+    path_data[offsets[i]:offsets[i + 1]]. Lookups by path use the 64-bit FNV-1a hashes of the
+    paths, which are computed vectorized and sorted on the first lookup.
+
+    Use query to filter the index by prefix, suffix, glob, regex, size and mtime.
+
+    Args:
+        path_data: uint8 array with the concatenated utf-8 encoded paths
+        offsets: int64 array of length n + 1 with the start of each path in path_data
+        sizes: int64 array of file sizes in bytes
+        mtimes: float64 array of modification times
+        root: optional absolute root directory the paths are relative to
+    """
+
+    def __init__(
+        self,
+        path_data: np.ndarray,
+        offsets: np.ndarray,
+        sizes: np.ndarray,
+        mtimes: np.ndarray,
+        root: Optional[str] = None,
+    ):
+        n = len(sizes)
+        if len(offsets) != n + 1 or len(mtimes) != n:
+            raise ValueError(
+                f"Got {len(offsets)} offsets, {len(sizes)} sizes and {len(mtimes)} mtimes, "
+                f"expected n + 1, n and n"
+            )
+        self.path_data = path_data
+        self.offsets = offsets
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.root = root
+        self._hashes: Optional[np.ndarray] = None
+        self._hash_order: Optional[np.ndarray] = None
+        self._sorted_hashes: Optional[np.ndarray] = None
+        self._path_order: Optional[np.ndarray] = None
+        self._tails: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_items(
+        cls, items: Iterable[tuple[str, int, float]], root: Optional[PathType] = None
+    ) -> FileIndex:
+        """
+        Args:
+            items: tuples (relative path, size, mtime), the paths must be unique
+            root: optional root directory
+        """
+        paths, sizes, mtimes = [], [], []
+        for path, size, mtime in items:
+            paths.append(path.encode("utf-8"))
+            sizes.append(size)
+            mtimes.append(mtime)
+        lengths = np.fromiter((len(p) for p in paths), dtype=np.int64, count=len(paths))
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(
+            np.frombuffer(b"".join(paths), dtype=np.uint8),
+            offsets,
+            np.array(sizes, dtype=np.int64),
+            np.array(mtimes, dtype=np.float64),
+            root=None if root is None else str(root),
+        )
+
+    @classmethod
+    def from_dict(
+        cls, file_dict: dict[str, FileProperties], root: Optional[PathType] = None
+    ) -> FileIndex:
+        """Convert the output of make_index"""
+        return cls.from_items(
+            ((path, props.size, props.mtime) for path, props in file_dict.items()), root=root
+        )
+
+    def to_dict(self) -> dict[str, FileProperties]:
+        return dict(self.items())
+
+    def __len__(self) -> int:
+        return len(self.sizes)
+
+    def __iter__(self) -> Iterator[str]:
+        buffer = self.path_data.tobytes()
+        offsets = self.offsets.tolist()
+        for start, stop in zip(offsets[:-1], offsets[1:]):
+            yield buffer[start:stop].decode("utf-8")
+
+    def __getitem__(self, path: str) -> FileProperties:
+        i = self.get_position(path)
+        if i < 0:
+            raise KeyError(path)
+        return self.get_properties(i)
+
+    def __contains__(self, path: object) -> bool:
+        return isinstance(path, str) and self.get_position(path) >= 0
+
+    def items(self) -> ItemsView:
+        return _FileIndexItemsView(self)
+
+    def values(self) -> ValuesView:
+        return _FileIndexValuesView(self)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(root={self.root!r}, files={len(self)})"
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays in bytes"""
+        arrays = [self.path_data, self.offsets, self.sizes, self.mtimes]
+        arrays += [self._hashes, self._hash_order, self._sorted_hashes]
+        arrays += [self._path_order, self._tails]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+    def get_path(self, i: int) -> str:
+        return self.path_data[self.offsets[i] : self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def get_paths(self, positions: Iterable[int]) -> list[str]:
+        buffer, offsets = self.path_data, self.offsets
+        return [
+            buffer[offsets[i] : offsets[i + 1]].tobytes().decode("utf-8") for i in positions
+        ]
+
+    def get_properties(self, i: int) -> FileProperties:
+        return FileProperties(int(self.sizes[i]), float(self.mtimes[i]))
+
+    def get_position(self, path: str) -> int:
+        """
+        Returns:
+            position of the path in the index or -1 if it is not in the index
+        """
+        path_bytes = path.encode("utf-8")
+        self._build_hash_index()
+        target = np.uint64(fnv1a_hash(path_bytes))
+        left = int(np.searchsorted(self._sorted_hashes, target, side="left"))
+        right = int(np.searchsorted(self._sorted_hashes, target, side="right"))
+        for i in self._hash_order[left:right]:
+            if self.path_data[self.offsets[i] : self.offsets[i + 1]].tobytes() == path_bytes:
+                return int(i)
+        return -1
+
+    def get_hashes(self) -> np.ndarray:
+        """
+        Returns:
+            uint64 array with the FNV-1a hash of each path
+        """
+        if self._hashes is not None:
+            return self._hashes
+        if self._sorted_hashes is not None:
+            hashes = np.empty_like(self._sorted_hashes)
+            hashes[self._hash_order] = self._sorted_hashes
+            return hashes
+        self._hashes = fnv1a_hash_segments(self.path_data, self.offsets)
+        return self._hashes
+
+    def get_sorted_hashes(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple of sorted uint64 hashes, and the positions of the paths in the sorted order
+        """
+        self._build_hash_index()
+        return self._sorted_hashes, self._hash_order
+
+    def query(
+        self,
+        prefix: Optional[str] = None,
+        suffix: Union[str, tuple[str, ...], None] = None,
+        glob: Optional[str] = None,
+        regex: Union[re.Pattern, str, None] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        min_mtime: Optional[float] = None,
+        max_mtime: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Find the files matching all given filters.
+
+        The prefix uses a binary search over the paths in sorted order, suffixes of up to 8 bytes
+        are compared with one array operation over the last 8 bytes of all paths. Both helper
+        arrays are created on the first query. Size and mtime filters are vectorized as well,
+        glob and regex are applied last with a python loop over the remaining paths.
+
+        Examples:
+            >>> positions = file_index.query(prefix="images/", suffix=(".jpg", ".png"))
+            >>> paths = file_index.get_paths(positions)
+            >>> total_size = file_index.sizes[positions].sum()
+
+        Args:
+            prefix: path starts with this string, e.g. "images/"
+            suffix: path ends with this string or one of these strings, e.g. ".jpg"
+            glob: fnmatch pattern for the full path, where * also matches /, e.g. "*/train/*.jpg"
+            regex: regex that must be found in the path (re.search)
+            min_size: minimum size in bytes (inclusive)
+            max_size: maximum size in bytes (inclusive)
+            min_mtime: minimum mtime (inclusive)
+            max_mtime: maximum mtime (inclusive)
+
+        Returns:
+            int64 array with the sorted positions of the matching files in the index
+        """
+        glob_prefix = None if glob is None else re.split(r"[*?\[]", glob, maxsplit=1)[0]
+        if glob_prefix:
+            # the literal start of the glob narrows the search via the prefix index
+            if prefix is None or glob_prefix.startswith(prefix):
+                prefix = glob_prefix
+            elif not prefix.startswith(glob_prefix):
+                return np.zeros(0, dtype=np.int64)
+        positions = None if prefix is None else self._query_prefix(prefix)
+
+        def take(array: np.ndarray) -> np.ndarray:
+            return array if positions is None else array[positions]
+
+        mask = None
+        if suffix is not None:
+            mask = self._query_suffix(suffix, positions)
+        for array, min_value, max_value in (
+            (self.sizes, min_size, max_size),
+            (self.mtimes, min_mtime, max_mtime),
+        ):
+            if min_value is not None:
+                mask = _and_mask(mask, take(array) >= min_value)
+            if max_value is not None:
+                mask = _and_mask(mask, take(array) <= max_value)
+        if positions is None:
+            positions = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        else:
+            positions = np.sort(positions if mask is None else positions[mask])
+        positions = positions.astype(np.int64, copy=False)
+
+        if glob is None and regex is None:
+            return positions
+        if isinstance(regex, str):
+            regex = re.compile(regex)
+        glob_regex = None if glob is None else re.compile(fnmatch.translate(glob))
+        keep = [
+            (glob_regex is None or glob_regex.match(path) is not None)
+            and (regex is None or regex.search(path) is not None)
+            for path in self.get_paths(positions)
+        ]
+        return positions[np.array(keep, dtype=bool)]
+
+    def get_path_order(self) -> np.ndarray:
+        """
+        Returns:
+            positions of the paths sorted by their utf-8 bytes, which is also the sort order
+            of the path strings
+        """
+        if self._path_order is None:
+            order = argsort_segments(self.path_data, self.offsets)
+            self._path_order = order.astype(np.int32) if len(order) < 2**31 else order
+        return self._path_order
+
+    def _query_prefix(self, prefix: str) -> np.ndarray:
+        order = self.get_path_order()
+        prefix_bytes = prefix.encode("utf-8")
+        sorted_prefixes = _SortedPathPrefixes(self, order, len(prefix_bytes))
+        left = bisect.bisect_left(sorted_prefixes, prefix_bytes)
+        right = bisect.bisect_right(sorted_prefixes, prefix_bytes, lo=left)
+        return order[left:right]
+
+    def _query_suffix(
+        self, suffix: Union[str, tuple[str, ...]], positions: Optional[np.ndarray]
+    ) -> np.ndarray:
+        if self._tails is None:
+            self._tails = _get_tails(self.path_data, self.offsets)
+        tails = self._tails if positions is None else self._tails[positions]
+        suffixes = (suffix,) if isinstance(suffix, str) else suffix
+        mask = np.zeros(len(tails), dtype=bool)
+        for suffix_str in suffixes:
+            suffix_bytes = suffix_str.encode("utf-8")
+            tail_bytes = suffix_bytes[-_TAIL_SIZE:]
+            tail_mask = np.uint64((1 << (8 * len(tail_bytes))) - 1)
+            tail_value = np.uint64(int.from_bytes(tail_bytes, "big"))
+            # paths contain no zero bytes, so the padding of short paths never matches
+            is_match = (tails & tail_mask) == tail_value
+            if len(suffix_bytes) <= _TAIL_SIZE:
+                mask |= is_match
+                continue
+            # compare the rest of long suffixes byte by byte
+            matches = np.flatnonzero(is_match)
+            match_positions = matches if positions is None else positions[matches]
+            starts, ends = self.offsets[match_positions], self.offsets[match_positions + 1]
+            is_long = ends - starts >= len(suffix_bytes)
+            matches, ends = matches[is_long], ends[is_long]
+            for j in range(_TAIL_SIZE, len(suffix_bytes)):
+                is_equal = self.path_data[ends - 1 - j] == suffix_bytes[-1 - j]
+                matches, ends = matches[is_equal], ends[is_equal]
+            mask[matches] = True
+        return mask
+
+    def save(self, file: PathType, compress: bool = False, level: int = 3) -> None:
+        """
+        Save as binary snapshot: magic bytes, u32 header length, json header, then the arrays
+        aligned to 64 bytes. The hash index is saved as well, so lookups after loading are fast.
+        The sorted path order is saved if it was already created by a prefix query.
+
+        Args:
+            file: output file
+            compress: compress the arrays with zstd, this makes the file smaller but loading
+                can not use mmap anymore.
+            level: zstd level
+        """
+        self._build_hash_index()
+        arrays = {
+            "path_data": self.path_data,
+            "offsets": self.offsets,
+            "sizes": self.sizes,
+            "mtimes": self.mtimes,
+            "sorted_hashes": self._sorted_hashes,
+            "hash_order": self._hash_order,
+        }
+        if self._path_order is not None:
+            arrays["path_order"] = self._path_order
+        blobs, sections = [], []
+        for name, array in arrays.items():
+            blob = np.ascontiguousarray(array).tobytes()
+            if compress:
+                blob = compress_data_to_bytes(blob, CompressorC.ZSTD, level=level)
+            blobs.append(blob)
+            sections.append(
+                {"name": name, "dtype": array.dtype.str, "count": len(array), "nbytes": len(blob)}
+            )
+        header = {
+            "version": FILE_INDEX_VERSION,
+            "root": self.root,
+            "n": len(self),
+            "compressed": compress,
+            "sections": sections,
+        }
+        # the offsets depend on the header length, which depends on the offsets.
+        # reserve enough digits by starting with large placeholder offsets.
+        for section in sections:
+            section["offset"] = 10**15
+        header_bytes = json.dumps(header).encode("utf-8")
+        position = _align(len(FILE_INDEX_MAGIC) + _HEADER_LENGTH.size + len(header_bytes))
+        for section, blob in zip(sections, blobs):
+            section["offset"] = position
+            position = _align(position + len(blob))
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        file = Path(file)
+        tmp_file = file.parent / f"{file.name}.tmp"
+        with tmp_file.open("wb") as fh:
+            fh.write(FILE_INDEX_MAGIC)
+            fh.write(_HEADER_LENGTH.pack(len(header_bytes)))
+            fh.write(header_bytes)
+            for section, blob in zip(sections, blobs):
+                fh.write(b"\x00" * (section["offset"] - fh.tell()))
+                fh.write(blob)
+        os.replace(tmp_file, file)
+
+    @classmethod
+    def load(cls, file: PathType, mmap: bool = True) -> FileIndex:
+        """
+        Load a binary snapshot created with save.
+
+        Args:
+            file: input file
+            mmap: memory-map the file instead of reading it, so loading is instant and
+                processes that load the same file share the memory. The arrays are read-only.
+                Ignored for compressed snapshots.
+        """
+        header = read_file_index_header(file)
+        if mmap and not header["compressed"]:
+            buffer = np.memmap(file, dtype=np.uint8, mode="r")
+        else:
+            buffer = np.frombuffer(Path(file).read_bytes(), dtype=np.uint8)
+        arrays = {}
+        for section in header["sections"]:
+            blob = buffer[section["offset"] : section["offset"] + section["nbytes"]]
+            dtype = np.dtype(section["dtype"])
+            if header["compressed"]:
+                blob = np.frombuffer(
+                    decompress_bytes_to_bytes(blob.tobytes(), CompressorC.ZSTD), dtype=np.uint8
+                )
+            arrays[section["name"]] = blob.view(dtype)[: section["count"]]
+        file_index = cls(
+            arrays["path_data"],
+            arrays["offsets"],
+            arrays["sizes"],
+            arrays["mtimes"],
+            root=header["root"],
+        )
+        file_index._sorted_hashes = arrays["sorted_hashes"]
+        file_index._hash_order = arrays["hash_order"]
+        file_index._path_order = arrays.get("path_order")
+        return file_index
+
+    def _build_hash_index(self) -> None:
+        if self._sorted_hashes is not None:
+            return
+        hashes = self.get_hashes()
+        order = np.argsort(hashes, kind="stable")
+        self._sorted_hashes = hashes[order]
+        self._hash_order = order.astype(np.int32) if len(order) < 2**31 else order
+        # the sorted hashes are enough for lookups
+        self._hashes = None
+
+
+def read_file_index_header(file: PathType) -> dict:
+    """
+    Returns:
+        json header of a FileIndex snapshot, with version, root, number of files n, and the
+        sections with name, dtype, count, offset and size in bytes of each array.
+    """
+    with Path(file).open("rb") as fh:
+        magic = fh.read(len(FILE_INDEX_MAGIC))
+        if magic != FILE_INDEX_MAGIC:
+            raise ValueError(f"Not a FileIndex snapshot: {file}")
+        (header_length,) = _HEADER_LENGTH.unpack(fh.read(_HEADER_LENGTH.size))
+        header = json.loads(fh.read(header_length).decode("utf-8"))
+    if header["version"] != FILE_INDEX_VERSION:
+        raise ValueError(
+            f"FileIndex snapshot {file} has version {header['version']}, "
+            f"expected {FILE_INDEX_VERSION}"
+        )
+    return header
+
+
+_TAIL_SIZE = 8
+
+
+def _get_tails(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        uint64 array with the last 8 bytes of each segment as big-endian number, so the last byte
+        of the segment is the lowest byte. Shorter segments are padded with zero bytes.
+    """
+    ends, lengths = offsets[1:], np.diff(offsets)
+    tails = np.zeros(len(lengths), dtype=np.uint64)
+    for j in range(_TAIL_SIZE):
+        has_byte = np.flatnonzero(lengths > j)
+        tails[has_byte] |= data[ends[has_byte] - 1 - j].astype(np.uint64) << np.uint64(8 * j)
+    return tails
+
+
+def _and_mask(mask: Optional[np.ndarray], other: np.ndarray) -> np.ndarray:
+    return other if mask is None else mask & other
+
+
+class _SortedPathPrefixes:
+    """Sequence of the sorted paths cut to some length in bytes, for bisect"""
+
+    def __init__(self, file_index: FileIndex, order: np.ndarray, length: int):
+        self.file_index = file_index
+        self.order = order
+        self.length = length
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def __getitem__(self, k: int) -> bytes:
+        i = self.order[k]
+        start, stop = self.file_index.offsets[i], self.file_index.offsets[i + 1]
+        return self.file_index.path_data[start : min(stop, start + self.length)].tobytes()
+
+
+def _align(position: int) -> int:
+    return -(-position // _ALIGNMENT) * _ALIGNMENT
+
+
+class _FileIndexItemsView(ItemsView):
+    """Iterate by position instead of looking up each key"""
+
+    def __iter__(self):
+        file_index: FileIndex = self._mapping
+        sizes, mtimes = file_index.sizes.tolist(), file_index.mtimes.tolist()
+        for path, size, mtime in zip(file_index, sizes, mtimes):
+            yield path, FileProperties(size, mtime)
+
+
+class _FileIndexValuesView(ValuesView):
+    def __iter__(self):
+        file_index: FileIndex = self._mapping
+        for size, mtime in zip(file_index.sizes.tolist(), file_index.mtimes.tolist()):
+            yield FileProperties(size, mtime)
+
+
+def fnv1a_hash(data: bytes) -> int:
+    """64-bit FNV-1a hash of some bytes"""
+    h = FNV_OFFSET
+    for byte in data:
+        h = ((h ^ byte) * FNV_PRIME) & _MASK_64
+    return h
+
+
+def fnv1a_hash_segments(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Vectorized 64-bit FNV-1a hash of each segment data[offsets[i]:offsets[i + 1]].
+
+    Segments are sorted by length, so that in step j all segments that are longer than j form
+    a prefix and can be updated with one array operation.
+
+    Returns:
+        uint64 array with one hash per segment, same as fnv1a_hash
+    """
+    starts = offsets[:-1]
+    lengths = offsets[1:] - starts
+    order = np.argsort(-lengths, kind="stable")
+    sorted_starts = starts[order]
+    sorted_lengths = lengths[order]
+    hashes = np.full(len(starts), FNV_OFFSET, dtype=np.uint64)
+    prime = np.uint64(FNV_PRIME)
+    max_length = int(sorted_lengths[0]) if len(sorted_lengths) > 0 else 0
+    # number of segments longer than j, for all j
+    num_active = np.searchsorted(-sorted_lengths, -np.arange(max_length), side="left")
+    for j in range(max_length):
+        n = int(num_active[j])
+        active = hashes[:n]
+        active ^= data[sorted_starts[:n] + j].astype(np.uint64)
+        active *= prime
+    result = np.empty_like(hashes)
+    result[order] = hashes
+    return result
+
+
+def argsort_segments(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Vectorized stable argsort of the segments data[offsets[i]:offsets[i + 1]] by their bytes,
+    see fnv1a_hash_segments for the segment format. Segments must not contain zero bytes.
+
+    The segments are sorted by their first 8 bytes as big-endian integers. Then the segments
+    that are still tied are sorted again by their next bytes, with the id of their group in the
+    high bits of the key, until no ties are left. Only the tied segments are sorted again, for
+    paths these are the ones in the same directory.
+
+    Returns:
+        int64 array of segment positions
+    """
+    starts = offsets[:-1].astype(np.int64)
+    lengths = (offsets[1:] - offsets[:-1]).astype(np.int64)
+    # zero padding, so that 16 bytes can be read after the end of each segment
+    words = np.concatenate([data, np.zeros(24 - len(data) % 8, dtype=np.uint8)])
+    words = words.view(">u8").astype(np.uint64)
+    order = np.arange(len(starts), dtype=np.int64)
+    # positions in the order that are still tied, and the id of their group
+    slots, group_ids, num_groups = order.copy(), np.zeros(len(starts), dtype=np.uint64), 1
+    position = 0
+    while len(slots) > 0:
+        num_bytes = (64 - int(num_groups - 1).bit_length()) // 8
+        segments = order[slots]
+        rest = lengths[segments] - position
+        # read num_bytes bytes at each address from two words
+        addresses = starts[segments] + position
+        index, shift = addresses >> 3, (addresses & 7).astype(np.uint64) << np.uint64(3)
+        values = (words[index] << shift) | (words[index + 1] >> np.uint64(1) >> (63 - shift))
+        values >>= np.uint64(64 - 8 * num_bytes)
+        # zero the bytes after the end of the segment, so shorter segments sort first
+        drop = (num_bytes - np.clip(rest, 0, num_bytes)).astype(np.uint64) << np.uint64(3)
+        values = np.where(rest > 0, values >> drop << drop, np.uint64(0))
+        keys = (group_ids << np.uint64(8 * num_bytes)) | values if num_groups > 1 else values
+        sub = np.argsort(keys, kind="stable")
+        order[slots] = segments[sub]
+        keys, rest = keys[sub], rest[sub]
+        # without zero bytes, equal keys mean that both segments end here or both continue
+        continues = rest > num_bytes
+        is_tie = (keys[1:] == keys[:-1]) & (continues[1:] | continues[:-1])
+        in_tie = np.zeros(len(slots), dtype=bool)
+        in_tie[1:] |= is_tie
+        in_tie[:-1] |= is_tie
+        is_group_start = np.concatenate([[True], ~is_tie])[in_tie]
+        group_ids = (np.cumsum(is_group_start) - 1).astype(np.uint64)
+        num_groups = int(group_ids[-1]) + 1 if len(group_ids) > 0 else 0
+        slots = slots[in_tie]
+        position += num_bytes
+    return order
+
+
+def segments_equal(
+    data_a: np.ndarray,
+    offsets_a: np.ndarray,
+    positions_a: np.ndarray,
+    data_b: np.ndarray,
+    offsets_b: np.ndarray,
+    positions_b: np.ndarray,
+) -> np.ndarray:
+    """
+    Vectorized comparison of pairs of segments, segment positions_a[i] of a with segment
+    positions_b[i] of b, see fnv1a_hash_segments for the segment format.
+
+    Returns:
+        bool array, True where the pair of segments is equal
+    """
+    starts_a, starts_b = offsets_a[positions_a], offsets_b[positions_b]
+    lengths_a = offsets_a[positions_a + 1] - starts_a
+    lengths_b = offsets_b[positions_b + 1] - starts_b
+    equal = lengths_a == lengths_b
+    candidates = np.flatnonzero(equal)
+    order = candidates[np.argsort(-lengths_a[candidates], kind="stable")]
+    sorted_lengths = lengths_a[order]
+    max_length = int(sorted_lengths[0]) if len(sorted_lengths) > 0 else 0
+    num_active = np.searchsorted(-sorted_lengths, -np.arange(max_length), side="left")
+    for j in range(max_length):
+        active = order[: int(num_active[j])]
+        equal[active] &= data_a[starts_a[active] + j] == data_b[starts_b[active] + j]
+    return equal
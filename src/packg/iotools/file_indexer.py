@@ -1,35 +1,48 @@
 """
 Utilities to index and sort file trees.
 
-# TODO turn index into class, current global variables may break in multi-threaded scenarios
-
 @Agent print for each test the input file and dir count, output file and dir count, and status.
 """
 
 from __future__ import annotations
 
+import fnmatch
+import hashlib
 import itertools
 import os
+import pickle
 import re
-from operator import itemgetter
+import stat
+import threading
+import time
+import unicodedata
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from operator import attrgetter, itemgetter
 from pathlib import Path
-from typing import Iterator, Optional, Union
+from typing import Callable, Iterator, Optional, Union
 
 import natsort
-from attr import define
+import numpy as np
+from attr import define, field
 from tqdm import tqdm
 
 from packg import format_exception
+from packg.iotools.file_index import (
+    FileIndex,
+    FileProperties,
+    FilePropertiesWithDigest,
+    segments_equal,
+)
 from packg.iotools.pathspec_matcher import (
-    SPECLISTTYPE,
+    CompiledPathSpecs,
     PathSpecArgs,
-    apply_pathspecs,
-    expand_pathspec_args,
-    make_pathspecs,
+    get_compiled_pathspecs,
+    make_pathspecs_from_args,
 )
 from packg.log import logger
 from packg.typext import PathType
-from typedparser import NamedTupleMixin
 
 
 def regex_glob(
@@ -44,9 +57,13 @@ def regex_glob(
 ) -> Iterator[Union[PathType, str]]:
     """Glob with regex filter
 
+    Results are yielded while the tree is walked with os.scandir, following the glob rules of
+    pathlib. If the regex starts with ^ and a literal path, e.g. "^/data/images/train/.*\\.jpg$",
+    directories that cannot contain matches are not entered.
+
     Args:
         base_path: base path
-        regex_pattern: regex pattern to filter
+        regex_pattern: regex pattern to filter, searched in the posix path including base_path
         glob_pattern: glob pattern to filter, potentially increase performance by pre-filtering
         match_filename_only: match only the filename, not the full path
         match_inverse: return files that do not match the regex
@@ -55,32 +72,157 @@ def regex_glob(
         return_as_posix_str: return as posix string instead of Path object
 
     Returns:
-        list of paths
+        iterator of paths
     """
-    # print(f"Got pattern {regex_pattern}")
     if isinstance(regex_pattern, str):
-        # print(f"Compiling {regex_pattern}")
         regex_pattern = re.compile(regex_pattern)
-        # print(f"Got {regex_pattern}")
-    glob_results = list(Path(base_path).glob(glob_pattern))
-    # print("got", len(glob_results),"results for", base_path, glob_pattern,":\n", glob_results)
-    for pth in glob_results:
+    regex_prefix = ""
+    if not match_filename_only and not match_inverse:
+        regex_prefix = _get_regex_literal_prefix(regex_pattern)
+    base_path = Path(base_path)
+    base_str = base_path.as_posix()
+    base_str = "" if base_str == "." else base_str if base_str.endswith("/") else f"{base_str}/"
+
+    def get_full_str(rel_str: str) -> str:
+        return f"{base_str}{rel_str}" if rel_str != "" else base_path.as_posix()
+
+    for rel_str, is_dir in _iter_glob(base_path, glob_pattern, regex_prefix, get_full_str):
+        if ignore_directories and is_dir:
+            continue
         if match_filename_only:
-            str_to_match = pth.name
+            str_to_match = rel_str.rpartition("/")[2] if rel_str != "" else base_path.name
         else:
-            str_to_match = pth.as_posix()
+            str_to_match = get_full_str(rel_str)
         re_matches_bool = bool(regex_pattern.search(str_to_match))
-        # print("match", re_matches_bool, "for", str_to_match, "with", regex_pattern)
         if match_inverse:
             re_matches_bool = not re_matches_bool
-        if re_matches_bool:
-            if ignore_directories and pth.is_dir():
+        if not re_matches_bool:
+            continue
+        if return_relative_paths:
+            pth = Path(rel_str)
+        else:
+            pth = base_path / rel_str if rel_str != "" else base_path
+        if return_as_posix_str:
+            pth = pth.as_posix()
+        yield pth
+
+
+def _iter_glob(
+    base_path: Path, glob_pattern: str, regex_prefix: str, get_full_str: Callable[[str], str]
+) -> Iterator[tuple[str, bool]]:
+    """
+    Same results as Path.glob, as tuples (posix path relative to base_path, is directory).
+
+    The pattern parts are matched with a small state machine: the states of a directory are the
+    indices of the pattern parts its entries can match next. Subdirectories whose full path
+    cannot start with regex_prefix are skipped.
+    """
+    if not glob_pattern:
+        raise ValueError(f"Unacceptable pattern: {glob_pattern!r}")
+    if glob_pattern.startswith("/") or Path(glob_pattern).anchor:
+        raise NotImplementedError("Non-relative patterns are unsupported")
+    only_dirs = glob_pattern.endswith("/")
+    parts = [part for part in glob_pattern.split("/") if part not in ("", ".")]
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    matchers = [
+        None if part == "**" else re.compile(fnmatch.translate(part), flags).match
+        for part in parts
+    ]
+    n_parts = len(parts)
+
+    def get_closure(states: set[int]) -> set[int]:
+        # ** can match zero directories
+        closure = set(states)
+        for i in sorted(states):
+            while i < n_parts and matchers[i] is None:
+                i += 1
+                closure.add(i)
+        return closure
+
+    if not base_path.is_dir():
+        return
+    stack = [("", get_closure({0}))]
+    while stack:
+        rel_dir, states = stack.pop()
+        if n_parts in states and matchers[-1] is None:
+            # a trailing ** matches the directory itself
+            yield rel_dir, True
+        try:
+            with os.scandir(base_path / rel_dir if rel_dir != "" else base_path) as it:
+                entries = list(it)
+        except (PermissionError, FileNotFoundError, NotADirectoryError):
+            continue
+        subdirs = []
+        for entry in entries:
+            rel_str = f"{rel_dir}/{entry.name}" if rel_dir != "" else entry.name
+            is_dir = _entry_is_dir(entry)
+            child_states = set()
+            for i in states:
+                if i == n_parts:
+                    continue
+                matcher = matchers[i]
+                if matcher is None:
+                    if is_dir and not entry.is_symlink():
+                        child_states.add(i)
+                elif matcher(entry.name) is not None:
+                    child_states.add(i + 1)
+            if not child_states:
+                continue
+            if n_parts in child_states and (is_dir or not only_dirs):
+                yield rel_str, is_dir
+            if not is_dir:
+                continue
+            child_states = get_closure(child_states)
+            if not any(i < n_parts for i in child_states) and matchers[-1] is not None:
                 continue
-            if return_relative_paths:
-                pth = pth.relative_to(base_path)
-            if return_as_posix_str:
-                pth = pth.as_posix()
-            yield pth
+            if regex_prefix != "":
+                full_dir = f"{get_full_str(rel_str)}/"
+                if not (full_dir.startswith(regex_prefix) or regex_prefix.startswith(full_dir)):
+                    continue
+            subdirs.append((rel_str, child_states))
+        stack.extend(reversed(subdirs))
+
+
+def _entry_is_dir(entry: os.DirEntry) -> bool:
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+def _get_regex_literal_prefix(regex_pattern: re.Pattern) -> str:
+    """
+    Returns:
+        literal string that all matches of a regex anchored with ^ or \\A must start with,
+        or "" if there is none
+    """
+    pattern = regex_pattern.pattern
+    if not isinstance(pattern, str) or regex_pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ""
+    if pattern.startswith("^"):
+        pos = 1
+    elif pattern.startswith("\\A"):
+        pos = 2
+    else:
+        return ""
+    if "|" in pattern:
+        return ""
+    prefix = []
+    while pos < len(pattern):
+        char = pattern[pos]
+        if char == "\\":
+            if pos + 1 >= len(pattern) or pattern[pos + 1].isalnum():
+                break
+            char = pattern[pos + 1]
+            pos += 1
+        elif char in ".^$*+?{}[]()":
+            if char in "*?{" and prefix:
+                # the quantifier applies to the last character
+                prefix.pop()
+            break
+        prefix.append(char)
+        pos += 1
+    return "".join(prefix)
 
 
 def sort_file_paths_with_dirs_separated(
@@ -92,6 +234,10 @@ def sort_file_paths_with_dirs_separated(
     Only works for file paths (not directory paths) - input "dir/" will be treated like "dir"
     since in pathlib, Path("dir/") and Path("dir") are the same thing.
 
+    Each path is encoded as one bytes key that sorts the same way as a list of
+    (sort_index, part) tuples, see _encode_sort_keys. Comparing bytes is much faster than
+    comparing nested tuples or natsort keys.
+
     Args:
         file_paths:
         natsorted: natural sort (image1, image2, image10) instead of (image1, image10, image2)
@@ -102,6 +248,17 @@ def sort_file_paths_with_dirs_separated(
     """
     paths = [Path(p) for p in file_paths]
     sort_index_dir = 0 if dirs_first else 2
+    try:
+        keys = _encode_sort_keys(paths, sort_index_dir, natsorted)
+    except _CannotEncodeError:
+        return _sort_file_paths_with_dirs_separated_tuples(paths, natsorted, sort_index_dir)
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    return [paths[i] for i in order]
+
+
+def _sort_file_paths_with_dirs_separated_tuples(
+    paths: list[Path], natsorted: bool, sort_index_dir: int
+) -> list[Path]:
     # split path into its parts, then create a list of (sort_index, part) tuple for the path
     key_paths = [
         [(sort_index_dir, part) for part in path.parts[:-1]] + [(1, path.name)] for path in paths
@@ -112,22 +269,140 @@ def sort_file_paths_with_dirs_separated(
     return sorted_paths
 
 
-@define
-class FileProperties(NamedTupleMixin):
-    size: int
-    mtime: float
+class _CannotEncodeError(Exception):
+    pass
+
+
+# parts with these characters collide with the separators of the encoding
+_RE_UNSAFE_CHARS = re.compile(r"[\x00-\x02]")
+_RE_DIGITS = re.compile(r"(\d+)")
+_MAX_DIGITS = 250
+
+
+def _encode_sort_keys(paths: list[Path], sort_index_dir: int, natural: bool) -> list[bytes]:
+    """
+    Encode paths as bytes, so that comparing the bytes gives the same order as comparing the
+    lists [(sort_index_dir, dir_part), ..., (1, file_name)], optionally with natural sorting of
+    the parts as natsort does it. The keys of parent dirs are created once and reused.
+    """
+    dir_keys: dict[tuple[str, ...], bytes] = {}
+    keys = []
+    for path in paths:
+        parent_parts = path.parts[:-1]
+        dir_key = dir_keys.get(parent_parts)
+        if dir_key is None:
+            dir_key = b"".join(
+                [_encode_sort_key_part(part, sort_index_dir, natural) for part in parent_parts]
+            )
+            dir_keys[parent_parts] = dir_key
+        keys.append(dir_key + _encode_sort_key_part(path.name, 1, natural))
+    return keys
+
+
+def _encode_sort_key_part(part: str, sort_index: int, natural: bool) -> bytes:
+    """
+    Encode a part as the byte sort_index + 3, then the utf-8 encoded part, then the byte 0.
+    UTF-8 bytes sort in the same order as the code points of a str, and the 0 byte makes sure
+    that a part sorts before all parts it is a prefix of.
+
+    For natural sorting the part is split into text and numbers, as natsort does it. Text is
+    followed by the byte 1. Numbers are the byte 3 + number of digits, then the digits without
+    leading zeros, so longer numbers sort after shorter ones.
+
+    Raises:
+        _CannotEncodeError: for parts with control characters 0-2, numbers with more than
+            _MAX_DIGITS digits, or for natural sorting non-ASCII numeric characters like "①",
+            "²" or "٣", which natsort also treats as numbers. These can not be encoded this way.
+    """
+    if _RE_UNSAFE_CHARS.search(part) is not None:
+        raise _CannotEncodeError(part)
+    if not natural:
+        return b"%c%s\x00" % (sort_index + 3, part.encode("utf-8"))
+    # natsort compares the NFD normal form, e.g. "ä" as "a" + combining diaeresis
+    normalized = unicodedata.normalize("NFD", part)
+    if not normalized.isascii() and any(
+        not "0" <= char <= "9" and unicodedata.numeric(char, None) is not None
+        for char in normalized
+    ):
+        raise _CannotEncodeError(part)
+    encoded = [bytes([sort_index + 3])]
+    for j, chunk in enumerate(_RE_DIGITS.split(normalized)):
+        if j % 2 == 0:
+            # text chunk, natsort drops empty text, except before a leading number
+            if chunk != "" or (j == 0 and len(part) > 0):
+                encoded.append(chunk.encode("utf-8") + b"\x01")
+            continue
+        digits = str(int(chunk))
+        if len(digits) > _MAX_DIGITS:
+            raise _CannotEncodeError(part)
+        encoded.append(bytes([len(digits) + 3]) + digits.encode("ascii"))
+    encoded.append(b"\x00")
+    return b"".join(encoded)
 
 
-_total_counter = 0
-_total_size = 0
-_ignored_dirs: list[str] = []
-_ignored_files: list[str] = []
-_pbar: tqdm | None = None
-_spinner = itertools.cycle("|/-\\")
 _max_print = 40  # cut filenames when output is verbose
 _count_every = 500  # how often to update the spinner
 
 
+@define
+class IndexContext:
+    """
+    State of one iter_index call. Each call has its own context, so several indexing jobs can
+    run at the same time in threads or async tasks.
+
+    Args:
+        verbose: show a progress bar
+        show_file_if_verbose: show file names in the progress bar instead of file sizes
+    """
+
+    verbose: bool = False
+    show_file_if_verbose: bool = False
+    num_files: int = 0
+    total_size: int = 0
+    ignored_dirs: list[str] = field(factory=list)
+    ignored_files: list[str] = field(factory=list)
+    num_hashed: int = 0
+    num_hashes_reused: int = 0
+    dir_cache: Optional[_DirCache] = None
+    pbar: Optional[tqdm] = None
+    _spinner: Iterator[str] = field(factory=lambda: itertools.cycle("|/-\\"))
+
+    def open_pbar(self) -> None:
+        self.pbar = tqdm(total=0, disable=not self.verbose, desc="Indexing files")
+
+    def update(self, rel_file_str: str, size: int) -> None:
+        if self.verbose and self.num_files % _count_every == 0:
+            if self.show_file_if_verbose:
+                file_out = rel_file_str
+                if len(rel_file_str) > _max_print:
+                    half = _max_print // 2
+                    file_out = " ".join((rel_file_str[: half - 3], "...", rel_file_str[half:]))
+            else:
+                file_out = f"{size / 1024 ** 2:13,.3f} MB"
+            self.pbar.set_description(f" {next(self._spinner)} indexing {file_out}", refresh=False)
+        self.pbar.update(1)
+        self.num_files += 1
+        self.total_size += size
+
+    def close_pbar(self) -> None:
+        cache_info = ""
+        if self.dir_cache is not None:
+            cache_info = (
+                f" Listed {self.dir_cache.num_listed} dirs, reused {self.dir_cache.num_reused}."
+            )
+        if self.num_hashed + self.num_hashes_reused > 0:
+            cache_info += f" Hashed {self.num_hashed} files, reused {self.num_hashes_reused}."
+        self.pbar.set_description(
+            f"Indexed {self.num_files} files. Ignored {len(self.ignored_dirs)} dirs and "
+            f"{len(self.ignored_files)} files.{cache_info}"
+        )
+        self.pbar.clear()
+        self.pbar.close()
+
+    def get_status(self) -> dict[str, list[str]]:
+        return {"ignored_dirs": self.ignored_dirs, "ignored_files": self.ignored_files}
+
+
 def make_index(
     base_root: PathType,
     recursive: bool = True,
@@ -138,7 +413,16 @@ def make_index(
     follow_symlinks: bool = False,
     ignore_io_errors: bool = False,
     return_status: bool = False,
-) -> dict[str, FileProperties] | tuple[dict[str, FileProperties], dict[str, list[str]]]:
+    workers: int = 0,
+    cache_file: Optional[PathType] = None,
+    return_file_index: bool = False,
+    hash_algo: Optional[str] = None,
+    partial_hash_size: Optional[int] = None,
+) -> (
+    dict[str, FileProperties]
+    | FileIndex
+    | tuple[dict[str, FileProperties] | FileIndex, dict[str, list[str]]]
+):
     """Create file index dictionary of some path
 
     Args:
@@ -151,191 +435,662 @@ def make_index(
         follow_symlinks: follow symlinks (default False) both by recursing into symlinked dirs and
             by indexing symlinked files.
         ignore_io_errors: ignore IO errors when reading files
+        return_status: also return the ignored dirs and files
+        workers: number of threads that list directories in parallel, which helps on
+            high-latency filesystems like NFS. The output is the same as with 0 = single-threaded.
+        cache_file: optional file to persist the directory listings. On the next run,
+            directories whose mtime did not change are not listed again, only their files are
+            stat'ed to get the current sizes and mtimes. The cache is discarded if the root or
+            the arguments that change the listing differ.
+        return_file_index: return a compact FileIndex instead of a dict, which needs much less
+            memory for large trees.
+        hash_algo: also compute the digest of each file content with this hashlib algorithm,
+            e.g. "sha256", and return FilePropertiesWithDigest. With cache_file, digests are
+            cached and only recomputed if the size, mtime or inode of a file changed.
+        partial_hash_size: only hash the first and last partial_hash_size bytes and the size
+            of each file, for a fast pre-screening. Smaller files are hashed completely.
 
     Returns:
         file dict {filename str : (file_size int, time_last_modified float) }
     """
+    if return_file_index and hash_algo is not None:
+        raise ValueError("FileIndex does not store digests, use return_file_index=False")
     base_root = Path(base_root).resolve().absolute()
-    global _total_counter, _total_size, _pbar, _ignored_dirs, _ignored_files
-    _total_counter = 0
-    _total_size = 0
-    _ignored_dirs = []
-    _ignored_files = []
-    _pbar = tqdm(total=0, disable=not verbose, desc="Indexing files")
-    specs = []
-    if pathspec_args is not None:
-        if isinstance(pathspec_args, PathSpecArgs):
-            pathspec_args_dict = expand_pathspec_args(pathspec_args)
-        elif isinstance(pathspec_args, dict):
-            pathspec_args_dict = pathspec_args
-        else:
-            raise ValueError(f"Invalid pathspec_args: {pathspec_args}")
-        specs = make_pathspecs(**pathspec_args_dict)
-    file_list = _recursive_index(
-        base_root,
+    context = IndexContext(verbose=verbose, show_file_if_verbose=show_file_if_verbose)
+    entries = iter_index(
         base_root,
-        0,
         recursive=recursive,
-        verbose=verbose,
         reverse=reverse,
-        show_file_if_verbose=show_file_if_verbose,
-        specs=specs,
+        pathspec_args=pathspec_args,
         follow_symlinks=follow_symlinks,
         ignore_io_errors=ignore_io_errors,
+        workers=workers,
+        cache_file=cache_file,
+        context=context,
+        hash_algo=hash_algo,
+        partial_hash_size=partial_hash_size,
     )
-    file_dict = {}
-    for filename, size, modtime in file_list:
-        file_dict[filename] = FileProperties(size, modtime)
-    assert len(file_dict) == len(file_list)
-    _pbar.set_description(
-        f"Indexed {len(file_dict)} files. Ignored {len(_ignored_dirs)} dirs and "
-        f"{len(_ignored_files)} files."
-    )
-    _pbar.clear()
-    _pbar.close()
+    if return_file_index:
+        file_dict = FileIndex.from_items(entries, root=base_root.as_posix())
+    elif hash_algo is not None:
+        file_dict = {}
+        for filename, size, modtime, digest in entries:
+            file_dict[filename] = FilePropertiesWithDigest(size, modtime, digest)
+        assert len(file_dict) == context.num_files
+    else:
+        file_dict = {}
+        for filename, size, modtime in entries:
+            file_dict[filename] = FileProperties(size, modtime)
+        assert len(file_dict) == context.num_files
     if return_status:
-        return file_dict, {
-            "ignored_dirs": _ignored_dirs,
-            "ignored_files": _ignored_files,
-        }
+        return file_dict, context.get_status()
     return file_dict
 
 
-def _recursive_index(
-    root: Path,
-    base_root: Path,
-    depth: int,
+def iter_index(
+    base_root: PathType,
     recursive: bool = True,
-    verbose: bool = True,
     reverse: bool = False,
-    show_file_if_verbose: bool = False,
-    specs: Optional[SPECLISTTYPE] = None,
+    pathspec_args: PathSpecArgs | dict | None = None,
     follow_symlinks: bool = False,
     ignore_io_errors: bool = False,
-) -> list[tuple[str, int, float]]:
-    """Recursive helper function for make_index
+    workers: int = 0,
+    cache_file: Optional[PathType] = None,
+    context: Optional[IndexContext] = None,
+    hash_algo: Optional[str] = None,
+    partial_hash_size: Optional[int] = None,
+) -> Iterator[tuple[str, int, float] | tuple[str, int, float, Optional[str]]]:
+    """Iterate the files of some path in the same order as make_index, while it is indexed.
+
+    All state is kept in the context, so it is safe to run several iterators at the same time.
+    Closing the iterator early stops the traversal, the cache_file is only written if the
+    iterator is exhausted.
+
+    Examples:
+        >>> context = IndexContext()
+        >>> for rel_file, size, mtime in iter_index("data", context=context):
+        ...     print(rel_file, size)
+        >>> print(context.num_files, context.total_size, context.ignored_dirs)
 
     Args:
-        root: current root
-        base_root: total root where the indexing started
-        depth: current depth
+        base_root: input path
+        recursive: recurse into subdirs
+        reverse: output files in reverse order
+        pathspec_args: optional pathspec arguments to filter files
+        follow_symlinks: follow symlinks, see make_index
+        ignore_io_errors: ignore IO errors when reading files
+        workers: number of threads that list directories and hash files in parallel
+        cache_file: optional file to persist the directory listings and digests, see make_index
+        context: optional IndexContext to show progress and read the counters and
+            ignored dirs and files
+        hash_algo: also yield the digest of each file, see make_index
+        partial_hash_size: only hash the start and end of each file, see make_index
 
     Returns:
-        list of tuples (filename str, file_size_bytes int, time_last_modified float)
+        iterator of tuples (filename str, file_size_bytes int, time_last_modified float),
+        with the hex digest str as fourth element if hash_algo is given
+    """
+    base_root = Path(base_root).resolve().absolute()
+    if context is None:
+        context = IndexContext()
+    specs = make_pathspecs_from_args(pathspec_args)
+    if cache_file is not None:
+        config = repr((recursive, reverse, follow_symlinks, specs))
+        context.dir_cache = _DirCache.load_or_create(cache_file, base_root.as_posix(), config)
+    scan_kwargs = {
+        "recursive": recursive,
+        "reverse": reverse,
+        "specs": get_compiled_pathspecs(specs),
+        "follow_symlinks": follow_symlinks,
+        "ignore_io_errors": ignore_io_errors,
+        "dir_cache": context.dir_cache,
+    }
+    if hash_algo is not None:
+        # fail early for unknown algorithms
+        hashlib.new(hash_algo)
+    context.open_pbar()
+    executor = None if workers == 0 else ThreadPoolExecutor(max_workers=workers)
+    hash_executor = None
+    if hash_algo is not None and workers > 0:
+        hash_executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        if executor is None:
+            get_root_node = partial(_scan_node, base_root.as_posix(), "", scan_kwargs)
+        else:
+            scanner = _ParallelScanner(executor, scan_kwargs, max_pending=16 * workers)
+            get_root_node = partial(scanner.scan, base_root.as_posix(), "")
+        entries = _iter_nodes(get_root_node, context)
+        if hash_algo is not None:
+            entries = _iter_with_digests(
+                entries,
+                base_root.as_posix(),
+                hash_algo,
+                partial_hash_size,
+                context,
+                hash_executor,
+                max_pending=16 * workers,
+            )
+        yield from entries
+        if context.dir_cache is not None:
+            context.dir_cache.save(cache_file)
+    finally:
+        for pool in (executor, hash_executor):
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        context.close_pbar()
+
+
+def _iter_nodes(
+    get_root_node: Callable[[], tuple[tuple, list[Callable]]], context: IndexContext
+) -> Iterator[tuple[str, int, float]]:
+    """Depth-first traversal for iter_index, the files of a dir come after all of its subdirs.
+
+    Args:
+        get_root_node: returns the result of _scan_dir for the root, and the get_node
+            functions of its subdirs, see _scan_node and _ParallelScanner
+    """
+    (_subdirs, ignored_dirs, files, ignored_files), children = get_root_node()
+    context.ignored_dirs.extend(ignored_dirs)
+    stack = [(files, ignored_files, iter(children))]
+    while stack:
+        files, ignored_files, children = stack[-1]
+        get_child_node = next(children, None)
+        if get_child_node is not None:
+            (_subdirs, ignored_dirs, child_files, child_ignored), grandchildren = get_child_node()
+            context.ignored_dirs.extend(ignored_dirs)
+            stack.append((child_files, child_ignored, iter(grandchildren)))
+            continue
+        stack.pop()
+        context.ignored_files.extend(ignored_files)
+        for rel_file_str, size, mtime in files:
+            context.update(rel_file_str, size)
+            yield rel_file_str, size, mtime
+
+
+def _iter_with_digests(
+    entries: Iterator[tuple[str, int, float]],
+    root: str,
+    hash_algo: str,
+    partial_hash_size: Optional[int],
+    context: IndexContext,
+    executor: Optional[ThreadPoolExecutor] = None,
+    max_pending: int = 0,
+) -> Iterator[tuple[str, int, float, Optional[str]]]:
+    """Add the digests to the entries of _iter_nodes, keeping the order. With an executor, up
+    to max_pending files are hashed ahead in threads, hashlib releases the GIL while hashing."""
+    hash_mode = hash_algo if partial_hash_size is None else f"{hash_algo}:{partial_hash_size}"
+    dir_cache = context.dir_cache
+    cached_digests = {} if dir_cache is None else dir_cache.old_digests.get(hash_mode, {})
+    new_digests = None if dir_cache is None else dir_cache.new_digests.setdefault(hash_mode, {})
+    get_digest = partial(_get_file_digest, hash_algo=hash_algo, partial_size=partial_hash_size)
+
+    def get_result(entry, result) -> tuple[str, int, float, Optional[str]]:
+        rel_file_str, size, mtime = entry
+        digest, key, was_cached = result
+        if was_cached:
+            context.num_hashes_reused += 1
+        elif digest is not None:
+            context.num_hashed += 1
+        if new_digests is not None and key is not None:
+            # files modified this shortly before the scan may change again without a new mtime
+            if key[1] <= dir_cache.start_ns - _RACY_MTIME_NS:
+                new_digests[rel_file_str] = (*key, digest)
+        return rel_file_str, size, mtime, digest
+
+    pending = deque()
+    for entry in entries:
+        args = (os.path.join(root, entry[0]), cached_digests.get(entry[0]))
+        if executor is None:
+            yield get_result(entry, get_digest(*args))
+            continue
+        pending.append((entry, executor.submit(get_digest, *args)))
+        if len(pending) > max_pending:
+            entry, future = pending.popleft()
+            yield get_result(entry, future.result())
+    while pending:
+        entry, future = pending.popleft()
+        yield get_result(entry, future.result())
+
+
+def _get_file_digest(
+    file: str, cached: Optional[tuple], hash_algo: str, partial_size: Optional[int]
+) -> tuple[Optional[str], Optional[tuple[int, int, int]], bool]:
+    """
+    Args:
+        file: absolute path
+        cached: cached tuple (size, mtime_ns, inode, digest) or None
+
+    Returns:
+        tuple of digest or None on errors, key (size, mtime_ns, inode) or None on errors,
+        and whether the cached digest was reused
+    """
+    try:
+        file_stat = os.stat(file)
+        key = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+        if cached is not None and cached[:3] == key:
+            return cached[3], key, True
+        return hash_file(file, hash_algo, partial_size), key, False
+    except OSError as e:
+        logger.warning(f"Could not hash {file}: {format_exception(e)}")
+        return None, None, False
+
+
+def hash_file(
+    file: PathType,
+    hash_algo: str = "sha256",
+    partial_size: Optional[int] = None,
+    chunk_size: int = 1024**2,
+) -> str:
+    """Compute the digest of a file, reading it in chunks into a reused buffer.
+
+    Args:
+        file: file to hash
+        hash_algo: hashlib algorithm name
+        partial_size: only hash the first and last partial_size bytes and the size of the file.
+            Files of up to 2 * partial_size bytes are hashed completely, so their partial digest
+            is the same as their full digest.
+        chunk_size: read size in bytes
+
+    Returns:
+        hex digest
+    """
+    hasher = hashlib.new(hash_algo)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file, "rb", buffering=0) as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if partial_size is not None and size > 2 * partial_size:
+            for start in (0, size - partial_size):
+                fh.seek(start)
+                remaining = partial_size
+                while remaining > 0:
+                    n = fh.readinto(view[: min(remaining, chunk_size)])
+                    if n == 0:
+                        break
+                    hasher.update(view[:n])
+                    remaining -= n
+            hasher.update(size.to_bytes(8, "little"))
+            return hasher.hexdigest()
+        while True:
+            n = fh.readinto(view)
+            if n == 0:
+                break
+            hasher.update(view[:n])
+    return hasher.hexdigest()
+
+
+def _scan_node(root: str, rel_root: str, scan_kwargs: dict) -> tuple[tuple, list[Callable]]:
+    """Scan a dir and return functions that scan its subdirs when called."""
+    result = _scan_dir_cached(root, rel_root, **scan_kwargs)
+    children = [
+        partial(_scan_node, abs_dir, rel_dir, scan_kwargs) for abs_dir, rel_dir in result[0]
+    ]
+    return result, children
+
+
+@define(slots=True)
+class _ScanJob:
+    root: str
+    rel_root: str
+    started: bool = False
+    future: Optional[Future] = None
+
+
+@define
+class _ParallelScanner:
+    """Scan dirs in threads ahead of the consumer in _iter_nodes. At most max_pending scans
+    are queued, running or done but not yet consumed, so the memory stays bounded for large
+    trees. Pathspecs are applied in _scan_dir, so ignored dirs are never scanned.
+
+    Args:
+        executor: thread pool for the scans
+        scan_kwargs: arguments for _scan_dir_cached
+        max_pending: maximum number of scans ahead of the consumer
+    """
+
+    executor: ThreadPoolExecutor
+    scan_kwargs: dict
+    max_pending: int
+    num_pending: int = 0
+    # stack of jobs to start, the next job in depth-first order is last
+    waiting: list[_ScanJob] = field(factory=list)
+    lock: threading.Lock = field(factory=threading.Lock)
+
+    def scan(self, root: str, rel_root: str) -> tuple[tuple, list[Callable]]:
+        """Scan a dir and queue its subdirs, returns functions that get the subdir results."""
+        result = _scan_dir_cached(root, rel_root, **self.scan_kwargs)
+        jobs = [_ScanJob(abs_dir, rel_dir) for abs_dir, rel_dir in result[0]]
+        with self.lock:
+            self.waiting.extend(reversed(jobs))
+        self._start_waiting()
+        return result, [partial(self._get_result, job) for job in jobs]
+
+    def _start_waiting(self) -> None:
+        with self.lock:
+            while self.num_pending < self.max_pending and len(self.waiting) > 0:
+                job = self.waiting.pop()
+                if job.started:
+                    continue
+                job.started = True
+                job.future = self.executor.submit(self.scan, job.root, job.rel_root)
+                self.num_pending += 1
+
+    def _get_result(self, job: _ScanJob) -> tuple[tuple, list[Callable]]:
+        with self.lock:
+            is_started = job.started
+            job.started = True
+        if not is_started:
+            # the consumer caught up with the scans
+            return self.scan(job.root, job.rel_root)
+        result = job.future.result()
+        job.future = None
+        with self.lock:
+            self.num_pending -= 1
+        self._start_waiting()
+        return result
+
+
+def _scan_dir_cached(
+    root: str, rel_root: str, dir_cache: Optional[_DirCache] = None, **scan_kwargs
+) -> tuple[list[tuple[str, str]], list[str], list[tuple[str, int, float]], list[str]]:
+    """Reuse the cached listing of the dir if its mtime did not change, otherwise scan it."""
+    if dir_cache is None:
+        return _scan_dir(root, rel_root, **scan_kwargs)
+    # stat before listing, so changes during the listing are detected on the next run
+    mtime_ns = dir_cache.get_dir_mtime_ns(root)
+    result = dir_cache.get_result(root, rel_root, mtime_ns)
+    if result is None:
+        result = _scan_dir(root, rel_root, **scan_kwargs)
+    dir_cache.set_result(rel_root, mtime_ns, result)
+    return result
+
+
+def _scan_dir(
+    root: str,
+    rel_root: str,
+    recursive: bool = True,
+    reverse: bool = False,
+    specs: Optional[CompiledPathSpecs] = None,
+    follow_symlinks: bool = False,
+    ignore_io_errors: bool = False,
+) -> tuple[list[tuple[str, str]], list[str], list[tuple[str, int, float]], list[str]]:
+    """List and filter a single directory with os.scandir.
+
+    The DirEntry objects cache the file type from the directory listing and the stat result,
+    so regular files cost at most one stat call and no Path objects are created.
+
+    Returns:
+        tuple of
+            subdirs to recurse into as list of (absolute path, relative path with trailing slash)
+            ignored dirs as list of "/relative/path/"
+            files as list of (relative path, size, mtime)
+            ignored files as list of "/relative/path"
     """
     if specs is None:
-        specs = []
-    global _total_counter, _total_size, _ignored_dirs, _ignored_files
-    entries = []
-    dirs, files = None, None
-    for _, dirs, files in os.walk(root, followlinks=follow_symlinks):
-        # probably the followlinks doesn't do anything here since we do not recurse with os.walk
-        break
-
-    def sorter(input_list):
-        if input_list is None:
-            return None
-        if reverse:
-            return reversed(sorted(input_list))
-        return sorted(input_list)
-
-    dirs = sorter(dirs)
-    files = sorter(files)
-    if dirs is not None and recursive:
-        abs_dirs = []
-        for d in dirs:
-            abs_dir = (root / d).absolute()
-            if not abs_dir.is_dir():  # protect against things like mounts, only index real dirs.
-                continue
-            if abs_dir.is_symlink():
+        specs = get_compiled_pathspecs([])
+    try:
+        with os.scandir(root) as scandir_it:
+            all_entries = list(scandir_it)
+    except OSError:
+        # same as os.walk, unreadable directories are skipped
+        return [], [], [], []
+    dir_entries, file_entries = [], []
+    for entry in all_entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+        (dir_entries if is_dir else file_entries).append(entry)
+    dir_entries.sort(key=attrgetter("name"), reverse=reverse)
+    file_entries.sort(key=attrgetter("name"), reverse=reverse)
+
+    subdirs, ignored_dirs = [], []
+    if recursive:
+        for entry in dir_entries:
+            if entry.is_symlink():
                 if not follow_symlinks:
                     continue
                 # reading the link will raise an error if the link is broken.
-                abs_dir.readlink()
-            abs_dirs.append(abs_dir)
-        if not follow_symlinks:
-            abs_dirs = [d for d in abs_dirs if not d.is_symlink()]
+                os.readlink(entry.path)
+            subdirs.append((entry.path, f"{rel_root}{entry.name}/"))
         if len(specs) > 0:
             # for gitignore to work properly it needs a leading slash to know where the root is,
             # and a trailing slash to know it's a dir.
-            rel_dirs_for_pathspec = [f"/{d.relative_to(base_root).as_posix()}/" for d in abs_dirs]
-            n_before = len(rel_dirs_for_pathspec)
-            rel_dirs_after_filtering = list(apply_pathspecs(rel_dirs_for_pathspec, specs))
-            # Store the ignored directories in the proper format
-            ignored_this_round = set(rel_dirs_for_pathspec) - set(rel_dirs_after_filtering)
-            _ignored_dirs.extend(sorted(ignored_this_round))
-            rel_dirs = [Path(d).relative_to("/") for d in rel_dirs_after_filtering]
-            # convert back to absolute dirs
-            abs_dirs = [base_root / d for d in rel_dirs]
-        # print(f"Directory candidates: {abs_dirs} in {root}")
-        for root_new in abs_dirs:
-            entries += _recursive_index(
-                root_new,
-                base_root,
-                depth + 1,
-                recursive=recursive,
-                verbose=verbose,
-                reverse=reverse,
-                show_file_if_verbose=show_file_if_verbose,
-                specs=specs,
-                follow_symlinks=follow_symlinks,
-                ignore_io_errors=ignore_io_errors,
-            )
-    if files is None:
-        return entries
+            is_selected = specs.match_many([f"/{rel_dir}" for _, rel_dir in subdirs])
+            ignored_dirs = sorted(f"/{d[1]}" for d, keep in zip(subdirs, is_selected) if not keep)
+            subdirs = [d for d, keep in zip(subdirs, is_selected) if keep]
 
-    abs_files = []
-    for f in files:
+    selected_files = []
+    for entry in file_entries:
         try:
-            abs_file = (root / f).absolute()
-            if abs_file.is_symlink() and follow_symlinks:
-                # pathlib silently ignores recursive symlinks. the way to detect the error is because
-                # it is not a directory anymore, but following it will lead to a directory.
-                linked_file = abs_file.readlink()
-                if linked_file.is_dir() and not abs_file.is_dir():
+            if follow_symlinks and entry.is_symlink():
+                # pathlib silently ignores recursive symlinks. the way to detect the error is
+                # because it is not a directory anymore, but following it will lead to a directory.
+                linked_file = Path(os.readlink(entry.path))
+                if linked_file.is_dir() and not Path(entry.path).is_dir():
                     raise RuntimeError(
-                        f"Broken symlink, potentially recursive: {abs_file} -> {linked_file}"
+                        f"Broken symlink, potentially recursive: {entry.path} -> {linked_file}"
                     )
-            if not abs_file.is_file():
+            if not entry.is_file():
                 # .is_file() safeguards against stuff like /dev/zero which returns .is_char_device()
                 continue
-            if abs_file.is_symlink() and not follow_symlinks:
+            if entry.is_symlink() and not follow_symlinks:
                 continue
-            abs_files.append(abs_file)
+            selected_files.append(entry)
         except OSError as e:
             if "input/output error" in str(e).lower() and ignore_io_errors:
                 logger.error(f"IO error: {format_exception(e)}")
-                continue
-    rel_files = [f.relative_to(base_root) for f in abs_files]
-    # again the files need a leading slash for gitignore to work properly
-    rel_files_leading_slash = [f"/{f.as_posix()}" for f in rel_files]
+            continue
+
+    ignored_files = []
     if len(specs) > 0:
-        # filter with pathspecs on relative file level
-        n_before = len(rel_files)
-        rel_files_after_filtering = list(apply_pathspecs(rel_files_leading_slash, specs))
-        # Store the ignored files in the proper format
-        ignored_this_round = set(rel_files_leading_slash) - set(rel_files_after_filtering)
-        _ignored_files.extend(sorted(ignored_this_round))
-        rel_files = [Path(f).relative_to("/") for f in rel_files_after_filtering]
-        abs_files = [base_root / ff for ff in rel_files]
-
-    for abs_file, rel_file in zip(abs_files, rel_files):
-        rel_file_str = rel_file.as_posix()
-
-        # get size and mod time
-        stat = abs_file.stat()
-        entries.append((rel_file_str, int(stat.st_size), float(stat.st_mtime)))
-
-        # logging
-        if verbose and _total_counter % _count_every == 0:
-            if show_file_if_verbose:
-                file_out = rel_file_str
-                if len(rel_file_str) > _max_print:
-                    half = _max_print // 2
-                    file_out = " ".join((rel_file_str[: half - 3], "...", rel_file_str[half:]))
-            else:
-                file_out = f"{stat.st_size / 1024 ** 2:13,.3f} MB"
-            _pbar.set_description(f" {next(_spinner)} indexing {file_out}", refresh=False)
-        _pbar.update(1)
-        _total_counter += 1
-    return entries
+        # again the files need a leading slash for gitignore to work properly
+        rel_files_leading_slash = [f"/{rel_root}{entry.name}" for entry in selected_files]
+        is_selected = specs.match_many(rel_files_leading_slash)
+        ignored_files = sorted(
+            rel_file
+            for rel_file, keep in zip(rel_files_leading_slash, is_selected)
+            if not keep
+        )
+        selected_files = [entry for entry, keep in zip(selected_files, is_selected) if keep]
+
+    files = []
+    for entry in selected_files:
+        # get size and mod time, for regular files this reuses the stat result of is_file()
+        entry_stat = entry.stat()
+        files.append(
+            (f"{rel_root}{entry.name}", int(entry_stat.st_size), float(entry_stat.st_mtime))
+        )
+    return subdirs, ignored_dirs, files, ignored_files
+
+
+@define
+class IndexDiff:
+    """Changes between two file indexes, see diff_indexes. Files can be in both changed sets."""
+
+    added: set[str]
+    removed: set[str]
+    size_changed: set[str]
+    mtime_changed: set[str]
+
+    @property
+    def modified(self) -> set[str]:
+        return self.size_changed | self.mtime_changed
+
+    def __len__(self) -> int:
+        return len(self.added) + len(self.removed) + len(self.modified)
+
+
+def diff_indexes(
+    old: FileIndex | dict[str, FileProperties],
+    new: FileIndex | dict[str, FileProperties],
+) -> IndexDiff:
+    """
+    Compare two file indexes, e.g. two snapshots of the same tree.
+
+    The paths are matched by their 64-bit hashes with a vectorized sorted merge, then the bytes
+    of all matched pairs are compared. Two different paths with the same hash are reported as
+    removed and added. Hash collisions inside one index fall back to dict lookups.
+
+    Args:
+        old: old index, as returned by make_index
+        new: new index
+
+    Returns:
+        IndexDiff with the sets of added, removed, size-changed and mtime-changed paths
+    """
+    old_index = old if isinstance(old, FileIndex) else FileIndex.from_dict(old)
+    new_index = new if isinstance(new, FileIndex) else FileIndex.from_dict(new)
+    old_hashes, old_order = old_index.get_sorted_hashes()
+    new_hashes, new_order = new_index.get_sorted_hashes()
+    if np.any(old_hashes[1:] == old_hashes[:-1]) or np.any(new_hashes[1:] == new_hashes[:-1]):
+        return _diff_indexes_with_dicts(old_index, new_index)
+    # merge the sorted hashes
+    matches = np.searchsorted(old_hashes, new_hashes)
+    matches[matches == len(old_hashes)] = 0
+    is_common = old_hashes[matches] == new_hashes if len(old_hashes) > 0 else matches > 0
+    pos_old = old_order[matches[is_common]].astype(np.int64)
+    pos_new = new_order[is_common].astype(np.int64)
+    # the hashes are unique inside each index, so pairs with different paths match nothing
+    is_equal = segments_equal(
+        old_index.path_data,
+        old_index.offsets,
+        pos_old,
+        new_index.path_data,
+        new_index.offsets,
+        pos_new,
+    )
+    pos_old, pos_new = pos_old[is_equal], pos_new[is_equal]
+
+    is_removed = np.ones(len(old_index), dtype=bool)
+    is_removed[pos_old] = False
+    is_added = np.ones(len(new_index), dtype=bool)
+    is_added[pos_new] = False
+    size_changed = pos_new[old_index.sizes[pos_old] != new_index.sizes[pos_new]]
+    mtime_changed = pos_new[old_index.mtimes[pos_old] != new_index.mtimes[pos_new]]
+    return IndexDiff(
+        added={new_index.get_path(i) for i in np.flatnonzero(is_added)},
+        removed={old_index.get_path(i) for i in np.flatnonzero(is_removed)},
+        size_changed={new_index.get_path(i) for i in size_changed},
+        mtime_changed={new_index.get_path(i) for i in mtime_changed},
+    )
+
+
+def _diff_indexes_with_dicts(old: FileIndex, new: FileIndex) -> IndexDiff:
+    old_dict, new_dict = old.to_dict(), new.to_dict()
+    common = old_dict.keys() & new_dict.keys()
+    return IndexDiff(
+        added=set(new_dict.keys() - common),
+        removed=set(old_dict.keys() - common),
+        size_changed={p for p in common if old_dict[p].size != new_dict[p].size},
+        mtime_changed={p for p in common if old_dict[p].mtime != new_dict[p].mtime},
+    )
+
+
+_DIR_CACHE_VERSION = 1
+# directories modified this shortly before the scan may be modified again without their mtime
+# changing, due to the mtime resolution of the filesystem. their mtime is not stored.
+_RACY_MTIME_NS = 2_000_000_000
+
+
+@define
+class _DirCache:
+    """
+    Persisted listings of the directories of one make_index call.
+
+    For each directory relative to the root (e.g. "" or "sub/dir/") store a tuple
+    (mtime_ns or None, subdir names, ignored dirs, file names, ignored files)
+    with the same filtering and order as the output of _scan_dir.
+
+    For each hash mode (e.g. "sha256" or "sha256:65536" for partial hashes) store the digests
+    as {relative file: (size, mtime_ns, inode, digest)}. Digests of modes not used in this
+    call are kept.
+    """
+
+    root: str
+    config: str
+    old_dirs: dict[str, tuple] = field(factory=dict)
+    new_dirs: dict[str, tuple] = field(factory=dict)
+    start_ns: int = field(factory=time.time_ns)
+    reused: list[str] = field(factory=list)
+    old_digests: dict[str, dict[str, tuple]] = field(factory=dict)
+    new_digests: dict[str, dict[str, tuple]] = field(factory=dict)
+
+    @classmethod
+    def load_or_create(cls, cache_file: PathType, root: str, config: str) -> _DirCache:
+        cache_file = Path(cache_file)
+        if not cache_file.is_file():
+            return cls(root, config)
+        try:
+            with cache_file.open("rb") as fh:
+                data = pickle.load(fh)
+        except Exception as e:
+            logger.warning(f"Ignoring broken index cache {cache_file}: {format_exception(e)}")
+            return cls(root, config)
+        if (data["version"], data["root"], data["config"]) != (_DIR_CACHE_VERSION, root, config):
+            logger.info(f"Index cache {cache_file} was created differently, rescanning.")
+            return cls(root, config)
+        return cls(root, config, old_dirs=data["dirs"], old_digests=data.get("digests", {}))
+
+    def save(self, cache_file: PathType) -> None:
+        cache_file = Path(cache_file)
+        os.makedirs(cache_file.parent, exist_ok=True)
+        data = {
+            "version": _DIR_CACHE_VERSION,
+            "root": self.root,
+            "config": self.config,
+            "dirs": self.new_dirs,
+            "digests": {**self.old_digests, **self.new_digests},
+        }
+        tmp_file = cache_file.parent / f"{cache_file.name}.tmp"
+        with tmp_file.open("wb") as fh:
+            pickle.dump(data, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
+    @property
+    def num_reused(self) -> int:
+        return len(self.reused)
+
+    @property
+    def num_listed(self) -> int:
+        return len(self.new_dirs) - len(self.reused)
+
+    @staticmethod
+    def get_dir_mtime_ns(root: str) -> Optional[int]:
+        try:
+            return os.stat(root).st_mtime_ns
+        except OSError:
+            return None
+
+    def get_result(self, root: str, rel_root: str, mtime_ns: Optional[int]) -> Optional[tuple]:
+        """Recreate the output of _scan_dir from the cache, or None if the dir must be listed."""
+        cached = self.old_dirs.get(rel_root)
+        if mtime_ns is None or cached is None or cached[0] != mtime_ns:
+            return None
+        _, subdir_names, ignored_dirs, file_names, ignored_files = cached
+        subdirs = [(os.path.join(root, name), f"{rel_root}{name}/") for name in subdir_names]
+        files = []
+        for name in file_names:
+            # the content of files can change without changing the mtime of the dir
+            try:
+                file_stat = os.stat(os.path.join(root, name))
+            except OSError:
+                return None
+            if not stat.S_ISREG(file_stat.st_mode):
+                return None
+            files.append((f"{rel_root}{name}", int(file_stat.st_size), float(file_stat.st_mtime)))
+        self.reused.append(rel_root)
+        return subdirs, ignored_dirs, files, ignored_files
+
+    def set_result(self, rel_root: str, mtime_ns: Optional[int], result: tuple) -> None:
+        subdirs, ignored_dirs, files, ignored_files = result
+        if mtime_ns is not None and mtime_ns > self.start_ns - _RACY_MTIME_NS:
+            mtime_ns = None
+        n_rel = len(rel_root)
+        self.new_dirs[rel_root] = (
+            mtime_ns,
+            [rel_dir[n_rel:-1] for _, rel_dir in subdirs],
+            ignored_dirs,
+            [rel_file[n_rel:] for rel_file, _, _ in files],
+            ignored_files,
+        )
@@ -1,17 +1,47 @@
 from __future__ import annotations
 
 import os
+import queue
+import sys
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import NamedTuple, Optional
 
+import numpy as np
 from attr import define
-from attrs import field
+from attrs import cmp_using, field
+from deprecated import deprecated
 from loguru import logger
 
 from packg import format_exception
 from packg.iotools import format_b_in_mb
+from packg.iotools.file_indexer import _RACY_MTIME_NS
 from packg.iotools.misc import format_b_in_gb
+from packg.typext import PathType
+
+FOLDER_TREE_VERSION = 1
+
+
+class FileSizeAndMtime(NamedTuple):
+    """Replaces the os.stat_result of files in Folder.files_and_stat, with the same names."""
+
+    st_size: int
+    st_mtime: float
+
+
+def _empty_array(dtype) -> np.ndarray:
+    return np.zeros(0, dtype=dtype)
+
+
+def _array_field(dtype):
+    return field(
+        factory=partial(_empty_array, dtype),
+        init=False,
+        repr=False,
+        eq=cmp_using(eq=np.array_equal),
+    )
 
 
 @define
@@ -19,19 +49,27 @@ class Folder:
     """
     Recursive folder class to get and print sizes of all files and folders in a directory.
 
+    The tree is kept small for large filesystems: files are stored per folder as interned
+    names and numpy arrays of sizes and mtimes instead of full stat results.
+
     Usage:
         root = Folder("/path/to/folder")
         root.populate(recursive=True)
         print(root.total_size)
+        root.save("tree.npz")
+        root = Folder.load("tree.npz")
     """
 
     full_path: Path = field()
-    running_total_size: int = field(default=0, repr=False)
-    last_total_size: int = field(default=0, repr=False)
+    # progress counters for logging, they depend on the traversal order so they are not compared
+    running_total_size: int = field(default=0, repr=False, eq=False)
+    last_total_size: int = field(default=0, repr=False, eq=False)
 
     # Initialize other fields with default factory
-    files_and_stat: dict[str, os.stat_result] = field(factory=dict, init=False, repr=False)
-    own_stat: Optional[os.stat_result] = field(default=None, init=False, repr=False)
+    file_names: list[str] = field(factory=list, init=False, repr=False)
+    file_sizes: np.ndarray = _array_field(np.int64)
+    file_mtimes: np.ndarray = _array_field(np.float64)
+    mtime_ns: Optional[int] = field(default=None, init=False, repr=False)
     dir_refs: dict[str, Folder] = field(factory=dict, init=False, repr=False)
     files_size: int = field(default=0, init=False)
     dirs_size: int = field(default=0, init=False)
@@ -41,11 +79,21 @@ class Folder:
     def __attrs_post_init__(self):
         self.full_path = Path(self.full_path)
 
-    def populate(self, recursive: bool = True, level: int = 0):
+    def populate(self, recursive: bool = True, level: int = 0, workers: int = 0):
+        """
+        Args:
+            recursive: also populate all subfolders
+            level: recursion level, only used for logging
+            workers: number of threads to list and stat the subfolders in parallel,
+                0 to populate everything in this thread. The resulting tree is the same.
+        """
         if self.populated:
             return
+        if recursive and workers > 0:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                self._populate_parallel(executor)
+            return
 
-        self.own_stat = self.full_path.stat()
         if (self.running_total_size - self.last_total_size) > 1024**3:
             logger.info(f"... {format_b_in_gb(self.running_total_size):10s} at {self.full_path}")
             self.last_total_size = self.running_total_size
@@ -53,25 +101,8 @@ class Folder:
         start_path = Path(self.full_path)
         indent = "    " * level
         logger.debug(f"{indent}Finding all files in {start_path}")
-        dirs = []
-        files_size = 0
-        for file in sorted(os.listdir(start_path)):
-            full_file = start_path / file
-            try:
-                if full_file.is_symlink():
-                    logger.debug(f"{indent}SKIP {full_file} (symlink)")
-                    continue
-                if full_file.is_dir():
-                    dirs.append(file)
-                    continue
-                if full_file.is_file():
-                    self.files_and_stat[file] = full_file.stat()
-                    continue
-            except OSError as e:
-                logger.warning(f"{indent}SKIP {full_file} ({format_exception(e)})")
-            logger.debug(f"{indent}SKIP {full_file} (neither file nor dir?)")
-        logger.debug(f"File size: {files_size}")
-        self.files_size = sum(st.st_size for st in self.files_and_stat.values())
+        dirs = self._set_listing(_list_folder(start_path, indent))
+        logger.debug(f"File size: {self.files_size}")
         self.running_total_size += self.files_size
 
         if recursive:
@@ -97,6 +128,211 @@ class Folder:
         logger.debug(f"{indent}Got total size {format_b_in_mb(self.total_size)} for {start_path}")
         self.populated = True
 
+    def _populate_parallel(self, executor: ThreadPoolExecutor):
+        """
+        List all folders of the tree in the thread pool. The main thread creates the subfolders
+        as listings arrive and queues their listing, then sums up the sizes bottom-up.
+        """
+        results: queue.SimpleQueue[tuple[Folder, Future]] = queue.SimpleQueue()
+
+        def submit(folder_to_list: Folder):
+            future = executor.submit(_list_folder, folder_to_list.full_path)
+            future.add_done_callback(lambda f: results.put((folder_to_list, f)))
+
+        submit(self)
+        num_pending = 1
+        while num_pending > 0:
+            folder, future = results.get()
+            num_pending -= 1
+            dirs = folder._set_listing(future.result())
+            self.running_total_size += folder.files_size
+            if (self.running_total_size - self.last_total_size) > 1024**3:
+                logger.info(
+                    f"... {format_b_in_gb(self.running_total_size):10s} at {folder.full_path}"
+                )
+                self.last_total_size = self.running_total_size
+            for dr in dirs:
+                subfolder = Folder(folder.full_path / dr)
+                folder.dir_refs[dr] = subfolder
+                submit(subfolder)
+                num_pending += 1
+        self._sum_up_sizes()
+
+    def refresh(self, workers: int = 0) -> int:
+        """
+        Update a populated tree, e.g. one loaded from a file. The mtime of every folder is
+        compared to the stored one, only changed folders are listed again. Their new
+        subfolders are populated, removed ones are dropped. Then the sizes are summed up again.
+
+        The mtime of a folder only changes when entries are added, removed or renamed, so files
+        that were changed in place are not detected. Folders that were modified shortly before
+        they were listed have no stored mtime and are always listed again.
+
+        Args:
+            workers: number of threads to check the mtimes and populate new subfolders
+
+        Returns:
+            number of folders that were listed again
+        """
+        if not self.populated:
+            self.populate(recursive=True, workers=workers)
+            return sum(1 for _ in self.iter_folders())
+        folders = list(self.iter_folders())
+        paths = [folder.full_path for folder in folders]
+        if workers > 0:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                mtimes_ns = list(executor.map(_get_mtime_ns_or_none, paths))
+        else:
+            mtimes_ns = [_get_mtime_ns_or_none(path) for path in paths]
+        changed_ids = {
+            id(folder)
+            for folder, mtime_ns in zip(folders, mtimes_ns)
+            if mtime_ns is None or mtime_ns != folder.mtime_ns
+        }
+        num_listed = self._refresh_changed(changed_ids, workers)
+        self._sum_up_sizes()
+        if num_listed > 0:
+            logger.info(f"Listed {num_listed} changed of {len(folders)} folders again")
+        return num_listed
+
+    def _refresh_changed(self, changed_ids: set[int], workers: int) -> int:
+        num_listed = 0
+        if id(self) in changed_ids:
+            logger.debug(f"Folder changed: {self.full_path}")
+            dirs = self._set_listing(_list_folder(self.full_path))
+            num_listed += 1
+            old_dir_refs, self.dir_refs = self.dir_refs, {}
+            for dr in dirs:
+                folder = old_dir_refs.get(dr)
+                if folder is None:
+                    folder = Folder(self.full_path / dr)
+                    folder.populate(recursive=True, level=1, workers=workers)
+                self.dir_refs[dr] = folder
+        for folder in self.dir_refs.values():
+            if folder.populated:
+                num_listed += folder._refresh_changed(changed_ids, workers)
+        return num_listed
+
+    def _set_listing(self, listing: tuple) -> list[str]:
+        """Store the output of _list_folder, returns the subfolder names."""
+        self.mtime_ns, dirs, self.file_names, self.file_sizes, self.file_mtimes = listing
+        self.files_size = int(self.file_sizes.sum())
+        return dirs
+
+    def _sum_up_sizes(self):
+        """Compute the sizes of this folder and its subfolders after they have been listed."""
+        for folder in self.dir_refs.values():
+            folder._sum_up_sizes()
+        self.dirs_size = sum(v.total_size for v in self.dir_refs.values())
+        self.total_size = self.files_size + self.dirs_size
+        self.populated = True
+
+    @property
+    def files_and_stat(self) -> dict[str, FileSizeAndMtime]:
+        """Dict {file name: (st_size, st_mtime)}, for code written for the old full stats."""
+        return {
+            name: FileSizeAndMtime(size, mtime)
+            for name, size, mtime in zip(
+                self.file_names, self.file_sizes.tolist(), self.file_mtimes.tolist()
+            )
+        }
+
+    @property
+    def mtime(self) -> Optional[float]:
+        return None if self.mtime_ns is None else self.mtime_ns / 1e9
+
+    @property
+    @deprecated("Use Folder.mtime_ns or Folder.mtime instead")
+    def own_stat(self) -> Optional[os.stat_result]:
+        """Stat result of the folder, None if it is not populated. The tree only keeps the
+        mtime, so this stats the folder again."""
+        return self.full_path.stat() if self.populated else None
+
+    def save(self, file: PathType) -> None:
+        """
+        Save the tree as uncompressed npz file of flat arrays, all folders in depth-first order.
+        Names are stored as one zero-separated utf-8 blob, so saving and loading does not
+        create or pickle python objects per file.
+
+        Args:
+            file: output file
+        """
+        folders = list(self.iter_folders())
+        position = {id(folder): i for i, folder in enumerate(folders)}
+        parents = np.full(len(folders), -1, dtype=np.int64)
+        for i, folder in enumerate(folders):
+            for subfolder in folder.dir_refs.values():
+                parents[position[id(subfolder)]] = i
+        dir_names = [self.full_path.as_posix()] + [folder.full_path.name for folder in folders[1:]]
+        file_names = [name for folder in folders for name in folder.file_names]
+        arrays = {
+            "version": np.array([FOLDER_TREE_VERSION], dtype=np.int64),
+            "parents": parents,
+            "dir_names": _join_names(dir_names),
+            "mtimes_ns": np.array([folder.mtime_ns or 0 for folder in folders], dtype=np.int64),
+            "populated": np.array([folder.populated for folder in folders], dtype=bool),
+            "files_sizes": np.array([folder.files_size for folder in folders], dtype=np.int64),
+            "total_sizes": np.array([folder.total_size for folder in folders], dtype=np.int64),
+            "file_counts": np.array([len(folder.file_names) for folder in folders], np.int64),
+            "file_names": _join_names(file_names),
+            "file_sizes": _concatenate([folder.file_sizes for folder in folders], np.int64),
+            "file_mtimes": _concatenate([folder.file_mtimes for folder in folders], np.float64),
+        }
+        file = Path(file)
+        os.makedirs(file.parent, exist_ok=True)
+        tmp_file = file.parent / f"{file.name}.tmp"
+        with tmp_file.open("wb") as fh:
+            np.savez(fh, **arrays)
+        os.replace(tmp_file, file)
+
+    @classmethod
+    def load(cls, file: PathType) -> Folder:
+        """
+        Load a tree created with save.
+
+        Args:
+            file: input file
+        """
+        with np.load(file, allow_pickle=False) as data:
+            arrays = dict(data.items())
+        if int(arrays["version"][0]) != FOLDER_TREE_VERSION:
+            raise ValueError(
+                f"Folder tree {file} has version {int(arrays['version'][0])}, "
+                f"expected {FOLDER_TREE_VERSION}"
+            )
+        dir_names = _split_names(arrays["dir_names"])
+        file_names = _split_names(arrays["file_names"])
+        file_ends = np.cumsum(arrays["file_counts"]).tolist()
+        folders = []
+        mtimes_ns, populated = arrays["mtimes_ns"].tolist(), arrays["populated"].tolist()
+        files_sizes, total_sizes = arrays["files_sizes"].tolist(), arrays["total_sizes"].tolist()
+        for i, parent in enumerate(arrays["parents"].tolist()):
+            if parent < 0:
+                folder = cls(dir_names[i])
+            else:
+                folder = cls(folders[parent].full_path / dir_names[i])
+                folders[parent].dir_refs[dir_names[i]] = folder
+            start = 0 if i == 0 else file_ends[i - 1]
+            folder.file_names = file_names[start : file_ends[i]]
+            folder.file_sizes = arrays["file_sizes"][start : file_ends[i]]
+            folder.file_mtimes = arrays["file_mtimes"][start : file_ends[i]]
+            # 0 is stored for folders without mtime
+            folder.mtime_ns = mtimes_ns[i] or None
+            folder.populated = populated[i]
+            folder.files_size = files_sizes[i]
+            folder.total_size = total_sizes[i]
+            folder.dirs_size = total_sizes[i] - files_sizes[i]
+            folders.append(folder)
+        return folders[0]
+
+    def iter_folders(self):
+        """Yield this folder and all subfolders depth-first, parents before children."""
+        stack = [self]
+        while len(stack) > 0:
+            folder = stack.pop()
+            yield folder
+            stack.extend(reversed(folder.dir_refs.values()))
+
     def get_dir_index(self, base_dir="", level: int = 0, max_level: int = -1):
         """
         Returns:
@@ -115,6 +351,75 @@ class Folder:
         return dir_index
 
 
+def _list_folder(
+    start_path: Path, indent: str = ""
+) -> tuple[Optional[int], list[str], list[str], np.ndarray, np.ndarray]:
+    """
+    List a single folder with os.scandir, symlinks are skipped.
+
+    Returns:
+        tuple of (mtime of the folder in ns or None if it was modified too shortly before the
+            listing, sorted subfolder names, sorted file names, file sizes, file mtimes)
+    """
+    start_ns = time.time_ns()
+    mtime_ns = start_path.stat().st_mtime_ns
+    if mtime_ns > start_ns - _RACY_MTIME_NS:
+        # the folder may change again without its mtime changing, so it is always listed again
+        mtime_ns = None
+    with os.scandir(start_path) as scandir_it:
+        entries = sorted(scandir_it, key=lambda entry: entry.name)
+    dirs, file_names, file_sizes, file_mtimes = [], [], [], []
+    for entry in entries:
+        try:
+            if entry.is_symlink():
+                logger.debug(f"{indent}SKIP {entry.path} (symlink)")
+                continue
+            if entry.is_dir():
+                dirs.append(sys.intern(entry.name))
+                continue
+            if entry.is_file():
+                entry_stat = entry.stat()
+                file_names.append(sys.intern(entry.name))
+                file_sizes.append(entry_stat.st_size)
+                file_mtimes.append(entry_stat.st_mtime)
+                continue
+        except OSError as e:
+            logger.warning(f"{indent}SKIP {entry.path} ({format_exception(e)})")
+        logger.debug(f"{indent}SKIP {entry.path} (neither file nor dir?)")
+    return (
+        mtime_ns,
+        dirs,
+        file_names,
+        np.array(file_sizes, dtype=np.int64),
+        np.array(file_mtimes, dtype=np.float64),
+    )
+
+
+def _get_mtime_ns_or_none(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+def _join_names(names: list[str]) -> np.ndarray:
+    # file names can not contain zero bytes. surrogateescape keeps undecodable names intact
+    return np.frombuffer("\0".join(names).encode("utf-8", "surrogateescape"), dtype=np.uint8)
+
+
+def _split_names(blob: np.ndarray) -> list[str]:
+    if len(blob) == 0:
+        return []
+    names = blob.tobytes().decode("utf-8", "surrogateescape").split("\0")
+    return [sys.intern(name) for name in names]
+
+
+def _concatenate(arrays: list[np.ndarray], dtype) -> np.ndarray:
+    if len(arrays) == 0:
+        return _empty_array(dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
 def get_subfolder_data(
     root: Folder,
     level: int = 0,
@@ -148,15 +453,16 @@ def get_subfolder_data(
     if max_level == 0:
         return
     size_b_other_files = 0
-    for file, file_stat in root.files_and_stat.items():
-        file_size = file_stat.st_size
+    for file, file_size, file_mtime in zip(
+        root.file_names, root.file_sizes.tolist(), root.file_mtimes.tolist()
+    ):
         if file_size >= min_size_b:
             output.append(
                 (
                     f"{full_path_to_here}{file}",
                     "f",
                     file_size,
-                    file_stat.st_mtime,
+                    file_mtime,
                 )
             )
             continue
@@ -176,7 +482,7 @@ def get_subfolder_data(
                 f"{full_path_to_here}",
                 "d",
                 root.total_size,
-                root.own_stat.st_mtime,
+                root.mtime,
             )
         )
     # if size_b_other_files > 0:
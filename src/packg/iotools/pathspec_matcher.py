@@ -8,8 +8,11 @@ TODO test if including can be removed, because existing gitignore syntax can do
 
 from __future__ import annotations
 
+import os
+import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
 
 from attr import define
 from pathspec import PathSpec, Pattern, RegexPattern
@@ -141,6 +144,7 @@ def apply_pathspecs(paths: List[str], specs: SPECLISTTYPE) -> Iterable[str]:
             Paths that are relative to the root must have a leading slash.
         specs: List of tuples with PathSpec and negate flag
     """
+    paths = list(paths)
     for path in paths:
         if not isinstance(path, str):
             raise ValueError(
@@ -149,9 +153,409 @@ def apply_pathspecs(paths: List[str], specs: SPECLISTTYPE) -> Iterable[str]:
             f"Paths that are relative to the root must have a leading slash. "
             f"Got {type(path)}: {path}"
         )
+    return get_compiled_pathspecs(specs).filter(paths)
+
+
+# regexes of gitignore patterns as compiled by pathspec >= 1.0, e.g. "*.ext" has the suffix
+# ".ext". The regex text differs between pathspec versions, other forms are searched as they are.
+_GIT_ANY_DIR_PREFIX = "^(?:.+/)?"
+_GIT_SUFFIX_REGEX = re.compile(
+    r"\^\(\?:\.\+/\)\?\[\^/\]\*((?:\\.|[A-Za-z0-9_-])+)\(\?:\(\?P<ps_d>/\)\|\$\)"
+)
+# pathspec < 1.0 matches the regexes at the start of the path, newer versions search them
+_PATHSPEC_SEARCHES_REGEX = RegexPattern("b").match_file("ab") is not None
+_UNSUPPORTED_IN_COMBINED_REGEX = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+_DEFAULT_REGEX_FLAGS = re.compile("").flags
+_PATH_SEPARATORS = [sep for sep in (os.sep, os.altsep) if sep and sep != "/"]
+
+# one pattern as (regex string, regex flags, include, is gitignore pattern)
+_PATTERNKEYTYPE = Tuple[str, int, bool, bool]
+_SPECKEYTYPE = Tuple[Tuple[_PATTERNKEYTYPE, ...], bool]
+
+
+def _compile_any(regex_strs: List[str]) -> List[re.Pattern]:
+    """Combine regexes into one that matches if any of them matches."""
+    if len(regex_strs) <= 1:
+        return [re.compile(regex_str) for regex_str in regex_strs]
+    try:
+        return [re.compile("|".join(f"(?:{regex_str})" for regex_str in regex_strs))]
+    except re.error:
+        # e.g. duplicate group names or inline flags in the middle of the regex
+        return [re.compile(regex_str) for regex_str in regex_strs]
+
+
+def _join_fast_git_regex_strs(fast_strs: List[str]) -> List[str]:
+    """Factor out the leading slash of rewritten gitignore regexes, which makes searching the
+    combined regex faster."""
+    slash_strs = [fast_str[1:] for fast_str in fast_strs if fast_str.startswith("/")]
+    other_strs = [fast_str for fast_str in fast_strs if not fast_str.startswith("/")]
+    if len(slash_strs) <= 1:
+        return fast_strs
+    return ["/(?:" + "|".join(f"(?:{slash_str})" for slash_str in slash_strs) + ")"] + other_strs
+
+
+def _get_fast_git_regex_str(regex_str: str) -> Optional[str]:
+    """
+    Rewrite the regex of a gitignore pattern to be searched in "/" + path instead of path,
+    then the prefix "^(?:.+/)?" that backtracks over every slash becomes a plain "/".
+    Only valid for paths that are not empty, do not start with "/" and have no newline.
+
+    Returns:
+        rewritten regex or None if the regex has an unknown form
+    """
+    if regex_str.startswith(_GIT_ANY_DIR_PREFIX):
+        return f"/{regex_str[len(_GIT_ANY_DIR_PREFIX):]}"
+    if regex_str.startswith("^"):
+        return f"^/{regex_str[1:]}"
+    if regex_str == ".":
+        return regex_str
+    return None
+
+
+class _PatternRun:
+    """
+    Consecutive patterns of one PathSpec with the same include flag. Inside a run the order
+    does not matter, the run matches if any of its patterns matches.
+
+    Patterns like "*.ext" are checked with str methods, other gitignore patterns are rewritten
+    and combined into one regex, see _get_fast_git_regex_str. User given regexes are combined
+    if possible and searched as they are.
+    """
+
+    def __init__(self, include: bool, pattern_keys: List[_PATTERNKEYTYPE]):
+        self.include = include
+        suffixes, exact_strs, fast_strs, slow_strs = [], [], [], []
+        self.slow_regexes = []
+        for regex_str, flags, _, is_git in pattern_keys:
+            if flags != _DEFAULT_REGEX_FLAGS or _UNSUPPORTED_IN_COMBINED_REGEX.search(regex_str):
+                self.slow_regexes.append(re.compile(regex_str, flags))
+                continue
+            suffix_match = _GIT_SUFFIX_REGEX.fullmatch(regex_str) if is_git else None
+            if suffix_match is not None:
+                suffixes.append(re.sub(r"\\(.)", r"\1", suffix_match.group(1)))
+                continue
+            fast_str = None
+            if is_git:
+                # the group name would be duplicated in the combined regex
+                regex_str = regex_str.replace("(?P<ps_d>", "(?:")
+                fast_str = _get_fast_git_regex_str(regex_str)
+            if fast_str is None:
+                slow_strs.append(regex_str)
+            else:
+                fast_strs.append(fast_str)
+                exact_strs.append(regex_str)
+        self.slow_regexes += _compile_any(slow_strs)
+        self.suffixes = tuple(suffixes)
+        self.dir_suffixes = tuple(f"{suffix}/" for suffix in suffixes)
+        self.fast_strs = fast_strs + [f"{re.escape(suffix)}(?:/|$)" for suffix in suffixes]
+        self.fast_regexes = _compile_any(_join_fast_git_regex_strs(fast_strs))
+        exact_strs += [rf"^(?:.+/)?[^/]*{re.escape(suffix)}(?:/|$)" for suffix in suffixes]
+        self.exact_regexes = _compile_any(exact_strs)
+
+    def select(
+        self,
+        positions: List[int],
+        files: Optional[List[str]],
+        slash_files: List[Optional[str]],
+    ) -> Set[int]:
+        """
+        Args:
+            positions: positions of the paths to check
+            files: normalized paths, only needed for user given regexes and where slash_files
+                is None
+            slash_files: "/" + normalized paths, None where the rewritten regexes are not
+                valid, see _normalize_path
+
+        Returns:
+            positions of the paths that match any pattern of this run
+        """
+        matched = set()
+        for regex in self.slow_regexes:
+            search = regex.search
+            matched.update(i for i in positions if search(files[i]) is not None)
+        common = [i for i in positions if slash_files[i] is not None and i not in matched]
+        if len(common) < len(positions):
+            for regex in self.exact_regexes:
+                search = regex.search
+                matched.update(
+                    i
+                    for i in positions
+                    if slash_files[i] is None and search(files[i]) is not None
+                )
+        if len(self.suffixes) > 0:
+            # some part of the path ends with the suffix
+            suffixes, dir_suffixes = self.suffixes, self.dir_suffixes
+            matched.update(
+                i
+                for i in common
+                if slash_files[i].endswith(suffixes)
+                or any(dir_suffix in slash_files[i] for dir_suffix in dir_suffixes)
+            )
+        for regex in self.fast_regexes:
+            search = regex.search
+            matched.update(i for i in common if search(slash_files[i]) is not None)
+        return matched
+
+
+class _CompiledSpec:
+    """
+    One PathSpec as runs of patterns, checked from the last run to the first, so the last
+    matching pattern wins as in gitignore. Most paths match no pattern at all, so for common
+    paths one regex with all patterns is searched first.
+    """
+
+    def __init__(self, pattern_keys: Tuple[_PATTERNKEYTYPE, ...], negate: bool):
+        self.negate = negate
+        runs = []
+        for pattern_key in pattern_keys:
+            include = pattern_key[2]
+            if len(runs) > 0 and runs[-1][0] == include:
+                runs[-1][1].append(pattern_key)
+            else:
+                runs.append((include, [pattern_key]))
+        self.runs = [_PatternRun(include, keys) for include, keys in reversed(runs)]
+        self.any_regex = None
+        self.any_suffixes = None
+        if all(len(run.slow_regexes) == 0 for run in self.runs):
+            fast_strs = [fast_str for run in self.runs for fast_str in run.fast_strs]
+            if all(len(run.fast_regexes) == 0 for run in self.runs):
+                suffixes = [suffix for run in self.runs for suffix in run.suffixes]
+                self.any_suffixes = (tuple(suffixes), tuple(f"{s}/" for s in suffixes))
+            elif len(fast_strs) > 0:
+                any_regexes = _compile_any(_join_fast_git_regex_strs(fast_strs))
+                self.any_regex = any_regexes[0] if len(any_regexes) == 1 else None
+
+    @property
+    def needs_files(self) -> bool:
+        return any(len(run.slow_regexes) > 0 for run in self.runs)
+
+    def get_includes(
+        self, files: Optional[List[str]], slash_files: List[Optional[str]]
+    ) -> List[bool]:
+        """
+        Args:
+            files: normalized paths, see _PatternRun.select
+            slash_files: "/" + normalized paths, see _PatternRun.select
+
+        Returns:
+            include flag of the last matching pattern per path, False if no pattern matches
+        """
+        includes = [False] * len(slash_files)
+        positions = range(len(slash_files))
+        if self.any_suffixes is not None:
+            # the suffixes never contain a slash, so they can be checked in slash_file as well
+            suffixes, dir_suffixes = self.any_suffixes
+            positions = [
+                i
+                for i, slash_file in enumerate(slash_files)
+                if slash_file is None
+                or slash_file.endswith(suffixes)
+                or any(dir_suffix in slash_file for dir_suffix in dir_suffixes)
+            ]
+        elif self.any_regex is not None:
+            search = self.any_regex.search
+            positions = [
+                i
+                for i, slash_file in enumerate(slash_files)
+                if slash_file is None or search(slash_file) is not None
+            ]
+        if len(self.runs) == 1 and (self.any_suffixes is not None or self.any_regex is not None):
+            # the common paths that passed the filter match the only run
+            include = self.runs[0].include
+            for i in positions:
+                if slash_files[i] is not None:
+                    includes[i] = include
+            positions = [i for i in positions if slash_files[i] is None]
+        for run in self.runs:
+            if len(positions) == 0:
+                break
+            matched = run.select(positions, files, slash_files)
+            if run.include:
+                for i in matched:
+                    includes[i] = True
+            positions = [i for i in positions if i not in matched]
+        return includes
+
+
+class _FallbackSpec:
+    """PathSpec with patterns that can not be compiled, matched by pathspec itself."""
+
+    needs_files = False
+
+    def __init__(self, spec: PathSpec, negate: bool):
+        self.spec = spec
+        self.negate = negate
+
+    def get_includes(self, paths: List[str]) -> List[bool]:
+        match_file = self.spec.match_file
+        return [match_file(path) for path in paths]
+
+
+class CompiledPathSpecs:
+    """
+    Faster replacement for applying a list of PathSpecs one after another, see apply_pathspecs.
+    Use get_compiled_pathspecs to create it.
+
+    Usage:
+        compiled = get_compiled_pathspecs(make_pathspecs(exclude_git=["*.pyc", "build/"]))
+        compiled.match_many(["/a.py", "/a.pyc", "/build/"])  # [True, False, False]
+
+    Args:
+        specs: compiled specs, or fallback specs for PathSpecs with patterns that can not be
+            compiled
+    """
+
+    def __init__(self, specs: List[Union[_CompiledSpec, _FallbackSpec]]):
+        self.specs = specs
+
+    def __len__(self) -> int:
+        return len(self.specs)
+
+    def match(self, path: str) -> bool:
+        """
+        Args:
+            path: file or directory path, see apply_pathspecs
+
+        Returns:
+            True if the path passes all specs i.e. it is kept by apply_pathspecs
+        """
+        return self.match_many([path])[0]
+
+    def match_many(self, paths: Iterable[str]) -> List[bool]:
+        """
+        Match all paths spec by spec, so the loops over the paths run in list comprehensions.
+
+        Returns:
+            list of bool, True for each path that passes all specs
+        """
+        paths = list(paths)
+        if len(_PATH_SEPARATORS) == 0:
+            # shortcut for the common case of paths with exactly one leading slash
+            slash_files = [
+                path
+                if path[:1] == "/" and path[1:2] not in ("", "/") and "\n" not in path
+                else _normalize_path(path)[1]
+                for path in paths
+            ]
+        else:
+            slash_files = [_normalize_path(path)[1] for path in paths]
+        files = None
+        if any(spec.needs_files for spec in self.specs) or None in slash_files:
+            files = [
+                _normalize_path(path)[0] if slash_file is None else slash_file[1:]
+                for path, slash_file in zip(paths, slash_files)
+            ]
+        is_selected = [True] * len(paths)
+        for spec in self.specs:
+            negate = spec.negate
+            if isinstance(spec, _FallbackSpec):
+                includes = spec.get_includes(paths)
+            else:
+                includes = spec.get_includes(files, slash_files)
+            is_selected = [
+                selected and include != negate
+                for selected, include in zip(is_selected, includes)
+            ]
+        return is_selected
+
+    def filter(self, paths: Iterable[str]) -> List[str]:
+        """
+        Returns:
+            list of the paths that pass all specs, in the input order
+        """
+        paths = list(paths)
+        return [path for path, selected in zip(paths, self.match_many(paths)) if selected]
+
+
+def _normalize_path(path: str) -> Tuple[str, Optional[str]]:
+    """
+    Normalize the path the same way as pathspec.
+
+    Returns:
+        tuple of (normalized path, "/" + normalized path or None if the rewritten gitignore
+            regexes are not valid for it, see _get_fast_git_regex_str)
+    """
+    for separator in _PATH_SEPARATORS:
+        path = path.replace(separator, "/")
+    if path.startswith("/"):
+        file = path[1:]
+    elif path.startswith("./"):
+        file = path[2:]
+    else:
+        file = path
+    if file == "" or file.startswith("/") or "\n" in file:
+        return file, None
+    return file, f"/{file}"
+
+
+@lru_cache(maxsize=256)
+def _compile_spec_cached(pattern_keys: Tuple[_PATTERNKEYTYPE, ...], negate: bool) -> _CompiledSpec:
+    return _CompiledSpec(pattern_keys, negate)
+
+
+@lru_cache(maxsize=64)
+def _compile_pathspecs_cached(spec_keys: Tuple[_SPECKEYTYPE, ...]) -> CompiledPathSpecs:
+    return CompiledPathSpecs(
+        [_compile_spec_cached(pattern_keys, negate) for pattern_keys, negate in spec_keys]
+    )
+
+
+def _get_pattern_key(pattern: Pattern) -> Optional[_PATTERNKEYTYPE]:
+    """
+    Returns:
+        tuple of (regex string, regex flags, include, is gitignore pattern) with search
+            semantics, or None if the pattern can not be compiled
+    """
+    if (
+        not isinstance(pattern, RegexPattern)
+        or type(pattern).match_file is not RegexPattern.match_file
+        or not isinstance(pattern.regex, re.Pattern)
+        or not isinstance(pattern.regex.pattern, str)
+    ):
+        return None
+    regex_str, flags = pattern.regex.pattern, pattern.regex.flags
+    if not _PATHSPEC_SEARCHES_REGEX and (not regex_str.startswith("^") or flags & re.MULTILINE):
+        regex_str = rf"\A(?:{regex_str})"
+        try:
+            re.compile(regex_str, flags)
+        except re.error:
+            # e.g. inline flags, which must be at the start
+            return None
+    is_git = isinstance(pattern, p_patterns.GitWildMatchPattern)
+    return regex_str, flags, pattern.include, is_git
+
+
+def get_compiled_pathspecs(specs: SPECLISTTYPE) -> CompiledPathSpecs:
+    """
+    Compile a list of PathSpecs, the result is cached by the patterns.
+
+    PathSpecs with patterns that are not regex based, or that override the matching, are
+    matched by pathspec itself. Tested with pathspec 0.12 and 1.1.
+
+    Args:
+        specs: List of tuples with PathSpec and negate flag, see make_pathspecs
+
+    Returns:
+        CompiledPathSpecs
+    """
+    spec_keys, fallback_positions = [], []
     for spec, negate in specs:
-        paths = spec.match_files(paths, negate=negate)
-    return paths
+        pattern_keys = [
+            _get_pattern_key(pattern) for pattern in spec.patterns if pattern.include is not None
+        ]
+        if any(pattern_key is None for pattern_key in pattern_keys):
+            fallback_positions.append(len(spec_keys))
+        spec_keys.append((tuple(pattern_keys), bool(negate)))
+    if len(fallback_positions) == 0:
+        return _compile_pathspecs_cached(tuple(spec_keys))
+    return CompiledPathSpecs(
+        [
+            _FallbackSpec(spec, bool(negate))
+            if i in fallback_positions
+            else _compile_spec_cached(*spec_keys[i])
+            for i, (spec, negate) in enumerate(specs)
+        ]
+    )
 
 
 @define(slots=False)
@@ -183,6 +587,26 @@ def expand_pathspec_args(args: PathSpecArgs) -> Dict[str, Any]:
     )
 
 
+def make_pathspecs_from_args(pathspec_args: PathSpecArgs | dict | None) -> SPECLISTTYPE:
+    """
+    Args:
+        pathspec_args: PathSpecArgs from the command line, dict with the arguments of
+            make_pathspecs, or None to not filter at all.
+
+    Returns:
+        List of tuples with PathSpec and negate flag
+    """
+    if pathspec_args is None:
+        return []
+    if isinstance(pathspec_args, PathSpecArgs):
+        pathspec_args_dict = expand_pathspec_args(pathspec_args)
+    elif isinstance(pathspec_args, dict):
+        pathspec_args_dict = pathspec_args
+    else:
+        raise ValueError(f"Invalid pathspec_args: {pathspec_args}")
+    return make_pathspecs(**pathspec_args_dict)
+
+
 class PathSpecWithConversion:
     """
     Wrapper for pathspec.PathSpec with argument conversion to and from pathlib.Path
@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+
+from packg.benchmarks.indexing import (
+    BenchmarkC,
+    SyscallCounter,
+    TreeSpec,
+    create_synthetic_tree,
+    main,
+    run_benchmarks,
+)
+from packg.iotools.file_indexer import make_index
+
+SMALL_SPEC = TreeSpec(fanout=2, depth=2, files_per_dir=3, max_file_size=10, num_symlinks=2)
+
+
+def test_create_synthetic_tree_is_reproducible(tmp_path):
+    counts = create_synthetic_tree(tmp_path / "a", SMALL_SPEC)
+    create_synthetic_tree(tmp_path / "b", SMALL_SPEC)
+    assert counts == {"dirs": 7, "files": 21, "symlinks": 2}
+    index_a = make_index(tmp_path / "a", verbose=False)
+    index_b = make_index(tmp_path / "b", verbose=False)
+    assert {k: v.size for k, v in index_a.items()} == {k: v.size for k, v in index_b.items()}
+
+
+def test_syscall_counter(tmp_path):
+    original_stat = os.stat
+    with SyscallCounter() as counter:
+        os.stat(tmp_path)
+        list(os.scandir(tmp_path))
+    assert os.stat is original_stat
+    assert counter.counts["stat"] == 1
+    assert counter.counts["scandir"] == 1
+    assert counter.total == 2
+
+
+def test_syscall_counter_dir_entries(tmp_path):
+    for name in ["a.txt", "b.txt"]:
+        (tmp_path / name).write_bytes(b"x")
+    (tmp_path / "sub").mkdir()
+    with SyscallCounter() as counter:
+        with os.scandir(tmp_path) as scandir_it:
+            entries = sorted(scandir_it, key=lambda entry: entry.name)
+        sizes = [entry.stat().st_size for entry in entries if entry.is_file()]
+        paths = [os.fspath(entry) for entry in entries if entry.is_dir()]
+    assert sizes == [1, 1]
+    assert paths == [str(tmp_path / "sub")]
+    assert counter.counts == {
+        "scandir": 1,
+        "DirEntry.is_file": 3,
+        "DirEntry.stat": 2,
+        "DirEntry.is_dir": 3,
+    }
+
+
+def test_run_benchmarks(tmp_path):
+    output_file = tmp_path / "results.jsonl"
+    results = run_benchmarks(SMALL_SPEC, repeats=1, workers=2, output_file=output_file)
+    assert [r.benchmark for r in results] == BenchmarkC.values_list()
+    assert all(r.num_files > 0 for r in results)
+    lines = output_file.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == len(results)
+    row = json.loads(lines[0])
+    assert row["benchmark"] == BenchmarkC.MAKE_INDEX
+    assert row["tree"]["files"] == 21
+    assert row["files_per_sec"] > 0
+    assert row["syscalls"]["scandir"] > 0
+
+
+def test_run_benchmarks_root(tmp_path):
+    spec = TreeSpec(fanout=2, depth=1, files_per_dir=2, num_symlinks=0, extensions=(".jpg",))
+    results = run_benchmarks(spec, benchmarks=[BenchmarkC.REGEX_GLOB], root=tmp_path / "tree")
+    # the tree is created in the given root and kept
+    assert results[0].num_files == 3
+    assert sorted(p.name for p in (tmp_path / "tree").glob("**/*.jpg")) == ["file_1.jpg"] * 3
+
+
+def test_main_tree_args(tmp_path, monkeypatch):
+    output_file = tmp_path / "results.jsonl"
+    argv = ["indexing", "--depth", "1", "--ignored_dir_ratio", "0", "-e", ".py", "-e", ".md"]
+    argv += ["-x", "*.md", "-b", "apply_pathspecs", "-r", "1", "-o", str(output_file)]
+    monkeypatch.setattr(sys, "argv", argv)
+    main()
+    row = json.loads(output_file.read_text(encoding="utf-8"))
+    assert row["tree"]["extensions"] == [".py", ".md"]
+    assert row["tree"]["exclude_git"] == ["*.md"]
+    assert row["tree"]["ignored_dir_ratio"] == 0
@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+
+from packg.cli import compress_tree
+from packg.cli.compress_tree import ModeC, convert_file, find_jobs
+from packg.iotools.compress import (
+    CompressorC,
+    DummyCompressor,
+    decompress_file_to_bytes,
+    dump_xz,
+)
+from packg.iotools.pathspec_matcher import PathSpecArgs
+
+
+def _make_tree(root):
+    (root / "sub").mkdir(parents=True)
+    for i in range(5):
+        (root / f"file{i}.json").write_text(json.dumps({"i": i, "data": "x" * 100 * i}))
+    (root / "sub" / "nested.json").write_text("{}")
+    (root / "sub" / "other.txt").write_text("not selected")
+
+
+def test_compress_tree_roundtrip(tmp_path, monkeypatch):
+    _make_tree(tmp_path)
+    originals = {p: p.read_text() for p in tmp_path.rglob("*.json")}
+    spec = PathSpecArgs(exclude_git=["*.txt"])
+
+    jobs = find_jobs(tmp_path, ModeC.COMPRESS, CompressorC.ZSTD, pathspec_args=spec)
+    assert len(jobs) == 6
+    jobs_endings = find_jobs(tmp_path, ModeC.COMPRESS, CompressorC.ZSTD, endings=["json"])
+    assert jobs_endings == jobs
+    for job in jobs:
+        convert_file(*job, verify=True)
+    for original in originals:
+        assert original.with_name(f"{original.name}.zst").is_file()
+    # outputs are up to date now, unless the source changes
+    assert find_jobs(tmp_path, ModeC.COMPRESS, CompressorC.ZSTD, pathspec_args=spec) == []
+    (tmp_path / "file0.json").write_text("changed")
+    originals[tmp_path / "file0.json"] = "changed"
+    jobs = find_jobs(tmp_path, ModeC.COMPRESS, CompressorC.ZSTD, pathspec_args=spec)
+    assert [job[0] for job in jobs] == [(tmp_path / "file0.json").as_posix()]
+    assert len(find_jobs(tmp_path, ModeC.COMPRESS, CompressorC.ZSTD, spec, force=True)) == 6
+
+    # run the cli to decompress with delete, in the foreground
+    for original in originals:
+        original.unlink()
+    (tmp_path / "file0.json.zst").unlink()
+    monkeypatch.setattr(
+        sys, "argv", ["compress_tree", str(tmp_path), "-m", "decompress", "-d", "-y", "-w", "0"]
+    )
+    compress_tree.main()
+    assert list(tmp_path.rglob("*.zst")) == []
+    for original, content in originals.items():
+        if original.name != "file0.json":
+            assert original.read_text() == content
+
+
+def test_compress_tree_recompress(tmp_path):
+    dump_xz("some data" * 100, tmp_path / "data.txt.xz")
+    jobs = find_jobs(tmp_path, ModeC.RECOMPRESS, CompressorC.ZSTD)
+    assert len(jobs) == 1
+    src, dst, src_compressor, dst_compressor = jobs[0]
+    assert (src_compressor, dst_compressor) == (CompressorC.LZMA, CompressorC.ZSTD)
+    assert dst.endswith("data.txt.zst")
+    status, _, _ = convert_file(*jobs[0], verify=True, delete=True)
+    assert status == "converted"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["data.txt.zst"]
+    assert find_jobs(tmp_path, ModeC.RECOMPRESS, CompressorC.ZSTD) == []
+
+
+def test_convert_file_streaming(tmp_path, monkeypatch):
+    src = tmp_path / "big.bin"
+    data = os.urandom(1024**2) * 3 + b"end"
+    src.write_bytes(data)
+    dst = tmp_path / "big.bin.zst"
+    status, in_size, _ = convert_file(
+        src.as_posix(), dst.as_posix(), CompressorC.NONE, CompressorC.ZSTD, verify=True
+    )
+    assert (status, in_size) == ("converted", len(data))
+    assert decompress_file_to_bytes(dst, CompressorC.ZSTD) == data
+
+    # a broken compressor is detected by the verification and leaves no output behind
+    class DroppingCompressor(DummyCompressor):
+        def compress(self, data: bytes) -> bytes:
+            return data[:-1]
+
+    monkeypatch.setattr(compress_tree, "get_compressor", lambda *args: DroppingCompressor())
+    dst.unlink()
+    status, _, _ = convert_file(
+        src.as_posix(), dst.as_posix(), CompressorC.NONE, CompressorC.NONE, verify=True
+    )
+    assert status == "failed"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["big.bin"]
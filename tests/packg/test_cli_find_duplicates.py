@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+
+from packg.cli import find_duplicates as find_duplicates_module
+from packg.cli.find_duplicates import find_duplicates
+
+
+def _make_trees(tmp_path):
+    big = os.urandom(50_000)
+    files = {
+        "a/big.bin": big,
+        "b/big_copy.bin": big,
+        "b/deep/big_copy2.bin": big,
+        # same size, start and end as big, only the full hash differs
+        "a/big_middle.bin": big[:20_000] + b"x" * 10_000 + big[30_000:],
+        "a/small.txt": b"small content",
+        "b/small_copy.txt": b"small content",
+        "b/small_other.txt": b"other content",
+        "a/unique_size.bin": os.urandom(1234),
+        "a/empty.txt": b"",
+        "b/empty.txt": b"",
+    }
+    for name, content in files.items():
+        file = tmp_path / name
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_bytes(content)
+    return files
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    _make_trees(tmp_path)
+    hashed = []
+    hash_file = find_duplicates_module.hash_file
+
+    def counting_hash_file(file, hash_algo, partial_size):
+        hashed.append((file.rpartition("/")[2], partial_size))
+        return hash_file(file, hash_algo, partial_size)
+
+    monkeypatch.setattr(find_duplicates_module, "hash_file", counting_hash_file)
+    roots = [(tmp_path / "a").as_posix(), (tmp_path / "b").as_posix()]
+    groups = find_duplicates(roots, partial_size=1000, workers=2)
+    assert [(g.size, g.wasted_bytes, g.files) for g in groups] == [
+        (
+            50_000,
+            100_000,
+            [f"{roots[0]}/big.bin", f"{roots[1]}/big_copy.bin", f"{roots[1]}/deep/big_copy2.bin"],
+        ),
+        (13, 13, [f"{roots[0]}/small.txt", f"{roots[1]}/small_copy.txt"]),
+    ]
+    # unique sizes are never read, small files are read once
+    big_names = ["big.bin", "big_copy.bin", "big_copy2.bin", "big_middle.bin"]
+    small_names = ["small.txt", "small_copy.txt", "small_other.txt"]
+    assert sorted(name for name, partial_size in hashed if partial_size is None) == big_names
+    assert sorted(name for name, partial_size in hashed if partial_size == 1000) == sorted(
+        big_names + small_names
+    )
+    assert find_duplicates(roots, min_size=0, workers=0)[-1].files == [
+        f"{roots[0]}/empty.txt",
+        f"{roots[1]}/empty.txt",
+    ]
+
+
+def test_find_duplicates_cli(tmp_path, monkeypatch, capsys):
+    _make_trees(tmp_path / "data")
+    output_file = tmp_path / "duplicates.json"
+    argv = ["find_duplicates", str(tmp_path / "data"), "-o", str(output_file), "-x", "*.txt"]
+    monkeypatch.setattr(sys, "argv", argv)
+    find_duplicates_module.main()
+    assert "wasted by 3 copies" in capsys.readouterr().out
+    groups = json.loads(output_file.read_text(encoding="utf-8"))
+    assert len(groups) == 1
+    assert sorted(file.rpartition("/")[2] for file in groups[0]["files"]) == [
+        "big.bin",
+        "big_copy.bin",
+        "big_copy2.bin",
+    ]
+
+
+def test_find_duplicates_overlapping_roots(tmp_path):
+    _make_trees(tmp_path)
+    root_a, root_b = (tmp_path / "a").as_posix(), (tmp_path / "b").as_posix()
+    expected = find_duplicates([root_a, root_b], workers=0)
+    assert find_duplicates([root_a, root_b, f"{root_b}/deep", root_a], workers=0) == expected
+    # the nested root comes first, the outer root replaces it
+    groups = find_duplicates([f"{root_b}/deep", tmp_path.as_posix()], workers=0)
+    assert [(g.wasted_bytes, len(g.files)) for g in groups] == [(100_000, 3), (13, 2)]
+    assert find_duplicates([root_a, f"{tmp_path.as_posix()}/a/"], workers=0) == []
+
+
+def test_find_duplicates_hardlinks(tmp_path):
+    _make_trees(tmp_path)
+    os.link(tmp_path / "a" / "big.bin", tmp_path / "a" / "big_link.bin")
+    os.link(tmp_path / "a" / "unique_size.bin", tmp_path / "b" / "unique_link.bin")
+    groups = find_duplicates([tmp_path.as_posix()], workers=2)
+    assert [(g.size, g.wasted_bytes, len(g.files)) for g in groups] == [
+        (50_000, 100_000, 3),
+        (13, 13, 2),
+    ]
+    names = [file.rpartition("/")[2] for group in groups for file in group.files]
+    assert all("link" not in name for name in names)
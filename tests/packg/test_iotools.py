@@ -1,4 +1,5 @@
 import io
+import random
 from pathlib import Path
 
 import pytest
@@ -11,6 +12,12 @@ from packg.iotools import (
     yield_lines_from_file,
     yield_lines_from_object,
 )
+from packg.iotools.file_indexer import (
+    _CannotEncodeError,
+    _encode_sort_key_part,
+    _encode_sort_keys,
+    _sort_file_paths_with_dirs_separated_tuples,
+)
 
 _ref = ["a", "b", "c"]
 _inp_str = "\na\n    b\n    c\n\n"
@@ -100,3 +107,42 @@ def test_sort_paths_with_dirs_separated(inp, natsorted, dirs_first, ref):
 
 def test_find_git_root():
     assert Path(find_git_root()).is_dir()
+
+
+_ENCODABLE_CHARS = ["a", "B", "1", "01", "10", "_", ".", " ", "ä", "é", "x9", "-"]
+# natsort treats non-ASCII numeric characters as numbers, these use the tuple fallback
+_NUMERIC_CHARS = ["٣", "①", "²", "½", "Ⅻ", "a²3"]
+
+
+@pytest.mark.parametrize("natsorted", [False, True])
+@pytest.mark.parametrize("dirs_first", [False, True])
+@pytest.mark.parametrize("with_numeric", [False, True])
+@pytest.mark.parametrize("with_special", [False, True])
+def test_sort_paths_with_dirs_separated_random(natsorted, dirs_first, with_numeric, with_special):
+    """The encoded sort keys must give the same order as sorting the nested tuples."""
+    rng = random.Random(0)
+    chars = _ENCODABLE_CHARS + (_NUMERIC_CHARS if with_numeric else [])
+    inp = [
+        "/".join(
+            "".join(rng.choice(chars) for _ in range(rng.randint(0, 4))) or "d"
+            for _ in range(rng.randint(1, 4))
+        )
+        for _ in range(3000)
+    ]
+    if with_special:
+        inp += ["", ".", "/", "/abs/file", "foo/007", "foo/7", "x/" + "9" * 300, "ctrl\x01/a"]
+    sort_index_dir = 0 if dirs_first else 2
+    paths = [Path(p) for p in inp]
+    if not with_numeric and not with_special:
+        # make sure the fast path with encoded keys is tested
+        _encode_sort_keys(paths, sort_index_dir, natsorted)
+    ref = _sort_file_paths_with_dirs_separated_tuples(paths, natsorted, sort_index_dir)
+    cand = sort_file_paths_with_dirs_separated(inp, natsorted=natsorted, dirs_first=dirs_first)
+    assert cand == ref
+
+
+@pytest.mark.parametrize("part", ["①", "a²", "٣0", "x½"])
+def test_encode_sort_key_part_numeric(part):
+    assert _encode_sort_key_part(part, 1, False) == b"\x04" + part.encode("utf-8") + b"\x00"
+    with pytest.raises(_CannotEncodeError):
+        _encode_sort_key_part(part, 1, True)
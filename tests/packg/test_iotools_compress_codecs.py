@@ -0,0 +1,109 @@
+import gzip
+import json
+import lzma
+import os
+
+import pytest
+
+from packg.iotools.compress import (
+    Codec,
+    CompressorC,
+    DummyCompressor,
+    DummyDecompressor,
+    GoalC,
+    OptionalCompressorC,
+    auto_select_codec,
+    benchmark_codecs,
+    compress_data_to_bytes,
+    decompress_bytes_to_bytes,
+    get_available_compressors,
+    get_compressor,
+    get_compressor_name_from_filename,
+    get_decompressor,
+    get_suffix_for_compressor_name,
+    register_codec,
+)
+
+SAMPLE = json.dumps([{"id": i, "name": f"item {i}", "value": i * 0.25} for i in range(3000)])
+
+
+@pytest.mark.parametrize("compressor_name", [CompressorC.GZIP, CompressorC.BZ2])
+def test_stdlib_codecs_multi_stream(compressor_name):
+    data = os.urandom(1000) + SAMPLE.encode()
+    compressed = compress_data_to_bytes(data, compressor_name, level=1)
+    assert decompress_bytes_to_bytes(compressed * 2, compressor_name) == data * 2
+    decompressor = get_decompressor(compressor_name)
+    doubled = compressed * 2
+    decompressed = b"".join(
+        [decompressor.decompress(doubled[i : i + 99]) for i in range(0, len(doubled), 99)]
+    )
+    assert decompressed == data * 2
+
+
+def test_gzip_compatible_with_stdlib():
+    data = SAMPLE.encode()
+    assert gzip.decompress(compress_data_to_bytes(data, CompressorC.GZIP)) == data
+    assert decompress_bytes_to_bytes(gzip.compress(data), CompressorC.GZIP) == data
+
+
+def test_lz4_codec():
+    pytest.importorskip("lz4")
+    assert OptionalCompressorC.LZ4 in get_available_compressors()
+    assert get_compressor_name_from_filename("a.json.lz4") == OptionalCompressorC.LZ4
+    compressor = get_compressor(OptionalCompressorC.LZ4, level=3)
+    compressed = b"".join([compressor.compress(SAMPLE[:100].encode()), compressor.flush()])
+    compressed = compressed + compress_data_to_bytes(SAMPLE, OptionalCompressorC.LZ4)
+    assert decompress_bytes_to_bytes(compressed, OptionalCompressorC.LZ4) == (
+        SAMPLE[:100] + SAMPLE
+    ).encode()
+
+
+def test_codec_parameters():
+    data = SAMPLE.encode()
+    fast = compress_data_to_bytes(data, CompressorC.LZMA, level=0)
+    strong = compress_data_to_bytes(data, CompressorC.LZMA, level=9)
+    assert lzma.decompress(fast) == lzma.decompress(strong) == data
+    assert len(strong) < len(fast)
+    assert get_compressor(CompressorC.ZSTD_SLOW).level == 9
+    assert get_compressor(CompressorC.ZSTD_SLOW, level=12).level == 12
+    assert get_compressor(CompressorC.ZSTD, threads=2).threads == 2
+    with pytest.raises(ValueError, match="does not support threads"):
+        get_compressor(CompressorC.GZIP, threads=2)
+    assert get_suffix_for_compressor_name(CompressorC.ZSTD_SLOW) == ".zst"
+    assert get_compressor_name_from_filename("a.tar.gz") == CompressorC.GZIP
+    with pytest.raises(ValueError, match="No file suffix"):
+        get_suffix_for_compressor_name(CompressorC.NONE)
+
+
+def test_register_codec():
+    codec = Codec("test_codec", DummyCompressor, DummyDecompressor, suffixes=(".testc",))
+    register_codec(codec)
+    try:
+        assert compress_data_to_bytes(b"abc", "test_codec") == b"abc"
+        assert get_compressor_name_from_filename("a.testc") == "test_codec"
+        with pytest.raises(ValueError, match="already registered"):
+            register_codec(codec)
+    finally:
+        from packg.iotools import compress
+
+        del compress.CODECS["test_codec"]
+        del compress.COMPRESSOR_SUFFIXES[".testc"]
+
+
+def test_auto_select_codec():
+    candidates = [CompressorC.GZIP, (CompressorC.LZMA, 9), (CompressorC.ZSTD, 1)]
+    results = benchmark_codecs(SAMPLE, candidates, repeats=1)
+    assert [(r.name, r.level) for r in results] == [
+        (CompressorC.GZIP, None),
+        (CompressorC.LZMA, 9),
+        (CompressorC.ZSTD, 1),
+    ]
+    assert all(r.ratio > 1 and r.compress_speed > 0 for r in results)
+    best_ratio = auto_select_codec(SAMPLE, GoalC.RATIO, candidates, repeats=1)
+    assert best_ratio.size_out == min(r.size_out for r in results)
+    best_balanced = auto_select_codec(SAMPLE, GoalC.BALANCED, repeats=1, verbose=True)
+    assert best_balanced.name in get_available_compressors()
+    assert best_balanced.name != CompressorC.NONE
+    assert auto_select_codec(SAMPLE, GoalC.SPEED, repeats=1).name != CompressorC.NONE
+    with pytest.raises(ValueError, match="Unknown goal"):
+        auto_select_codec(SAMPLE, "fastest", candidates, repeats=1)
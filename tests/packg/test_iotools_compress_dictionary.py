@@ -0,0 +1,90 @@
+import json
+import threading
+
+import pytest
+
+from packg.iotools.compress import (
+    CompressorC,
+    compress_data_to_bytes,
+    decompress_bytes_to_str,
+    get_compressor,
+    get_decompressor,
+    load_zstd_dictionary,
+    save_zstd_dictionary,
+    train_zstd_dictionary,
+)
+from packg.iotools.compress import _ZSTD_CONTEXTS_PER_THREAD, _get_cached_zstd_cctx, _zstd_local
+
+
+@pytest.fixture(scope="module")
+def records() -> list[str]:
+    return [
+        json.dumps({"id": i, "name": f"user{i}", "tags": ["alpha", "beta"], "score": i * 0.5})
+        for i in range(2000)
+    ]
+
+
+def test_zstd_dictionary_roundtrip(tmp_path, records):
+    dict_data = train_zstd_dictionary(records[:1500], dict_size=16384)
+    dict_file = tmp_path / "records.dict"
+    save_zstd_dictionary(dict_data, dict_file)
+    assert load_zstd_dictionary(dict_file) == dict_data
+
+    size_plain, size_dict = 0, 0
+    for record in records[1500:]:
+        compressed_plain = compress_data_to_bytes(record, CompressorC.ZSTD)
+        compressed = compress_data_to_bytes(record, CompressorC.ZSTD, dict_data=dict_data)
+        assert decompress_bytes_to_str(compressed, CompressorC.ZSTD, dict_data=dict_data) == record
+        size_plain += len(compressed_plain)
+        size_dict += len(compressed)
+    print(f"Compressed size without dict {size_plain}, with dict {size_dict}")
+    assert size_dict < size_plain / 2
+
+
+def test_zstd_dictionary_streaming(records):
+    dict_data = train_zstd_dictionary(records, dict_size=16384)
+    compressor = get_compressor(CompressorC.ZSTD_SLOW, dict_data=dict_data)
+    compressed = b"".join([compressor.compress(r.encode()) for r in records[:10]])
+    compressed += compressor.flush()
+    decompressor = get_decompressor(CompressorC.ZSTD_SLOW, dict_data=dict_data)
+    decompressed = b"".join(
+        [decompressor.decompress(compressed[i : i + 7]) for i in range(0, len(compressed), 7)]
+    )
+    assert decompressed.decode() == "".join(records[:10])
+
+
+def test_zstd_context_reuse_in_threads(records):
+    dict_data = train_zstd_dictionary(records, dict_size=16384)
+    errors = []
+
+    def worker():
+        for record in records:
+            compressed = compress_data_to_bytes(record, CompressorC.ZSTD, dict_data=dict_data)
+            if decompress_bytes_to_str(compressed, CompressorC.ZSTD, dict_data=dict_data) != record:
+                errors.append(record)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_zstd_context_cache_bounded(records):
+    dict_data = train_zstd_dictionary(records, dict_size=16384)
+    cctx = _get_cached_zstd_cctx(3, 0, dict_data)
+    assert _get_cached_zstd_cctx(3, 0, dict_data) is cctx
+    for level in range(1, 20):
+        compress_data_to_bytes(records[0], CompressorC.ZSTD, level=level, dict_data=dict_data)
+        _get_cached_zstd_cctx(3, 0, dict_data)
+    # the context in use stays cached, the least recently used ones are dropped
+    assert len(_zstd_local.cctxs) == _ZSTD_CONTEXTS_PER_THREAD
+    assert _get_cached_zstd_cctx(3, 0, dict_data) is cctx
+
+
+def test_dictionary_unsupported_compressor():
+    with pytest.raises(ValueError, match="does not support dictionaries"):
+        get_compressor(CompressorC.LZMA, dict_data=b"1234")
+    with pytest.raises(ValueError, match="does not support dictionaries"):
+        get_decompressor(CompressorC.NONE, dict_data=b"1234")
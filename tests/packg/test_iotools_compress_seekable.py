@@ -0,0 +1,65 @@
+import io
+import json
+
+import pytest
+import zstandard
+
+from packg.iotools.compress import (
+    CompressorC,
+    SeekableZstdReader,
+    SeekableZstdWriter,
+    decompress_bytes_to_bytes,
+)
+
+
+def _make_lines(n: int = 1000) -> list[str]:
+    return [json.dumps({"id": i, "text": "x" * (i % 37)}) for i in range(n)]
+
+
+@pytest.mark.parametrize("align_lines", [True, False])
+@pytest.mark.parametrize("workers", [0, 4])
+def test_seekable_zstd_roundtrip(tmp_path, align_lines, workers):
+    lines = _make_lines()
+    raw_data = "".join(f"{line}\n" for line in lines).encode("utf-8")
+    file = tmp_path / "data.jsonl.zst"
+    with SeekableZstdWriter(file, frame_size=1000, align_lines=align_lines) as writer:
+        for line in lines:
+            writer.write(f"{line}\n")
+
+    # the output must be readable by any zstd decompressor
+    compressed = file.read_bytes()
+    assert zstandard.ZstdDecompressor().stream_reader(
+        io.BytesIO(compressed), read_across_frames=True
+    ).read() == raw_data
+    assert decompress_bytes_to_bytes(compressed, CompressorC.ZSTD) == raw_data
+
+    with SeekableZstdReader(file, workers=workers) as reader:
+        assert reader.num_frames > 10
+        assert reader.size == len(raw_data)
+        if align_lines:
+            for frame_id in range(reader.num_frames):
+                assert reader.read_frame(frame_id).endswith(b"\n")
+        for start, stop in [(0, 10), (995, 3005), (len(raw_data) - 5, None), (10, 10)]:
+            assert reader.read_range(start, stop) == raw_data[start:stop]
+        assert reader.num_lines == len(lines)
+        for start, stop in [(0, 1), (0, 20), (17, 500), (999, 1000), (990, None)]:
+            assert reader.read_lines(start, stop) == lines[start:stop]
+        assert json.loads(reader.read_lines(123, 124)[0])["id"] == 123
+
+
+def test_seekable_zstd_no_trailing_newline():
+    sink = io.BytesIO()
+    writer = SeekableZstdWriter(sink, frame_size=4, align_lines=False)
+    writer.write(b"line0\nline1\nline2")
+    writer.close()
+    sink.seek(0)
+    reader = SeekableZstdReader(sink)
+    assert reader.num_lines == 3
+    assert reader.read_lines(1, None) == ["line1", "line2"]
+    assert reader.read_lines(2, 3, encoding=None) == [b"line2"]
+
+
+def test_seekable_zstd_invalid_file():
+    data = zstandard.ZstdCompressor().compress(b"not seekable" * 10)
+    with pytest.raises(ValueError, match="Not a seekable zstd file"):
+        SeekableZstdReader(io.BytesIO(data))
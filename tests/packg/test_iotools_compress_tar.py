@@ -0,0 +1,188 @@
+import gzip
+import io
+import os
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from packg.iotools.compress import (
+    CompressorC,
+    compress_data_to_file,
+    create_tar_zst,
+    extract_tar,
+    get_compressor_name_from_filename,
+)
+from packg.iotools.pathspec_matcher import PathSpecArgs
+
+FILES = {
+    "a.txt": b"content a",
+    "sub/b.py": b"content b" * 1000,
+    "sub/c.txt": b"",
+    "sub/deep/d.txt": os.urandom(100_000),
+}
+
+
+def _make_tar_bytes(files: dict[str, bytes], links: dict[str, str] = None) -> bytes:
+    sink = io.BytesIO()
+    with tarfile.open(fileobj=sink, mode="w") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = 1_600_000_000
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in (links or {}).items():
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+    return sink.getvalue()
+
+
+def _read_tree(root: Path) -> dict[str, bytes]:
+    return {
+        p.relative_to(root).as_posix(): p.read_bytes()
+        for p in root.rglob("*")
+        if p.is_file() and not p.is_symlink()
+    }
+
+
+@pytest.mark.parametrize("suffix", [".tar", ".tar.zst", ".tar.xz", ".tar.gz"])
+@pytest.mark.parametrize("workers", [0, 4])
+def test_extract_tar_compressed(tmp_path, suffix, workers):
+    tar_bytes = _make_tar_bytes(FILES)
+    tar_file = tmp_path / f"archive{suffix}"
+    if suffix == ".tar.gz":
+        # not handled by the compressor wrappers, tarfile detects it automatically
+        tar_file.write_bytes(gzip.compress(tar_bytes))
+    else:
+        compressor_name = get_compressor_name_from_filename(tar_file) or CompressorC.NONE
+        compress_data_to_file(tar_bytes, tar_file, compressor_name)
+    target = tmp_path / "out"
+    extract_tar(tar_file, target, workers=workers, verbose=True, max_pending_bytes=50_000)
+    assert _read_tree(target) == FILES
+    assert (target / "a.txt").stat().st_mtime == 1_600_000_000
+
+
+def test_extract_tar_pathspec_filter(tmp_path):
+    tar_file = tmp_path / "archive.tar"
+    tar_file.write_bytes(_make_tar_bytes(FILES))
+    target = tmp_path / "out"
+    extract_tar(tar_file, target, workers=2, pathspec_args=PathSpecArgs(exclude_git=["*.py"]))
+    assert set(_read_tree(target)) == {"a.txt", "sub/c.txt", "sub/deep/d.txt"}
+
+    target2 = tmp_path / "out2"
+    extract_tar(tar_file, target2, pathspec_args={"include_git": ["/sub/deep/"]})
+    assert set(_read_tree(target2)) == {"sub/deep/d.txt"}
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_extract_tar_duplicate_members(tmp_path, workers):
+    """If a tar contains a file twice, the later member wins, as with tar -x."""
+    tar_file = tmp_path / "archive.tar"
+    with tarfile.open(tar_file, mode="w") as tar:
+        for i, content in enumerate([b"first" * 1000, b"other", b"second"]):
+            info = tarfile.TarInfo("other.txt" if i == 1 else "dup.txt")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    target = tmp_path / "out"
+    extract_tar(tar_file, target, workers=workers)
+    assert _read_tree(target) == {"dup.txt": b"second", "other.txt": b"other"}
+
+
+def test_extract_tar_symlinks(tmp_path):
+    tar_file = tmp_path / "archive.tar"
+    tar_file.write_bytes(_make_tar_bytes(FILES, links={"link.txt": "sub/b.py"}))
+    target = tmp_path / "out"
+    extract_tar(tar_file, target, workers=2)
+    assert (target / "link.txt").is_symlink()
+    assert (target / "link.txt").read_bytes() == FILES["sub/b.py"]
+
+
+@pytest.mark.parametrize(
+    "entries",
+    [
+        [("../evil.txt", b"x")],
+        [("/abs/evil.txt", b"x")],
+        [("link", "../../outside")],
+        [("escape", ".."), ("escape/evil.txt", b"x")],
+    ],
+)
+def test_extract_tar_unsafe_paths(tmp_path, entries):
+    sink = io.BytesIO()
+    with tarfile.open(fileobj=sink, mode="w") as tar:
+        for name, content_or_link in entries:
+            info = tarfile.TarInfo(name)
+            if isinstance(content_or_link, str):
+                info.type = tarfile.SYMTYPE
+                info.linkname = content_or_link
+                tar.addfile(info)
+                continue
+            info.size = len(content_or_link)
+            tar.addfile(info, io.BytesIO(content_or_link))
+    tar_file = tmp_path / "archive.tar"
+    tar_file.write_bytes(sink.getvalue())
+    target = tmp_path / "sub" / "out"
+    with pytest.raises(ValueError, match="Refusing"):
+        extract_tar(tar_file, target)
+    assert not (tmp_path / "evil.txt").exists()
+    assert not (tmp_path / "sub" / "evil.txt").exists()
+
+
+def _write_tree(root: Path, files: dict[str, bytes]) -> None:
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(content)
+
+
+def test_create_tar_zst(tmp_path):
+    src = tmp_path / "src"
+    _write_tree(src, FILES)
+    out_file = tmp_path / "archive.tar.zst"
+    assert create_tar_zst(src, out_file, threads=2, verbose=False) == [out_file.absolute()]
+    target = tmp_path / "out"
+    extract_tar(out_file, target, workers=2)
+    assert _read_tree(target) == FILES
+
+    # pathspecs filter the packed files, the archive itself is never packed
+    out_file2 = src / "archive.tar.zst"
+    create_tar_zst(src, out_file2, pathspec_args=PathSpecArgs(exclude_git=["*.py"]))
+    create_tar_zst(src, out_file2, pathspec_args=PathSpecArgs(exclude_git=["*.py"]))
+    target2 = tmp_path / "out2"
+    extract_tar(out_file2, target2)
+    assert set(_read_tree(target2)) == {"a.txt", "sub/c.txt", "sub/deep/d.txt"}
+
+
+def test_create_tar_zst_volumes(tmp_path):
+    src = tmp_path / "src"
+    _write_tree(src, FILES)
+    out_file = tmp_path / "archive.tar.zst"
+    volumes = create_tar_zst(src, out_file, level=1, volume_size=20_000, verbose=False)
+    assert len(volumes) > 2
+    assert [v.name for v in volumes[:2]] == ["archive.tar.zst.000", "archive.tar.zst.001"]
+    assert all(v.stat().st_size <= 20_000 for v in volumes)
+    out_file.write_bytes(b"".join(v.read_bytes() for v in volumes))
+    target = tmp_path / "out"
+    extract_tar(out_file, target)
+    assert _read_tree(target) == FILES
+
+
+@pytest.mark.parametrize("volume_size", [None, 20_000])
+def test_create_tar_zst_error(tmp_path, monkeypatch, volume_size):
+    """A failed run closes the output and removes the partial files."""
+    src = tmp_path / "src"
+    # more than the write buffer, so some output is written before the error
+    _write_tree(src, {"a.bin": os.urandom(800_000), "b.bin": os.urandom(800_000), "c.txt": b""})
+    add = tarfile.TarFile.add
+
+    def failing_add(self, name, *args, **kwargs):
+        if Path(name).name == "c.txt":
+            raise OSError(f"Cannot read {name}")
+        return add(self, name, *args, **kwargs)
+
+    monkeypatch.setattr(tarfile.TarFile, "add", failing_add)
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    with pytest.raises(OSError, match="Cannot read"):
+        create_tar_zst(src, out_dir / "archive.tar.zst", level=1, volume_size=volume_size)
+    assert list(out_dir.iterdir()) == []
@@ -0,0 +1,82 @@
+import lzma
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from packg.iotools.compress import (
+    CompressorC,
+    compress_data_to_bytes,
+    decompress_bytes_to_bytes,
+    decompress_xz_parallel,
+    dump_xz,
+    find_xz_streams,
+    get_compressor,
+    get_decompressor,
+    load_xz,
+)
+from packg.iotools.jsonext import dump_json_xz, load_json_xz
+
+DATA = b"".join(os.urandom(50) + b"repeated text " * 20 for _ in range(2000))
+
+
+@pytest.mark.parametrize("data", [DATA, b"", b"short"])
+@pytest.mark.parametrize("threads", [1, 4])
+def test_xz_block_parallel_roundtrip(data, threads):
+    compressed = compress_data_to_bytes(
+        data, CompressorC.LZMA, threads=threads, block_size=100_000
+    )
+    # the output must be readable by any xz decompressor
+    assert lzma.decompress(compressed) == data
+    streams = find_xz_streams(compressed)
+    assert len(streams) == max(1, -(-len(data) // 100_000))
+    assert decompress_xz_parallel(compressed, threads=4) == data
+    assert decompress_bytes_to_bytes(compressed, CompressorC.LZMA, threads=2) == data
+    assert decompress_bytes_to_bytes(compressed, CompressorC.LZMA) == data
+
+
+def test_xz_block_parallel_streaming():
+    compressor = get_compressor(CompressorC.LZMA, threads=2, block_size=10_000)
+    chunks = [DATA[i : i + 12_345] for i in range(0, len(DATA), 12_345)]
+    compressed = b"".join([compressor.compress(chunk) for chunk in chunks])
+    compressed += compressor.flush()
+    # stream padding between streams is allowed by the format
+    compressed = compressed + b"\x00" * 8 + lzma.compress(b"tail")
+    decompressor = get_decompressor(CompressorC.LZMA)
+    decompressed = b"".join(
+        [decompressor.decompress(compressed[i : i + 777]) for i in range(0, len(compressed), 777)]
+    )
+    assert decompressed == DATA + b"tail"
+    assert decompress_xz_parallel(compressed) == DATA + b"tail"
+
+
+def test_xz_parallel_fallback():
+    # a single stream cannot be split, invalid trailing data cannot be parsed
+    assert decompress_xz_parallel(lzma.compress(DATA)) == DATA
+    with pytest.raises(ValueError):
+        find_xz_streams(lzma.compress(DATA) + b"garbage!")
+
+
+def test_dump_load_xz_threads(tmp_path):
+    file = tmp_path / "data.txt.xz"
+    text = DATA.hex()
+    dump_xz(text, file, threads=4, block_size=50_000)
+    assert len(find_xz_streams(file.read_bytes())) > 1
+    assert load_xz(file) == text
+    assert load_xz(file, threads=4) == text
+    dump_xz(b"appended", file, mode="ab", threads=2)
+    assert load_xz(file, mode="rb", threads=2) == DATA.hex().encode() + b"appended"
+
+    json_file = tmp_path / "data.json.xz"
+    obj = {"values": list(range(10_000))}
+    dump_json_xz(obj, json_file, threads=2, block_size=10_000)
+    assert load_json_xz(json_file, threads=2) == obj
+
+
+@pytest.mark.skipif(shutil.which("xz") is None, reason="xz cli not installed")
+def test_xz_cli_reads_block_parallel_output(tmp_path):
+    file = tmp_path / "data.xz"
+    file.write_bytes(compress_data_to_bytes(DATA, CompressorC.LZMA, threads=2, block_size=50_000))
+    output = subprocess.run(["xz", "-dc", str(file)], check=True, capture_output=True).stdout
+    assert output == DATA
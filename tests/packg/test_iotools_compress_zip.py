@@ -0,0 +1,94 @@
+import os
+import time
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from packg.iotools.compress import ZipIndex, _sanitize_windows_name
+
+FILES = {
+    "a.txt": b"content a",
+    "sub/b.json": b'{"b": 1}' * 1000,
+    "sub/deep/c.bin": os.urandom(50_000),
+    "empty.txt": b"",
+}
+DATE_TIME = (2023, 12, 30, 23, 43, 0)
+
+
+@pytest.fixture
+def zip_file(tmp_path):
+    zip_file = tmp_path / "data.zip"
+    with zipfile.ZipFile(zip_file, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(zipfile.ZipInfo("sub/", date_time=DATE_TIME), b"")
+        for name, content in FILES.items():
+            zf.writestr(zipfile.ZipInfo(name, date_time=DATE_TIME), content)
+    return zip_file
+
+
+def test_zip_index(zip_file):
+    with ZipIndex(zip_file) as zip_index:
+        assert len(zip_index) == len(FILES) + 1
+        assert "sub/b.json" in zip_index and "missing" not in zip_index
+        assert zip_index.get_info("sub/deep/c.bin").file_size == 50_000
+        listing = zip_index.listing(include_dirs=False)
+        assert set(listing) == set(FILES)
+        timestamp = time.mktime(DATE_TIME + (0, 0, -1))
+        assert listing["a.txt"] == (len(FILES["a.txt"]), timestamp)
+        for name, content in FILES.items():
+            assert zip_index.read(name) == content
+        with zip_index.open("sub/b.json") as fh:
+            assert fh.read(8) == b'{"b": 1}'
+
+    # the cached index is only reused while the file is unchanged
+    assert ZipIndex(zip_file).infos is zip_index.infos
+    assert ZipIndex(zip_file, use_cache=False).infos is not zip_index.infos
+    with zipfile.ZipFile(zip_file, "a") as zf:
+        zf.writestr("new.txt", b"new")
+    os.utime(zip_file, ns=(0, zip_file.stat().st_mtime_ns + 10**9))
+    assert "new.txt" in ZipIndex(zip_file)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_zip_index_extract(tmp_path, zip_file, workers):
+    target = tmp_path / "out"
+    paths = ZipIndex(zip_file).extract(target, workers=workers)
+    assert len(paths) == len(FILES) + 1
+    for name, content in FILES.items():
+        assert (target / name).read_bytes() == content
+    assert (target / "a.txt").stat().st_mtime == time.mktime(DATE_TIME + (0, 0, -1))
+
+    target2 = tmp_path / "out2"
+    ZipIndex(zip_file).extract(target2, names=["a.txt", "sub/deep/c.bin"], workers=workers)
+    assert sorted(p.relative_to(target2).as_posix() for p in target2.rglob("*") if p.is_file()) == [
+        "a.txt",
+        "sub/deep/c.bin",
+    ]
+
+
+def test_zip_index_extract_unsafe_names(tmp_path):
+    zip_file = tmp_path / "unsafe.zip"
+    names = ["/abs/a.txt", "../up/b.txt", "x/./../c.txt", "d/"]
+    with zipfile.ZipFile(zip_file, "w") as zf:
+        for name in names:
+            data = b"" if name[-1] == "/" else b"x"
+            zf.writestr(zipfile.ZipInfo(name, date_time=DATE_TIME), data)
+    paths = ZipIndex(zip_file).extract(tmp_path / "out")
+    with zipfile.ZipFile(zip_file, "r") as zf:
+        expected = [zf.extract(name, tmp_path / "out_zipfile") for name in names]
+    assert [p.relative_to(tmp_path / "out") for p in paths] == [
+        Path(p).relative_to(tmp_path / "out_zipfile") for p in expected
+    ]
+    assert all(p.exists() for p in paths)
+
+
+def test_sanitize_windows_name():
+    assert _sanitize_windows_name('a:b\\c..\\\\d?<>|"*.txt', "\\") == "a_b\\c\\d______.txt"
+    assert _sanitize_windows_name("x/y./.../z", "/") == "x/y/z"
+
+
+def test_zip_index_extract_failed_worker(tmp_path, zip_file):
+    target = tmp_path / "out"
+    (target / "a.txt").mkdir(parents=True)
+    with pytest.raises(RuntimeError, match="Failed to extract 1/"):
+        ZipIndex(zip_file).extract(target, workers=2)
@@ -0,0 +1,249 @@
+import fnmatch
+import random
+import re
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from packg.iotools.file_index import (
+    FileIndex,
+    FileProperties,
+    argsort_segments,
+    fnv1a_hash,
+    fnv1a_hash_segments,
+    read_file_index_header,
+    segments_equal,
+)
+from packg.iotools import file_indexer
+from packg.iotools.file_indexer import diff_indexes, make_index
+
+
+def _make_items(n: int, seed: int = 0) -> list[tuple[str, int, float]]:
+    rng = random.Random(seed)
+    names = ["data", "images", "ä-ö", "sub dir", "x"]
+    return [
+        (
+            f"{rng.choice(names)}/{rng.choice(names)}{i}/file_{i}.{rng.choice(['txt', 'jpg'])}",
+            rng.randint(0, 10**9),
+            1.7e9 + rng.random() * 1e6,
+        )
+        for i in range(n)
+    ]
+
+
+def test_fnv1a_hash_segments():
+    segments = [b"", b"a", b"hello world", "ä/ö".encode(), b"a" * 300]
+    data = np.frombuffer(b"".join(segments), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(s) for s in segments])
+    assert fnv1a_hash(b"") == 0xCBF29CE484222325
+    assert fnv1a_hash(b"a") == 0xAF63DC4C8601EC8C
+    assert fnv1a_hash_segments(data, offsets).tolist() == [fnv1a_hash(s) for s in segments]
+
+
+def test_file_index_mapping():
+    items = _make_items(2000)
+    file_index = FileIndex.from_items(items, root="/root")
+    file_dict = {path: FileProperties(size, mtime) for path, size, mtime in items}
+    assert len(file_index) == 2000
+    assert list(file_index) == list(file_dict)
+    assert list(file_index.items()) == list(file_dict.items())
+    assert list(file_index.values()) == list(file_dict.values())
+    for path, props in file_dict.items():
+        assert file_index[path] == props
+    assert "missing.txt" not in file_index and file_index.get("missing.txt") is None
+    with pytest.raises(KeyError):
+        _ = file_index["data"]
+    assert file_index == file_dict
+    assert FileIndex.from_dict(file_dict).to_dict() == file_dict
+    assert len(FileIndex.from_items([])) == 0 and "a" not in FileIndex.from_items([])
+
+
+def test_file_index_memory():
+    items = _make_items(50_000)
+    tracemalloc.start()
+    # create new objects like make_index does, instead of referencing the ones in items
+    file_dict = {
+        path.encode().decode(): FileProperties(size + 1, mtime + 1) for path, size, mtime in items
+    }
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    file_index = FileIndex.from_dict(file_dict)
+    assert file_index[items[7][0]] == file_dict[items[7][0]]
+    print(f"dict {dict_bytes / 1e6:.1f}MB, FileIndex {file_index.nbytes / 1e6:.1f}MB")
+    assert file_index.nbytes * 4 < dict_bytes
+
+
+def test_make_index_return_file_index(tmp_path):
+    for name in ["a.txt", "sub/b.txt", "sub/c/d.txt"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_text(name)
+    file_dict = make_index(tmp_path, verbose=False)
+    file_index = make_index(tmp_path, verbose=False, return_file_index=True)
+    assert isinstance(file_index, FileIndex)
+    assert file_index.root == tmp_path.resolve().as_posix()
+    assert list(file_index.items()) == list(file_dict.items())
+
+
+@pytest.mark.parametrize("compress", [False, True])
+@pytest.mark.parametrize("mmap", [False, True])
+def test_file_index_save_load(tmp_path, compress, mmap):
+    items = _make_items(3000)
+    file_index = FileIndex.from_items(items, root="/data/root")
+    file = tmp_path / "index.fidx"
+    file_index.save(file, compress=compress)
+    header = read_file_index_header(file)
+    assert (header["n"], header["root"], header["compressed"]) == (3000, "/data/root", compress)
+    assert all(section["offset"] % 64 == 0 for section in header["sections"])
+
+    loaded = FileIndex.load(file, mmap=mmap)
+    assert loaded.root == "/data/root"
+    assert list(loaded.items()) == list(file_index.items())
+    assert loaded[items[123][0]] == FileProperties(items[123][1], items[123][2])
+    assert "missing" not in loaded
+    if mmap and not compress:
+        assert isinstance(loaded.sizes.base, np.memmap)
+
+    empty_file = tmp_path / "empty.fidx"
+    FileIndex.from_items([]).save(empty_file, compress=compress)
+    assert len(FileIndex.load(empty_file, mmap=mmap)) == 0
+
+
+def test_file_index_load_invalid(tmp_path):
+    file = tmp_path / "invalid.fidx"
+    file.write_bytes(b"something else")
+    with pytest.raises(ValueError, match="Not a FileIndex snapshot"):
+        FileIndex.load(file)
+
+
+def test_segments_equal():
+    segments_a = [b"abc", b"", b"abd", b"x" * 100, b"ab"]
+    segments_b = [b"ab", b"abc", b"x" * 100, b"", b"abc"]
+    data_a = np.frombuffer(b"".join(segments_a), dtype=np.uint8)
+    data_b = np.frombuffer(b"".join(segments_b), dtype=np.uint8)
+    offsets_a = np.cumsum([0] + [len(s) for s in segments_a])
+    offsets_b = np.cumsum([0] + [len(s) for s in segments_b])
+    positions_a, positions_b = np.array([0, 1, 2, 3, 4, 0]), np.array([1, 3, 4, 2, 0, 4])
+    equal = segments_equal(data_a, offsets_a, positions_a, data_b, offsets_b, positions_b)
+    assert equal.tolist() == [True, True, False, True, True, True]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_argsort_segments(seed):
+    rng = random.Random(seed)
+    parts = [b"a", b"b", b"/", b"ab" * 5, "ä".encode(), b"\xff", b"x" * 20]
+    segments = list(
+        {b"".join(rng.choice(parts) for _ in range(rng.randint(0, 12))) for _ in range(500)}
+    )
+    segments += [segments[0], b""]
+    data = np.frombuffer(b"".join(segments), dtype=np.uint8)
+    offsets = np.cumsum([0] + [len(s) for s in segments])
+    order = argsort_segments(data, offsets)
+    assert order.tolist() == sorted(range(len(segments)), key=segments.__getitem__)
+    assert argsort_segments(data[:0], np.zeros(1, dtype=np.int64)).tolist() == []
+
+
+@pytest.mark.parametrize("as_dict", [False, True])
+def test_diff_indexes(as_dict):
+    items = _make_items(3000)
+    new_items = items[100:] + [("added/file.txt", 1, 2.0)]
+    new_items[0] = (new_items[0][0], new_items[0][1] + 1, new_items[0][2])
+    new_items[1] = (new_items[1][0], new_items[1][1], new_items[1][2] + 1)
+    new_items[2] = (new_items[2][0], new_items[2][1] + 1, new_items[2][2] + 1)
+    old, new = FileIndex.from_items(items), FileIndex.from_items(new_items)
+    if as_dict:
+        old, new = old.to_dict(), new.to_dict()
+    diff = diff_indexes(old, new)
+    assert diff.added == {"added/file.txt"}
+    assert diff.removed == {path for path, _, _ in items[:100]}
+    assert diff.size_changed == {new_items[0][0], new_items[2][0]}
+    assert diff.mtime_changed == {new_items[1][0], new_items[2][0]}
+    assert diff.modified == {path for path, _, _ in new_items[:3]}
+    assert len(diff) == 104
+    assert len(diff_indexes(new, new)) == 0
+    assert len(diff_indexes({}, new).added) == len(new_items)
+    assert len(diff_indexes(old, {}).removed) == len(items)
+
+
+def test_diff_indexes_hash_collision(monkeypatch):
+    # with colliding hashes the result must be the same as without
+    old = FileIndex.from_items([("a", 1, 1.0), ("b", 2, 2.0), ("c", 3, 3.0)])
+    new = FileIndex.from_items([("a", 1, 5.0), ("bb", 2, 2.0), ("c", 3, 3.0)])
+    expected = diff_indexes(old, new)
+    used_fallback = []
+    fallback = file_indexer._diff_indexes_with_dicts
+
+    def counting_fallback(*args):
+        used_fallback.append(True)
+        return fallback(*args)
+
+    monkeypatch.setattr(file_indexer, "_diff_indexes_with_dicts", counting_fallback)
+    for index in (old, new):
+        index._sorted_hashes, index._hash_order = None, None
+        index._hashes = np.array([1, 2, 3], dtype=np.uint64)
+    # different paths with the same hash are removed and added, not the same file
+    assert diff_indexes(old, new) == expected
+    assert used_fallback == []
+    new._sorted_hashes, new._hashes = None, np.array([1, 2, 2], dtype=np.uint64)
+    assert diff_indexes(old, new) == expected
+    assert used_fallback == [True]
+
+
+def test_diff_indexes_same_length_collision():
+    old = FileIndex.from_items([("ab", 1, 1.0), ("c", 3, 3.0)])
+    new = FileIndex.from_items([("xy", 1, 1.0), ("c", 3, 3.0)])
+    for index in (old, new):
+        index._hashes = np.array([7, 3], dtype=np.uint64)
+    diff = diff_indexes(old, new)
+    assert diff.removed == {"ab"}
+    assert diff.added == {"xy"}
+    assert len(diff.modified) == 0
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"prefix": "images/"},
+        {"prefix": "ä-ö/sub"},
+        {"prefix": "missing/"},
+        {"suffix": ".jpg"},
+        {"suffix": (".txt", "_17.jpg")},
+        {"suffix": "/file_1234.txt"},
+        {"glob": "data/*/file_1*.txt"},
+        {"glob": "*ä*", "max_size": 10**8},
+        {"regex": r"_\d\d\.jpg$", "prefix": "x"},
+        {"min_size": 10**8, "max_size": 5 * 10**8},
+        {"min_mtime": 1.7e9 + 2e5, "max_mtime": 1.7e9 + 3e5, "suffix": ".txt"},
+    ],
+)
+def test_file_index_query(kwargs):
+    items = _make_items(3000)
+    file_index = FileIndex.from_items(items)
+    regex = None if "regex" not in kwargs else re.compile(kwargs["regex"])
+
+    def is_match(path, size, mtime):
+        suffix = kwargs.get("suffix", "")
+        return (
+            path.startswith(kwargs.get("prefix", ""))
+            and path.endswith(suffix if isinstance(suffix, str) else tuple(suffix))
+            and fnmatch.fnmatchcase(path, kwargs.get("glob", "*"))
+            and (regex is None or regex.search(path) is not None)
+            and kwargs.get("min_size", 0) <= size <= kwargs.get("max_size", 10**10)
+            and kwargs.get("min_mtime", 0) <= mtime <= kwargs.get("max_mtime", 1e10)
+        )
+
+    expected = [i for i, item in enumerate(items) if is_match(*item)]
+    positions = file_index.query(**kwargs)
+    assert positions.tolist() == expected
+    assert file_index.get_paths(positions) == [items[i][0] for i in expected]
+
+
+def test_file_index_query_empty_and_snapshot(tmp_path):
+    assert len(FileIndex.from_items([]).query(prefix="a", suffix=".txt")) == 0
+    file_index = FileIndex.from_items(_make_items(100))
+    expected = file_index.query(prefix="data/")
+    file_index.save(tmp_path / "index.bin")
+    loaded = FileIndex.load(tmp_path / "index.bin")
+    assert loaded._path_order is not None
+    assert loaded.query(prefix="data/").tolist() == expected.tolist()
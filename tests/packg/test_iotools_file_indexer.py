@@ -1,9 +1,15 @@
+import hashlib
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Iterator
 
 import pytest
 
-from packg.iotools.file_indexer import make_index
+from packg.iotools.file_index import FilePropertiesWithDigest
+from packg.iotools.file_indexer import IndexContext, hash_file, iter_index, make_index
 from packg.iotools.pathspec_matcher import PathSpecArgs
 
 
@@ -273,3 +279,235 @@ def test_make_index_with_pathspec_exclude_directory_root_only(temp_file_structur
     assert "file3.md" in result
     assert "subdir2/file6.md" in result
     assert "subdir2/file7.txt" in result
+
+
+def test_make_index_order_and_symlinks(temp_file_structure: Path):
+    """Files of subdirectories come before the files of their parent, sorted by name."""
+    (temp_file_structure / "link_file.txt").symlink_to(temp_file_structure / "file1.txt")
+    (temp_file_structure / "link_dir").symlink_to(temp_file_structure / "subdir2" / "subdir1")
+    (temp_file_structure / "broken_link").symlink_to(temp_file_structure / "missing")
+
+    result = make_index(temp_file_structure, verbose=False)
+    assert list(result)[:5] == [
+        "subdir1/nested/subdir_nested/file10.py",
+        "subdir1/nested/subdir_nested/file9.txt",
+        "subdir1/nested/file8.txt",
+        "subdir1/file4.txt",
+        "subdir1/file5.py",
+    ]
+    assert list(result)[-3:] == ["file1.txt", "file2.py", "file3.md"]
+    assert list(make_index(temp_file_structure, verbose=False, reverse=True))[:3] == [
+        "subdir2/subdir1/file12.py",
+        "subdir2/subdir1/file11.txt",
+        "subdir2/file7.txt",
+    ]
+
+    result_follow = make_index(temp_file_structure, verbose=False, follow_symlinks=True)
+    assert set(result_follow) - set(result) == {
+        "link_file.txt",
+        "link_dir/file11.txt",
+        "link_dir/file12.py",
+    }
+    assert result_follow["link_file.txt"] == result["file1.txt"]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_make_index_workers(temp_file_structure: Path, reverse: bool):
+    """Parallel traversal must give the same order and status as the sequential one."""
+    for i in range(20):
+        (temp_file_structure / "subdir2" / f"many{i}").mkdir()
+        (temp_file_structure / "subdir2" / f"many{i}" / "file.py").write_text("x" * i)
+    kwargs = {
+        "verbose": False,
+        "reverse": reverse,
+        "return_status": True,
+        "pathspec_args": PathSpecArgs(exclude_git=["many1*/", "file3.md"]),
+    }
+    result, status = make_index(temp_file_structure, **kwargs)
+    for workers in [1, 8]:
+        result_parallel, status_parallel = make_index(
+            temp_file_structure, workers=workers, **kwargs
+        )
+        assert list(result_parallel.items()) == list(result.items())
+        assert status_parallel == status
+    assert len(status["ignored_dirs"]) == 11
+
+
+def test_make_index_workers_error(temp_file_structure: Path, monkeypatch):
+    """Errors in the worker threads are raised in the caller."""
+    from packg.iotools import file_indexer
+
+    scan_dir = file_indexer._scan_dir
+
+    def failing_scan_dir(root, rel_root, **kwargs):
+        if rel_root == "subdir1/nested/":
+            raise PermissionError(f"Cannot read {root}")
+        return scan_dir(root, rel_root, **kwargs)
+
+    monkeypatch.setattr(file_indexer, "_scan_dir", failing_scan_dir)
+    with pytest.raises(PermissionError, match="Cannot read"):
+        make_index(temp_file_structure, verbose=False, workers=4)
+
+
+def test_iter_index_workers_bounded(tmp_path, monkeypatch):
+    """The parallel traversal only scans a bounded number of dirs ahead of the consumer."""
+    from packg.iotools import file_indexer
+
+    for a, b, c in itertools.product(range(4), repeat=3):
+        (tmp_path / f"a{a}" / f"b{b}" / f"c{c}").mkdir(parents=True)
+        (tmp_path / f"a{a}" / f"b{b}" / f"c{c}" / "file.txt").write_text("x")
+    scan_dir = file_indexer._scan_dir
+    scanned = []
+
+    def counting_scan_dir(root, rel_root, **kwargs):
+        scanned.append(rel_root)
+        return scan_dir(root, rel_root, **kwargs)
+
+    monkeypatch.setattr(file_indexer, "_scan_dir", counting_scan_dir)
+    entries = iter_index(tmp_path, workers=1)
+    first = next(entries)
+    time.sleep(0.2)
+    # root, a0, a0/b0, a0/b0/c0 are consumed, 16 scans per worker can run ahead
+    assert len(scanned) <= 4 + 16
+    result = [first, *entries]
+    assert len(scanned) == 1 + 4 + 16 + 64
+    assert result == list(iter_index(tmp_path))
+
+
+def test_make_index_cache_file(temp_file_structure: Path, tmp_path_factory, monkeypatch):
+    """Unchanged directories are not listed again, changes in files and dirs are detected."""
+    from packg.iotools import file_indexer
+
+    cache_file = tmp_path_factory.mktemp("cache") / "index.pkl"
+    spec = PathSpecArgs(exclude_git=["*.md"])
+    kwargs = {"verbose": False, "pathspec_args": spec, "cache_file": cache_file}
+    result = make_index(temp_file_structure, **kwargs)
+    assert cache_file.is_file()
+    # make all dir mtimes old enough to be trusted
+    for path in [temp_file_structure, *temp_file_structure.rglob("*")]:
+        if path.is_dir():
+            os.utime(path, ns=(0, 10**18))
+    make_index(temp_file_structure, **kwargs)
+
+    listed = []
+    scan_dir = file_indexer._scan_dir
+
+    def counting_scan_dir(root, rel_root, **kwargs):
+        listed.append(rel_root)
+        return scan_dir(root, rel_root, **kwargs)
+
+    monkeypatch.setattr(file_indexer, "_scan_dir", counting_scan_dir)
+    result_cached, status = make_index(temp_file_structure, return_status=True, **kwargs)
+    assert listed == []
+    assert list(result_cached.items()) == list(result.items())
+    assert status["ignored_files"] == ["/subdir2/file6.md", "/file3.md"]
+
+    # changed file content is found without listing, a new file only lists its dir
+    (temp_file_structure / "subdir1" / "file4.txt").write_text("changed content")
+    (temp_file_structure / "subdir2" / "subdir1" / "new.txt").write_text("new")
+    result_changed = make_index(temp_file_structure, workers=2, **kwargs)
+    assert listed == ["subdir2/subdir1/"]
+    assert result_changed["subdir1/file4.txt"].size == len("changed content")
+    assert set(result_changed) - set(result) == {"subdir2/subdir1/new.txt"}
+
+    # other arguments invalidate the cache
+    listed.clear()
+    make_index(temp_file_structure, verbose=False, cache_file=cache_file)
+    assert len(listed) == 6
+
+
+def test_iter_index(temp_file_structure: Path):
+    kwargs = {"pathspec_args": PathSpecArgs(exclude_git=["file3.md", "subdir1/nested/"])}
+    result, status = make_index(temp_file_structure, verbose=False, return_status=True, **kwargs)
+    context = IndexContext()
+    entries = list(iter_index(temp_file_structure, context=context, **kwargs))
+    assert [rel_file for rel_file, _, _ in entries] == list(result)
+    assert context.get_status() == status
+    assert context.num_files == len(result)
+    assert context.total_size == sum(props.size for props in result.values())
+
+    # closing early stops the traversal
+    entries_iter = iter_index(temp_file_structure, workers=2, **kwargs)
+    assert next(entries_iter) == entries[0]
+    entries_iter.close()
+
+
+def test_iter_index_threads(tmp_path: Path):
+    """Concurrent indexing jobs do not share state."""
+    roots = []
+    for i in range(4):
+        root = tmp_path / f"root{i}"
+        for j in range(50 * (i + 1)):
+            (root / f"dir{j % 7}").mkdir(parents=True, exist_ok=True)
+            (root / f"dir{j % 7}" / f"file{j}.txt").write_text("x" * i)
+            (root / f"dir{j % 7}" / f"file{j}.md").write_text("")
+        roots.append(root)
+    expected = [make_index(root, verbose=False, return_status=True) for root in roots]
+
+    def index_root(i: int) -> tuple[dict, dict]:
+        context = IndexContext()
+        entries = iter_index(roots[i], context=context, pathspec_args={"exclude_git": ["*.md"]})
+        return {rel_file: size for rel_file, size, _ in entries}, context
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(index_root, list(range(4)) * 3))
+    for i, (sizes, context) in enumerate(results):
+        root_result, _ = expected[i % 4]
+        assert sizes == {f: props.size for f, props in root_result.items() if f.endswith(".txt")}
+        assert len(context.ignored_files) == 50 * (i % 4 + 1)
+        assert context.num_files == len(sizes)
+
+
+def test_hash_file(tmp_path: Path):
+    content = os.urandom(10_000)
+    file = tmp_path / "file.bin"
+    file.write_bytes(content)
+    assert hash_file(file) == hashlib.sha256(content).hexdigest()
+    assert hash_file(file, "md5", chunk_size=777) == hashlib.md5(content).hexdigest()
+    # small files are hashed completely in partial mode
+    assert hash_file(file, partial_size=5000) == hash_file(file)
+    # only the start, end and size are used for partial digests
+    file2 = tmp_path / "file2.bin"
+    file2.write_bytes(content[:1000] + b"x" * 8000 + content[-1000:])
+    assert hash_file(file2, partial_size=1000) == hash_file(file, partial_size=1000)
+    assert hash_file(file2, partial_size=1001) != hash_file(file, partial_size=1001)
+    assert hash_file(file2) != hash_file(file)
+
+
+@pytest.mark.parametrize("workers", [0, 3])
+def test_make_index_hash_algo(temp_file_structure: Path, tmp_path_factory, workers: int):
+    result = make_index(temp_file_structure, verbose=False)
+    result_hashed = make_index(
+        temp_file_structure, verbose=False, hash_algo="sha1", workers=workers
+    )
+    assert list(result_hashed) == list(result)
+    for rel_file, props in result_hashed.items():
+        assert isinstance(props, FilePropertiesWithDigest)
+        assert (props.size, props.mtime) == tuple(result[rel_file])
+        content = (temp_file_structure / rel_file).read_bytes()
+        assert props.digest == hashlib.sha1(content).hexdigest()
+
+    # digests are cached by size, mtime and inode. new files are not cached since their
+    # content could still change without changing their mtime.
+    for file in temp_file_structure.rglob("*"):
+        os.utime(file, ns=(0, 10**18))
+    cache_file = tmp_path_factory.mktemp("cache") / "index.pkl"
+    kwargs = {"cache_file": cache_file, "hash_algo": "sha1", "workers": workers}
+    context = IndexContext()
+    entries = list(iter_index(temp_file_structure, context=context, **kwargs))
+    assert context.num_hashed == len(result)
+    assert [entry[3] for entry in entries] == [p.digest for p in result_hashed.values()]
+    context = IndexContext()
+    assert list(iter_index(temp_file_structure, context=context, **kwargs)) == entries
+    assert (context.num_hashed, context.num_hashes_reused) == (0, len(result))
+
+    (temp_file_structure / "file1.txt").write_text("changed")
+    os.utime(temp_file_structure / "file1.txt", ns=(0, 10**18 + 1))
+    context = IndexContext()
+    list(iter_index(temp_file_structure, context=context, partial_hash_size=2, **kwargs))
+    assert context.num_hashed == len(result)
+    result_changed = make_index(temp_file_structure, verbose=False, **kwargs)
+    assert result_changed["file1.txt"].digest == hashlib.sha1(b"changed").hexdigest()
+
+    with pytest.raises(ValueError):
+        make_index(temp_file_structure, hash_algo="sha1", return_file_index=True)
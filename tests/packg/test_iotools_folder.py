@@ -0,0 +1,141 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from packg.iotools.folder import Folder, get_subfolder_data
+
+
+def _set_mtime_ns_back(path, delta_ns=10**9):
+    # make sure the next change results in a different mtime on filesystems with coarse mtimes
+    path_stat = path.stat()
+    os.utime(path, ns=(path_stat.st_atime_ns, path_stat.st_mtime_ns - delta_ns))
+
+
+@pytest.fixture
+def folder_tree(tmp_path):
+    root = tmp_path / "root"
+    for i in range(3):
+        for j in range(3):
+            sub = root / f"dir{i}" / f"sub{j}"
+            sub.mkdir(parents=True)
+            for k in range(j + 1):
+                (sub / f"file{k}.txt").write_bytes(b"x" * (100 * i + 10 * j + k))
+    (root / "top.bin").write_bytes(b"y" * 1000)
+    (root / "empty").mkdir()
+    os.symlink(root / "top.bin", root / "link.bin")
+    os.symlink(root / "dir0", root / "link_dir")
+    # folders modified right before they are listed do not store their mtime
+    for path, _, _ in os.walk(root):
+        _set_mtime_ns_back(Path(path), 10**10)
+    return root
+
+
+def _get_expected_total_size(root) -> int:
+    total_size = 0
+    for path, _, names in os.walk(root):
+        for name in names:
+            file = os.path.join(path, name)
+            if not os.path.islink(file):
+                total_size += os.path.getsize(file)
+    return total_size
+
+
+def test_folder_populate(folder_tree):
+    folder = Folder(folder_tree)
+    folder.populate(recursive=True)
+    assert folder.populated
+    assert list(folder.dir_refs.keys()) == ["dir0", "dir1", "dir2", "empty"]
+    assert list(folder.files_and_stat.keys()) == ["top.bin"]
+    assert folder.files_size == 1000
+    assert folder.total_size == _get_expected_total_size(folder_tree)
+    assert folder.dir_refs["empty"].total_size == 0
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_folder_populate_parallel(folder_tree, workers):
+    folder_seq = Folder(folder_tree)
+    folder_seq.populate(recursive=True)
+    folder_par = Folder(folder_tree)
+    folder_par.populate(recursive=True, workers=workers)
+    assert folder_par == folder_seq
+    assert folder_par.dir_refs["dir2"].dir_refs["sub1"].total_size == 210 + 211
+    assert get_subfolder_data(folder_par, min_size_mb=0) == get_subfolder_data(
+        folder_seq, min_size_mb=0
+    )
+
+
+def test_folder_files_and_stat(folder_tree):
+    folder = Folder(folder_tree / "dir1" / "sub2")
+    folder.populate(recursive=False)
+    assert folder.file_names == ["file0.txt", "file1.txt", "file2.txt"]
+    assert folder.file_sizes.tolist() == [120, 121, 122]
+    file_stat = folder.files_and_stat["file1.txt"]
+    assert file_stat.st_size == 121
+    assert file_stat.st_mtime == (folder_tree / "dir1" / "sub2" / "file1.txt").stat().st_mtime
+
+
+def test_folder_own_stat(folder_tree):
+    folder = Folder(folder_tree / "dir1")
+    with pytest.warns(DeprecationWarning):
+        assert folder.own_stat is None
+    folder.populate(recursive=False)
+    with pytest.warns(DeprecationWarning):
+        assert folder.own_stat.st_mtime_ns == folder.mtime_ns
+
+
+def test_folder_save_load(folder_tree, tmp_path):
+    (folder_tree / "dir0" / os.fsdecode(b"\xff-\xc3\xa4.bin")).write_bytes(b"z" * 5)
+    folder = Folder(folder_tree)
+    folder.populate(recursive=True)
+    folder.save(tmp_path / "tree.npz")
+    loaded = Folder.load(tmp_path / "tree.npz")
+    assert loaded == folder
+    assert loaded.total_size == _get_expected_total_size(folder_tree)
+    assert loaded.dir_refs["dir0"].full_path == folder_tree / "dir0"
+    assert get_subfolder_data(loaded, min_size_mb=0) == get_subfolder_data(folder, min_size_mb=0)
+
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_folder_refresh(folder_tree, tmp_path, workers):
+    folder = Folder(folder_tree)
+    folder.populate(recursive=True)
+    folder.save(tmp_path / "tree.npz")
+    folder = Folder.load(tmp_path / "tree.npz")
+    assert folder.refresh(workers=workers) == 0
+
+    for path in [folder_tree, folder_tree / "dir1" / "sub0", folder_tree / "dir2"]:
+        _set_mtime_ns_back(path)
+    (folder_tree / "dir1" / "sub0" / "new.txt").write_bytes(b"n" * 7)
+    (folder_tree / "dir2" / "sub2" / "file0.txt").unlink()
+    _set_mtime_ns_back(folder_tree / "dir2" / "sub2")
+    (folder_tree / "new_dir" / "deep").mkdir(parents=True)
+    (folder_tree / "new_dir" / "deep" / "a.bin").write_bytes(b"a" * 3)
+    for sub in (folder_tree / "dir2" / "sub1").iterdir():
+        sub.unlink()
+    (folder_tree / "dir2" / "sub1").rmdir()
+
+    # root, dir1/sub0, dir2 and dir2/sub2 are listed again, new_dir is populated from scratch
+    assert folder.refresh(workers=workers) == 4
+    expected = Folder(folder_tree)
+    expected.populate(recursive=True)
+    assert folder == expected
+    assert folder.total_size == _get_expected_total_size(folder_tree)
+
+
+def test_folder_refresh_racy_mtime(folder_tree):
+    sub = folder_tree / "dir0" / "sub0"
+    _set_mtime_ns_back(sub, -(10**10))
+    folder = Folder(folder_tree)
+    folder.populate(recursive=True)
+    assert folder.mtime_ns is not None
+    assert folder.dir_refs["dir0"].dir_refs["sub0"].mtime_ns is None
+
+    # a change right after the listing may keep the mtime, the folder is listed again anyway
+    mtime_ns = sub.stat().st_mtime_ns
+    (sub / "new.txt").write_bytes(b"n" * 7)
+    path_stat = sub.stat()
+    os.utime(sub, ns=(path_stat.st_atime_ns, mtime_ns))
+    assert folder.refresh() == 1
+    assert folder.dir_refs["dir0"].dir_refs["sub0"].file_names == ["file0.txt", "new.txt"]
+    assert folder.total_size == _get_expected_total_size(folder_tree)
@@ -1,9 +1,11 @@
 import os
+import random
 from pathlib import Path
 from typing import List
 
 import pytest
-from pathspec import PathSpec, Pattern
+from pathspec import PathSpec, Pattern, RegexPattern
+from pathspec import patterns as p_patterns
 
 from packg.iotools.pathspec_matcher import (
     PathSpecArgs,
@@ -11,11 +13,13 @@ from packg.iotools.pathspec_matcher import (
     PathSpecWithConversion,
     apply_pathspecs,
     expand_pathspec_args,
+    get_compiled_pathspecs,
     make_and_apply_pathspecs,
     make_pathspec,
     make_pathspecs,
     repr_pathspec,
 )
+from packg.iotools.pathspec_matcher import _GIT_SUFFIX_REGEX, _PATHSPEC_SEARCHES_REGEX
 from packg.testing.setup_tests import git_example_fixture, session_tmp_path
 
 _ = git_example_fixture, session_tmp_path  # remove the unused false positive
@@ -269,3 +273,92 @@ def test_pathspec_with_dirs_no_leading_slash():
     # directories and does not exclude them.
     out = list(apply_pathspecs(["/subdir1", "/subdir2"], make_pathspecs(exclude_git=["/subdir1/"])))
     assert out == ["/subdir1", "/subdir2"]
+
+
+def _apply_pathspecs_one_by_one(paths, specs):
+    for spec, negate in specs:
+        paths = list(spec.match_files(paths, negate=negate))
+    return paths
+
+
+def test_compiled_pathspecs():
+    specs = make_pathspecs(exclude_git=["*.pyc", "build/", "!keep.pyc"])
+    compiled = get_compiled_pathspecs(specs)
+    # compiled specs are cached by their patterns
+    specs_again = make_pathspecs(exclude_git=["*.pyc", "build/", "!keep.pyc"])
+    assert get_compiled_pathspecs(specs_again) is compiled
+    paths = ["/a.py", "/a.pyc", "/build/", "/src/build/x.py", "/keep.pyc", "/x.pyc/y.txt"]
+    assert compiled.match_many(paths) == [True, False, False, False, True, False]
+    assert compiled.filter(paths) == ["/a.py", "/keep.pyc"]
+    assert compiled.match("/b.py")
+    assert len(compiled) == 1
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning:pathspec")
+def test_compiled_pathspecs_same_as_pathspec():
+    rng = random.Random(0)
+    parts = ["a", "b.pyc", "build", "x.log", "keep.log", ".pyc", "c.tar.gz", "src", "", "\n"]
+    git_patterns = ["*.pyc", "*.log", "build/", "!keep.log", "/a", "a/**/b.pyc", "**/src"]
+    git_patterns += ["*.tar.gz", "!*.py", "*", "c*", "b.*", "/build/", "#comment", "", "[ab]*"]
+    regex_patterns = [r"\.py$", r"^a/", r"(x)\1", r"(?P<n>b)", r"(?i)BUILD", "log"]
+    for _ in range(500):
+        kwargs = {}
+        for key in ["include_git", "exclude_git"]:
+            if rng.random() < 0.6:
+                kwargs[key] = rng.sample(git_patterns, rng.randint(1, 5))
+        for key in ["include_regex", "exclude_regex"]:
+            if rng.random() < 0.2:
+                kwargs[key] = rng.sample(regex_patterns, rng.randint(1, 3))
+        specs = make_pathspecs(**kwargs)
+        paths = [
+            rng.choice(["/", "", "./", "//"])
+            + "/".join(rng.choice(parts) for _ in range(rng.randint(1, 4)))
+            + rng.choice(["", "/"])
+            for _ in range(20)
+        ]
+        assert apply_pathspecs(paths, specs) == _apply_pathspecs_one_by_one(paths, specs), kwargs
+
+
+class _EndsWithPattern(Pattern):
+    """Pattern that is not regex based, so it can not be compiled."""
+
+    def __init__(self, suffix: str, include: bool = True):
+        super().__init__(include)
+        self.suffix = suffix
+
+    def match_file(self, file):
+        return file if file.endswith(self.suffix) else None
+
+
+class _MatchOncePattern(RegexPattern):
+    """Regex pattern that overrides the matching."""
+
+    def match_file(self, file):
+        return super().match_file(file) if file.count("/") == 0 else None
+
+
+def test_compiled_pathspecs_fallback():
+    paths = ["/a.py", "/a.pyc", "/sub/b.pyc", "/keep.pyc", "/x.log"]
+    specs = make_pathspecs(exclude_git=["*.log"])
+    specs.append((PathSpec([_EndsWithPattern(".pyc"), _EndsWithPattern("keep.pyc", False)]), True))
+    specs.append((PathSpec([_MatchOncePattern(r"^a\.")]), True))
+    compiled = get_compiled_pathspecs(specs)
+    assert compiled.filter(paths) == ["/keep.pyc"]
+    assert compiled.filter(paths) == _apply_pathspecs_one_by_one(paths, specs)
+    assert get_compiled_pathspecs(specs).specs[0] is compiled.specs[0]
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning:pathspec")
+def test_compiled_pathspecs_regex_forms():
+    """The compiled specs depend on the regexes of pathspec, check the supported forms."""
+    regexes = {
+        pattern: p_patterns.GitWildMatchPattern(pattern).regex.pattern
+        for pattern in ["*.pyc", "build/", "/a", "a/**/b"]
+    }
+    assert all(regex.startswith("^") for regex in regexes.values())
+    if _PATHSPEC_SEARCHES_REGEX:
+        # pathspec >= 1.0, "*.ext" patterns are matched as suffixes
+        assert _GIT_SUFFIX_REGEX.fullmatch(regexes["*.pyc"]).group(1) == r"\.pyc"
+        assert RegexPattern("b").match_file("ab") is not None
+    else:
+        assert RegexPattern("b").match_file("ab") is None
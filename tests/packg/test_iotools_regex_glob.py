@@ -5,6 +5,7 @@ from pathlib import Path
 
 import pytest
 
+from packg.iotools import file_indexer
 from packg.iotools.file_indexer import regex_glob
 
 
@@ -81,3 +82,48 @@ def test_invalid_regex(test_dir):
     with pytest.raises(re.error):
         # note how generator must be turned into list in order to run and trigger the error.
         list(regex_glob(test_dir, "[invalid_pattern"))
+
+
+@pytest.mark.parametrize(
+    "glob_pattern",
+    ["**/*", "*", "**", "*/", "**/*.txt", "subdir/*", "subdir/**", "*/*.txt", "missing/*"],
+)
+def test_glob_pattern_same_as_pathlib(test_dir, glob_pattern):
+    expected = sorted(p.as_posix() for p in test_dir.glob(glob_pattern))
+    results = regex_glob(test_dir, r"", glob_pattern=glob_pattern, return_as_posix_str=True)
+    assert sorted(results) == expected
+
+
+def test_regex_prefix_pruning(test_dir, monkeypatch):
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(Path(path))
+        return scandir(path)
+
+    monkeypatch.setattr(file_indexer.os, "scandir", counting_scandir)
+    results = list(regex_glob(test_dir, f"^{re.escape(test_dir.as_posix())}/subdir/.*"))
+    assert results == [test_dir / "subdir" / "other_file.txt"]
+    assert listed == [test_dir, test_dir / "subdir"]
+
+    # results are yielded before the subdirectories are listed
+    listed.clear()
+    next(iter(regex_glob(test_dir, r".*", glob_pattern="**/*.txt")))
+    assert listed == [test_dir]
+
+
+@pytest.mark.parametrize(
+    "pattern, prefix",
+    [
+        (r"^/data/images/.*\.jpg$", "/data/images/"),
+        (r"\A/data/\.cache/x", "/data/.cache/x"),
+        (r"^/data/imagesx*", "/data/images"),
+        (r"^/data/(train|val)/", ""),
+        (r"/data/images/", ""),
+        (r"^/data/a|^/other", ""),
+        (r"^/data/\d+/", "/data/"),
+    ],
+)
+def test_get_regex_literal_prefix(pattern, prefix):
+    assert file_indexer._get_regex_literal_prefix(re.compile(pattern)) == prefix